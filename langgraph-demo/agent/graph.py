@@ -5,43 +5,80 @@ from .state import AgentState # Import state definition
 from .nodes import ( # Import node logic functions
     retrieve_schema_node,
     generate_sql_node,
+    repair_sql_node,
     execute_sql_node,
     generate_response_node,
     handle_error_node,
     should_execute_sql,
     should_generate_response,
+    should_sanitize_response,
     sanitize_prompt_node,
     llm_classify_intent_few_shot,
     route_based_on_intent,
-    sanitize_model_response_node
+    sanitize_model_response_node,
+    contextualize_question_node,
+    record_turn_node,
+    answer_from_cache_node,
+    route_after_local_answer,
+    route_after_sanitize_prompt
 )
+from .sessions import CHECKPOINTER
+from utils.log import get_logger
 
+logger = get_logger(__name__)
 
-print("Defining agent graph...")
+logger.debug("Defining agent graph...")
 
 # Create a new state graph instance with the AgentState structure
 workflow = StateGraph(AgentState)
 workflow.add_node("sanitize_prompt", sanitize_prompt_node)
+workflow.add_node("contextualize_question", contextualize_question_node)
 workflow.add_node("classify_intent",llm_classify_intent_few_shot)
 # Add nodes to the graph. Each node corresponds to a function imported from nodes.py
+workflow.add_node("answer_from_cache", answer_from_cache_node)
 workflow.add_node("retrieve_schema", retrieve_schema_node)
 workflow.add_node("generate_sql", generate_sql_node)
+workflow.add_node("repair_sql", repair_sql_node)
 workflow.add_node("execute_sql", execute_sql_node)
 workflow.add_node("generate_response", generate_response_node)
 workflow.add_node("handle_error", handle_error_node)
 workflow.add_node("sanitize_response", sanitize_model_response_node)
+workflow.add_node("record_turn", record_turn_node)
 
 # Define the entry point of the graph
 workflow.set_entry_point("sanitize_prompt")
 # Define the edges (transitions between nodes)
-workflow.add_edge("sanitize_prompt", "classify_intent")
+# Conditional edge after prompt sanitization: continue (follow-ups are rewritten using the session history),
+# or stop if Model Armor shed the request or the deadline passed
+workflow.add_conditional_edges(
+    "sanitize_prompt",
+    route_after_sanitize_prompt,
+    {
+        "contextualize_question": "contextualize_question",
+        "handle_error": "handle_error"
+    }
+)
+workflow.add_edge("contextualize_question", "classify_intent")
 
 workflow.add_conditional_edges(
     "classify_intent",
     route_based_on_intent,
     {
         "generate_direct_response":"generate_response",
-        "retrieve_schema":"retrieve_schema"
+        "retrieve_schema":"retrieve_schema",
+        "answer_from_cache":"answer_from_cache", # Follow-up with cached result sets in this session
+        "handle_error":"handle_error" # Classification failed or the deadline passed
+    }
+)
+
+# Conditional edge after local planning: answer from the cached result sets, or go to BigQuery as usual
+workflow.add_conditional_edges(
+    "answer_from_cache",
+    route_after_local_answer,
+    {
+        "generate_response": "generate_response",
+        "retrieve_schema": "retrieve_schema",
+        "handle_error": "handle_error"
     }
 )
 
@@ -55,28 +92,50 @@ workflow.add_conditional_edges(
     should_execute_sql, # Function to determine the next step
     {
         "execute_sql": "execute_sql",   # If SQL generated, go to execute_sql
+        "repair_sql": "repair_sql",     # If the validator rejected it, try to repair it
         "handle_error": "handle_error" # If error or no SQL, go to handle_error
     }
 )
 
+# Conditional edge after SQL repair: same choices as after generation (bounded by SQL_REPAIR_MAX_ATTEMPTS)
+workflow.add_conditional_edges(
+    "repair_sql",
+    should_execute_sql,
+    {
+        "execute_sql": "execute_sql",
+        "repair_sql": "repair_sql",
+        "handle_error": "handle_error"
+    }
+)
+
 # Conditional edge after SQL execution: decide whether to generate response or handle error
 workflow.add_conditional_edges(
     "execute_sql",
     should_generate_response, # Function to determine the next step
     {
         "generate_response": "generate_response", # If results obtained, go to generate_response
+        "repair_sql": "repair_sql",                # If BigQuery rejected the query, try to repair it
         "handle_error": "handle_error"      # If execution failed, go to handle_error
     }
 )
 
 # Edges leading to the end of the graph
-workflow.add_edge("generate_response", "sanitize_response") 
-workflow.add_edge("sanitize_response", END) # Successful response generation ends the graph
-workflow.add_edge("handle_error", END)      # Error handling also ends the graph
+# Conditional edge after response generation: sanitize the answer, or handle error (e.g. deadline passed)
+workflow.add_conditional_edges(
+    "generate_response",
+    should_sanitize_response,
+    {
+        "sanitize_response": "sanitize_response",
+        "handle_error": "handle_error"
+    }
+)
+workflow.add_edge("sanitize_response", "record_turn") # Successful response generation ends the turn
+workflow.add_edge("handle_error", "record_turn")      # Error handling also ends the turn
+workflow.add_edge("record_turn", END)                 # The turn is saved to the session history
 
-# Compile the graph into a runnable application
-app = workflow.compile()
+# Compile the graph into a runnable application; the checkpointer persists state per session (thread_id)
+app = workflow.compile(checkpointer=CHECKPOINTER)
 
-print("Agent graph compiled successfully.")
+logger.info("Agent graph compiled successfully.")
 
 # The compiled 'app' object can now be imported and used in main.py
\ No newline at end of file
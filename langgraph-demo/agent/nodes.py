@@ -1,31 +1,61 @@
 from .state import AgentState # Relative import
-from tools.retriever import retrieve_relevant_schema, SCHEMA_DESCRIPTION_LOOKUP # Import function and potentially the loaded lookup
+from tools.retriever import retrieve_relevant_schema, get_schema_state, embed_query # Import function and the current schema state
+from tools.example_store import get_example_store, select_examples, format_examples
+from tools.sql_validator import validate_sql, format_validation_errors
+from tools.result_cache import RESULT_SETS, LOCAL_ENGINE_AVAILABLE, describe_result_sets, check_local_sql, run_local_query
 from tools.bigquery_executor import execute_bq_query
+from tools.answer_templates import render_answer
 #from tools.llm_services import get_sql_generation_chain, get_response_generation_chain # Example: Get chains
 import config
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from tools.llm_services import llm
+from tools.llm_services import invoke_llm
 from tools.bigquery_executor import bq_client
 import json
 import re
+import time
+from typing import Optional, List, Dict, Any
 from tools.model_armor import ModelArmorPipeline
 from google.cloud import modelarmor_v1
+from utils.resilience import call_with_resilience, remaining_seconds, DeadlineExceededError, BackendBusyError
+from utils.metrics import METRICS
+from utils.request_log import annotate
+from utils.single_flight import SingleFlight
+from utils.usage import check_cost_budget, record_bigquery
+from utils.log import get_logger
+from utils.tenants import get_tenant
+from .sessions import append_turn, compact_turn
+from google.cloud import bigquery
+from google.api_core import exceptions as google_exceptions
+
+logger = get_logger(__name__)
 
 # Ensure lookup data is available (might need better handling if loading fails)
-if not SCHEMA_DESCRIPTION_LOOKUP:
-     print("[WARN] nodes.py: SCHEMA_DESCRIPTION_LOOKUP is empty.")
+if not get_schema_state().lookup:
+     logger.warning("Schema lookup is empty.")
      # Raise error or handle appropriately
 
 #Instantiate the Model Armor
 pipeline = ModelArmorPipeline()
+
+def _deadline_passed(state: AgentState) -> bool:
+    budget = remaining_seconds(state.get("deadline"))
+    return budget is not None and budget <= 0
+
+def _timeout_update(stage: str, error: Optional[Exception] = None) -> dict:
+    """State update for a request whose deadline passed at `stage` (or was shed by admission control)."""
+    if isinstance(error, BackendBusyError):
+        logger.warning("Request shed during %s: %s", stage, error)
+        return {"error_message": str(error), "timed_out": True, "busy_backend": error.service}
+    logger.warning("Request deadline exceeded during %s.", stage)
+    return {"error_message": f"The request ran out of time during {stage}.", "timed_out": True}
+
 # --- Node Functions ---
 
 def sanitize_prompt_node(state: AgentState) -> dict:
     """Node that sanitizes input and updates the question field in the state."""
-    print("--- Sanitizing Prompt ---")
+    logger.debug("Sanitizing prompt")
     original_question = state["question"]
-    print(f"Original question received: '{original_question}'")
+    logger.debug("Original question received: '%s'", original_question)
     
     # Initialize the dictionary for updates to the state
     # It's good practice to also store the original_question separately if needed later for comparison/logging
@@ -33,7 +63,7 @@ def sanitize_prompt_node(state: AgentState) -> dict:
     
     try:
         # Perform sanitization
-        response = pipeline.sanitize_prompt(prompt=original_question)
+        response = pipeline.sanitize_prompt(prompt=original_question, deadline=state.get("deadline"))
         
         # For robust debugging, let's check the type and value of filter_match_state
         match_state = response.sanitization_result.filter_match_state
@@ -53,7 +83,7 @@ def sanitize_prompt_node(state: AgentState) -> dict:
         else:
             # Prompt is considered "clean" by the sanitizer, or the specific filter (match_state == 2) was not triggered.
             # In this case, the 'question' for the next node should be the original, unaltered question.
-            print(f"Prompt deemed clean or no specific sanitization rule matched (match_state == {match_state}). Using original question: '{original_question}'")
+            logger.debug("Prompt deemed clean or no specific sanitization rule matched (match_state == %s). Using original question.", match_state)
             update.update({
                 "question": original_question, # Explicitly set 'question' to the original for the next node
                 "is_safe": True
@@ -62,8 +92,10 @@ def sanitize_prompt_node(state: AgentState) -> dict:
             
         return update # Return the dictionary of changes to be merged into the AgentState
             
+    except DeadlineExceededError as e: # Shed by admission control or out of time: end with the busy/timeout answer
+        return {**update, "question": original_question, **_timeout_update("prompt sanitization", e)}
     except Exception as e:
-        print(f"Error during sanitization process: {str(e)}")
+        logger.error("Error during sanitization process: %s", e)
         # In case of any error during sanitization, fallback to using the original question
         # and flag it as not safe due to the processing error.
         return {
@@ -75,10 +107,15 @@ def sanitize_prompt_node(state: AgentState) -> dict:
     
 def sanitize_model_response_node(state: AgentState) -> dict:
     """Node that sanitizes output and updates the final response field in the state."""
-    print("--- Sanitizing Model Response ---")
+    logger.debug("Sanitizing model response")
     original_response = state["final_response"]
-    print(f"Original response received: '{original_response}'")
-    sanitized_response=pipeline.sanitize_response(response=original_response)
+    logger.debug("Original response received: '%s'", original_response)
+    try:
+        sanitized_response=pipeline.sanitize_response(response=original_response, deadline=state.get("deadline"))
+    except Exception as e:
+        # Degrade gracefully (e.g. Model Armor breaker open): keep the answer, flag it as unchecked
+        logger.error("Error during response sanitization: %s", e)
+        return {"safe": False, "original_response": original_response}
     if sanitized_response.sanitization_result.filter_match_state == 2:
         return {
             "safe": False,
@@ -87,11 +124,80 @@ def sanitize_model_response_node(state: AgentState) -> dict:
         }
     return {"safe": True, "original_response": original_response}
 
+def _format_history(history: List[Dict[str, Any]]) -> str:
+    """Renders previous turns compactly for prompts (question, SQL and a few result rows)."""
+    blocks = []
+    for number, turn in enumerate(history, start=1):
+        preview = json.dumps(turn.get("results_preview", [])[:5], default=str)
+        blocks.append(
+            f"Turn {number}:\nQuestion: {turn.get('question')}\nSQL: {turn.get('sql_query') or 'none'}\n"
+            f"Result ({turn.get('row_count', 0)} rows, first rows): {preview}"
+        )
+    return "\n\n".join(blocks)
+
+def contextualize_question_node(state: AgentState) -> dict:
+    """
+    Rewrites a follow-up ("and for Tampines?") into a standalone question using
+    the session history, and decides whether the previous turn's schema context
+    can be reused instead of running retrieval again.
+    """
+    history = state.get("history") or []
+    if not history:
+        return {"is_followup": False, "reuse_schema_context": False}
+    if _deadline_passed(state):
+        return _timeout_update("follow-up rewriting")
+    logger.debug("Contextualizing question")
+
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", """You rewrite follow-up questions in a conversation about sales data into standalone questions.
+Given the previous turns and the new question, respond with only a JSON object:
+{{"followup": true or false, "question": "<standalone question>", "same_schema": true or false}}
+
+* "followup" is true if the new question depends on the previous turns (e.g. "and for Tampines?", "break that down by FY", "only the top 3").
+* "question" is the new question rewritten so it can be understood without the conversation. If it is not a follow-up, repeat it unchanged.
+* "same_schema" is true if the tables and columns used by the most recent SQL are enough to answer the rewritten question.
+
+Previous turns:
+{history}
+"""),
+        ("user", "New question: {question}")
+    ])
+    try:
+        raw_output = invoke_llm(
+            "contextualize_question", prompt, {"history": _format_history(history), "question": state["question"]},
+            deadline=state.get("deadline")
+        )
+        rewrite = json.loads(extract_sql_from_markdown(raw_output)) # Strips a ```json fence if present
+    except DeadlineExceededError as e:
+        return _timeout_update("follow-up rewriting", e)
+    except Exception as e:
+        # Fall back to treating the question as standalone
+        logger.warning("Could not rewrite follow-up question: %s", e)
+        return {"is_followup": False, "reuse_schema_context": False}
+
+    if not rewrite.get("followup") or not str(rewrite.get("question", "")).strip():
+        return {"is_followup": False, "reuse_schema_context": False}
+    standalone_question = str(rewrite["question"]).strip()
+    logger.debug("Follow-up rewritten as: '%s'", standalone_question)
+    METRICS.increment("followup_questions")
+    return {
+        "question": standalone_question,
+        "is_followup": True,
+        # A context retrieved from an older schema version is not reused: the schema was reloaded since
+        "reuse_schema_context": bool(rewrite.get("same_schema")) and bool(history[-1].get("schema_context"))
+                                and history[-1].get("schema_version") == get_schema_state(state.get("tenant")).version,
+    }
+
+def record_turn_node(state: AgentState) -> dict:
+    """Appends the finished turn to the bounded session history (persisted by the checkpointer)."""
+    return {"history": append_turn(state.get("history"), compact_turn(state))}
+
 def llm_classify_intent_few_shot(state: AgentState) -> dict:
     """
-    Simulates an LLM call for few-shot intent classification.
-    Replace this with an actual LLM call in your application.
+    Classifies the user's intent with a few-shot LLM prompt.
     """
+    if _deadline_passed(state):
+        return _timeout_update("intent classification")
     intent_categories = ["DATABASE_QUERY", "GENERAL_QUESTION"]
     
     # Construct the few-shot prompt
@@ -125,8 +231,7 @@ def llm_classify_intent_few_shot(state: AgentState) -> dict:
     # ---- SIMULATED LLM RESPONSE ----
     # In a real application, you would invoke your LLM here:
     try:
-        response = llm.invoke(prompt_template)
-        classification_result = response.content.strip()
+        classification_result = invoke_llm("classify_intent", prompt_template, deadline=state.get("deadline")).strip()
         if classification_result == "GENERAL_QUESTION":
             state["query_results"]=[]
         elif classification_result=="DATABASE_QUERY":
@@ -137,52 +242,167 @@ def llm_classify_intent_few_shot(state: AgentState) -> dict:
         return state
     
     #state["intent_type"]=classification_result
+    except DeadlineExceededError as e:
+        return _timeout_update("intent classification", e)
     except Exception as e:
         return {
-            "question":"question",
-            "intent_type": state["intent_type"],
+            "intent_type": state.get("intent_type"),
             "error_message": f"Intent classification error: {str(e)}"
         }
 
+def route_after_sanitize_prompt(state: AgentState) -> str:
+    """Stops a request that was shed or ran out of time at Model Armor before any LLM or BigQuery call."""
+    return "handle_error" if state.get("timed_out") else "contextualize_question"
+
 def route_based_on_intent(state: AgentState) -> str:
+    if state.get("error_message") and not state.get("intent_type"):
+        logger.warning("Classification failed: %s. Routing to error handler.", state['error_message'])
+        return "handle_error"
     intent = state["intent_type"]
-    print(f"Conditional Edge Check: Intent is '{intent}'")
+    logger.debug("Conditional edge check: intent is '%s'", intent)
     if intent == "GENERAL_QUESTION":
         return "generate_direct_response"  # New name for clarity
     elif intent == "DATABASE_QUERY":
+        if state.get("is_followup") and LOCAL_ENGINE_AVAILABLE and RESULT_SETS.get(state.get("session_id")):
+            return "answer_from_cache" # Try the cached result sets before BigQuery
         return "retrieve_schema"
     else:
         # Fallback: if intent is unclear, perhaps default to general or error
-        print(f"Warning: Unknown intent '{intent}'. Defaulting to general response.")
+        logger.warning("Unknown intent '%s'. Defaulting to general response.", intent)
         return "generate_direct_response"
     
+def _record_followup_answer(source: str) -> None:
+    """Counts how a follow-up was answered and updates the local-answer rate gauge."""
+    METRICS.increment("followup_answers", source=source)
+    local = METRICS.counter("followup_answers", source="local")
+    remote = METRICS.counter("followup_answers", source="bigquery")
+    METRICS.set_gauge("followup_local_answer_rate", local / (local + remote))
+
+def answer_from_cache_node(state: AgentState) -> dict:
+    """
+    Plans a follow-up against the session's cached result sets. If the question
+    is a drill-down on them (sort, filter, top N, re-aggregate), it is answered
+    with a local DuckDB query over the Arrow tables; otherwise retrieval and
+    BigQuery run as usual.
+    """
+    logger.debug("Planning local answer")
+    if _deadline_passed(state):
+        return _timeout_update("local answer planning")
+    result_sets = RESULT_SETS.get(state.get("session_id"))
+    if not result_sets:
+        return {}
+    start_time = time.perf_counter()
+
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", """You decide whether a follow-up question can be answered from previous query results alone.
+The previous results are available as DuckDB tables (result_1 is the most recent):
+{result_sets}
+
+If the question can be answered ONLY by sorting, filtering, limiting, or aggregating these tables (for example "sort by quantity", "only the top 3", "just the Tampines store", "what is the total"), output a single DuckDB SELECT query over these tables.
+If it needs any data or columns not present in these tables, output exactly REMOTE.
+Only output the query or REMOTE, without explanations or markdown formatting.
+"""),
+        ("user", "Follow-up question: {question}")
+    ])
+    try:
+        plan = invoke_llm(
+            "answer_from_cache", prompt,
+            {"result_sets": describe_result_sets(result_sets), "question": state["question"]},
+            deadline=state.get("deadline")
+        )
+        local_sql = extract_sql_from_markdown(plan)
+        if not local_sql or local_sql.strip().upper().startswith("REMOTE"):
+            logger.debug("Follow-up needs BigQuery.")
+            return {}
+        problem = check_local_sql(local_sql, list(result_sets))
+        if problem:
+            logger.warning("Local plan rejected (%s). Falling back to BigQuery.", problem)
+            return {}
+        query_start = time.perf_counter()
+        records = run_local_query(local_sql, result_sets)
+        METRICS.observe("local_query_seconds", time.perf_counter() - query_start)
+    except DeadlineExceededError as e:
+        return _timeout_update("local answer planning", e)
+    except Exception as e:
+        logger.warning("Local answer failed (%s). Falling back to BigQuery.", e)
+        return {}
+
+    METRICS.observe("local_answer_seconds", time.perf_counter() - start_time)
+    _record_followup_answer("local")
+    logger.info("Answered locally with %d records: %s", len(records), local_sql)
+    RESULT_SETS.add(state.get("session_id"), state["question"], records) # Further drill-downs can build on it
+    previous_turn = (state.get("history") or [{}])[-1]
+    return {
+        "query_results": records[:50],
+        "local_sql": local_sql,
+        "answer_source": "local",
+        # Keep the BigQuery lineage for later follow-ups that need fresh data
+        "sql_query": previous_turn.get("sql_query"),
+        "schema_context": previous_turn.get("schema_context"),
+        "schema_version": previous_turn.get("schema_version"),
+    }
+
+def route_after_local_answer(state: AgentState) -> str:
+    """After planning: answer from the local result, or continue to retrieval and BigQuery."""
+    if state.get("timed_out"):
+        return "handle_error"
+    if state.get("answer_source") == "local":
+        return "generate_response"
+    return "retrieve_schema"
+
 def retrieve_schema_node(state: AgentState) -> dict:
     """Retrieves relevant schema context using RAG."""
-    print("--- Retrieving Schema ---")
+    logger.debug("Retrieving schema")
     #print('question to schema step:',state["question"])
     question = state["question"]
+    if _deadline_passed(state):
+        return _timeout_update("schema retrieval")
+    if state.get("reuse_schema_context"):
+        # Follow-up on the same tables: reuse the previous turn's context instead of retrieving again
+        METRICS.increment("schema_context_reused")
+        return {"schema_context": state["history"][-1]["schema_context"], "schema_version": state["history"][-1].get("schema_version")}
     try:
-        # Replace with your actual endpoint name from GCP console
-        vector_search_endpoint = config.VECTOR_SEARCH_INDEX_ENDPOINT_NAME
-        deployed_index_id = config.VECTOR_SEARCH_DEPLOYED_INDEX_ID
+        tenant = get_tenant(state.get("tenant"))
+        schema_state = get_schema_state(tenant.name) # Pinned for this request, so the reported version is the one used
+        # The tenant's endpoint (by default the shared one, queried with a tenant filter)
+        vector_search_endpoint = tenant.index_endpoint
+        deployed_index_id = tenant.deployed_index_id
         # Ensure retrieve_relevant_schema is correctly implemented (Step 3.5)
-        schema_context = retrieve_relevant_schema(question, vector_search_endpoint, deployed_index_id, num_results=5)
+        schema_context = retrieve_relevant_schema(question, vector_search_endpoint, deployed_index_id, deadline=state.get("deadline"),
+                                                  schema_state=schema_state, tenant=tenant.name)
         if not schema_context:
-            print("Warning: No relevant schema found.")
-            schema_context = "No specific schema context found. Please use general knowledge of the tables: stores, products, sales_transactions."
-        return {"schema_context": schema_context}
+            logger.warning("No relevant schema found.")
+            schema_context = ("No specific schema context found. Please use general knowledge of the tables: "
+                              f"{', '.join(sorted(schema_state.catalog.tables))}.")
+        return {"schema_context": schema_context, "schema_version": schema_state.version}
     except Exception as e:
-        print(f"Error retrieving schema: {e}")
+        logger.error("Error retrieving schema: %s", e)
         return {"error_message": f"Failed to retrieve schema information: {e}"}
 
 def generate_sql_node(state: AgentState) -> dict:
     """Generates SQL query using the LLM."""
-    print("--- Generating SQL ---")
+    logger.debug("Generating SQL")
     question = state["question"]
     schema_context = state["schema_context"]
-    print('schema_context used:', schema_context)
+    logger.debug("Schema context used: %s", schema_context)
     if not schema_context: # Handle case where schema retrieval failed silently
         return {"error_message": "Cannot generate SQL without schema context."}
+    if _deadline_passed(state):
+        return _timeout_update("SQL generation")
+    # Text from the schema, the session and the example store is passed as template variables,
+    # so braces in it (struct literals, regex quantifiers, JSON) are not read as placeholders
+    inputs = {"schema_context": schema_context, "question": question}
+    previous_sql_note = ""
+    if state.get("is_followup") and (state.get("history") or [{}])[-1].get("sql_query"):
+        # Follow-ups usually refine the previous query (new filter, breakdown, ordering)
+        previous_sql_note = "\n\nThis is a follow-up. SQL used for the previous question:\n{previous_sql}"
+        inputs["previous_sql"] = state["history"][-1]["sql_query"]
+    tenant = get_tenant(state.get("tenant"))
+    examples = _few_shot_examples(state)
+    examples_section = ""
+    if examples:
+        examples_section = "\n\nVerified examples of similar questions and their SQL (adapt them, do not copy blindly):\n{examples}"
+        inputs["examples"] = format_examples(examples)
 
     prompt = ChatPromptTemplate.from_messages([
         ("system", f"""You are an expert Google BigQuery SQL generator. Based ONLY on the provided schema context and the user's question, generate a valid BigQuery SQL query.
@@ -210,7 +430,7 @@ Key Guidelines:
     * You are capable of generating complex SQL. If the question requires rankings (like "top N"), period-over-period comparisons, or calculations within specific partitions, use Common Table Expressions (CTEs) and Window Functions (e.g., `ROW_NUMBER() OVER (PARTITION BY ... ORDER BY ...)` , `SUM(...) OVER (...)`) as appropriate.
 
 6.  **Table Naming:**
-    * The relevant tables, if determined to be needed from the 'Schema Context', are `{config.GCP_PROJECT_ID}.{config.BIGQUERY_DATASET_ID}.stores`, `{config.GCP_PROJECT_ID}.{config.BIGQUERY_DATASET_ID}.products`, and `{config.GCP_PROJECT_ID}.{config.BIGQUERY_DATASET_ID}.sales_transactions`. ALWAYS use these fully qualified names.
+    * The tables in the 'Schema Context' are in the dataset `{tenant.project}.{tenant.dataset}`. ALWAYS use fully qualified names in the form `{tenant.table_name('table_name')}`.
 
 7.  **Schema Adherence:**
     * ONLY use tables and columns mentioned in the 'Schema Context' section. Do not infer or use any tables/columns not listed there.
@@ -225,25 +445,166 @@ Key Guidelines:
     * If the user's question is highly ambiguous even after applying these guidelines (e.g., a critical filter value is entirely unclear and cannot be reasonably inferred from the question or schema context), output 'NO_QUERY'.
 
 Schema Context:
-{schema_context}
+{{schema_context}}{examples_section}
 """),
-        ("user", f"User Question: {question}")
+        ("user", "User Question: {question}" + previous_sql_note)
     ])
-    sql_generator_chain = prompt | llm | StrOutputParser()
-
     try:
-        sql_query = sql_generator_chain.invoke({}) # Pass context implicitly via prompt
-        print(f"Generated SQL attempt: {sql_query}")
+        sql_query = invoke_llm("generate_sql", prompt, inputs, deadline=state.get("deadline"))
+        logger.info("Generated SQL attempt: %s", sql_query)
         if "NO_QUERY" in sql_query or not sql_query.strip():
-             return {"error_message": "Could not generate a SQL query for this question."}
-        # Basic validation (can be improved)
-        if not ("SELECT" in sql_query.upper() and "FROM" in sql_query.upper()):
-             return {"error_message": f"Invalid SQL generated: {sql_query}"}
-        return {"sql_query": sql_query.strip()}
+             return {"error_message": "Could not generate a SQL query for this question.", "few_shot_examples": len(examples)}
+        # Local validation against the schema catalog (milliseconds, no BigQuery round trip)
+        validation_errors = validate_sql(
+            extract_sql_from_markdown(sql_query), get_schema_state(tenant.name).catalog, tenant.project, tenant.dataset
+        )
+        if validation_errors:
+            logger.warning("Generated SQL failed validation:\n%s", format_validation_errors(validation_errors))
+            update = _sql_error_update(state, sql_query.strip(), format_validation_errors(validation_errors),
+                                       "Invalid SQL generated", validation_errors)
+            update["few_shot_examples"] = len(examples)
+            return update
+        return {"sql_query": sql_query.strip(), "sql_validation_errors": [], "few_shot_examples": len(examples)}
+    except DeadlineExceededError as e:
+        return _timeout_update("SQL generation", e)
     except Exception as e:
-        print(f"Error generating SQL: {e}")
+        logger.error("Error generating SQL: %s", e)
         return {"error_message": f"LLM failed to generate SQL: {e}"}
+
+def _few_shot_examples(state: AgentState) -> List[Dict[str, Any]]:
+    """Verified (question, SQL) pairs similar to the question (tools/example_store.py); none if the lookup fails."""
+    if not config.FEW_SHOT_ENABLED:
+        return []
+    try:
+        embedding = embed_query(state["question"], "generate_sql", deadline=state.get("deadline"))
+        return select_examples(embedding, get_schema_state(state.get("tenant")), tenant=state.get("tenant"))
+    except Exception as e:
+        logger.warning("Few-shot example lookup failed; generating SQL without examples: %s", e)
+        return []
+
+def _add_verified_example(state: AgentState, sql: str) -> None:
+    """Stores a question whose SQL ran and returned rows as a few-shot example for similar questions."""
+    if not config.FEW_SHOT_ENABLED:
+        return
+    try:
+        embedding = embed_query(state["question"], "execute_sql", deadline=state.get("deadline")) # Usually cached by generate_sql
+        get_example_store(state.get("tenant")).add(state["question"], sql, embedding)
+    except Exception as e:
+        logger.warning("Could not store the few-shot example: %s", e)
+
+def _record_sql_outcome(state: AgentState, answered: bool) -> None:
+    """
+    Counts how a question that reached SQL generation ended (answered on the
+    first attempt, answered after repairs, or failed), by whether its prompt
+    had few-shot examples, and updates the first-attempt success rate and the
+    mean attempts per answered question. Each repair avoided saves an LLM call
+    and a BigQuery round trip.
+    """
+    few_shot = "yes" if state.get("few_shot_examples") else "no"
+    attempts = (state.get("repair_attempts") or 0) + 1
+    if answered:
+        METRICS.increment("sql_questions", outcome="first_attempt" if attempts == 1 else "repaired", few_shot=few_shot)
+        METRICS.increment("sql_answer_attempts", attempts, few_shot=few_shot)
+    else:
+        METRICS.increment("sql_questions", outcome="failed", few_shot=few_shot)
+    counts = {outcome: sum(METRICS.counter("sql_questions", outcome=outcome, few_shot=label) for label in ("yes", "no"))
+              for outcome in ("first_attempt", "repaired", "failed")}
+    METRICS.set_gauge("sql_first_attempt_success_rate", counts["first_attempt"] / sum(counts.values()))
+    answered_count = counts["first_attempt"] + counts["repaired"]
+    if answered_count:
+        total_attempts = sum(METRICS.counter("sql_answer_attempts", few_shot=label) for label in ("yes", "no"))
+        METRICS.set_gauge("sql_attempts_per_answer", total_attempts / answered_count)
     
+def _sql_error_update(state: AgentState, sql_query: str, sql_error: str, summary: str,
+                      validation_errors: Optional[List[Dict[str, str]]] = None) -> dict:
+    """State update for a SQL query rejected by the validator or BigQuery; routes to repair_sql if attempts remain."""
+    return {
+        "sql_query": sql_query,
+        "sql_validation_errors": validation_errors or [],
+        "sql_error": sql_error,
+        "first_sql_error_at": state.get("first_sql_error_at") or time.time(),
+        "error_message": f"{summary}:\n{sql_error}",
+    }
+
+def repair_sql_node(state: AgentState) -> dict:
+    """
+    Rewrites a failing SQL query using the validator or BigQuery error message.
+    Reuses the already retrieved schema context, so sanitization, classification
+    and retrieval are not run again.
+    """
+    attempt = (state.get("repair_attempts") or 0) + 1
+    logger.info("Repairing SQL (attempt %d/%d)", attempt, config.SQL_REPAIR_MAX_ATTEMPTS)
+    if _deadline_passed(state):
+        return _timeout_update("SQL repair")
+    METRICS.increment("sql_repair_attempts")
+    failing_sql = extract_sql_from_markdown(state["sql_query"])
+    tenant = get_tenant(state.get("tenant"))
+
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", f"""You are an expert Google BigQuery SQL engineer. A SQL query written for the user's question was rejected with the error below. Fix the query so that it answers the question and resolves the error.
+
+Rules:
+* ONLY use tables and columns mentioned in the 'Schema Context' section.
+* ALWAYS use fully qualified table names in the form `{tenant.table_name('table_name')}`.
+* The query must be a single read-only SELECT statement (CTEs are allowed).
+* Only output the corrected SQL query, without explanations, comments or markdown formatting.
+* If the question cannot be answered with the provided schema, output 'NO_QUERY'.
+
+Schema Context:
+{{schema_context}}
+"""),
+        ("user", "User Question: {question}\n\nFailing SQL:\n{failing_sql}\n\nError:\n{sql_error}")
+    ])
+    # Passed as template variables, so braces in the SQL, the error or the schema are not read as placeholders
+    inputs = {
+        "schema_context": state["schema_context"],
+        "question": state["question"],
+        "failing_sql": failing_sql,
+        "sql_error": state.get("sql_error"),
+    }
+    start_time = time.perf_counter()
+    try:
+        # Each failed attempt escalates to a stronger model tier (tools/llm_services.py)
+        repaired_sql = invoke_llm("repair_sql", prompt, inputs, deadline=state.get("deadline"), escalation=attempt)
+    except DeadlineExceededError as e:
+        return _timeout_update("SQL repair", e)
+    except Exception as e:
+        logger.error("Error repairing SQL: %s", e)
+        return {"repair_attempts": attempt, "sql_error": None, "error_message": f"LLM failed to repair SQL: {e}"}
+    finally:
+        METRICS.observe("sql_repair_seconds", time.perf_counter() - start_time)
+
+    logger.info("Repaired SQL attempt: %s", repaired_sql)
+    if "NO_QUERY" in repaired_sql or not repaired_sql.strip():
+        return {"repair_attempts": attempt, "sql_error": None, "error_message": "Could not repair the SQL query for this question."}
+    validation_errors = validate_sql(
+        extract_sql_from_markdown(repaired_sql), get_schema_state(tenant.name).catalog, tenant.project, tenant.dataset
+    )
+    if validation_errors:
+        update = _sql_error_update(state, repaired_sql.strip(), format_validation_errors(validation_errors),
+                                   "Repaired SQL is still invalid", validation_errors)
+        update["repair_attempts"] = attempt
+        return update
+    return {
+        "sql_query": repaired_sql.strip(),
+        "sql_validation_errors": [],
+        "sql_error": None,
+        "error_message": None,
+        "repair_attempts": attempt,
+    }
+
+def _record_repair_outcome(state: AgentState, succeeded: bool) -> None:
+    """
+    Records repair success and the latency saved compared with a full re-ask.
+    A re-ask repeats every stage up to the failure (started_at -> first_sql_error_at);
+    the repair path only costs the time since the first SQL error.
+    """
+    METRICS.increment("sql_repairs", outcome="success" if succeeded else "failed")
+    if succeeded and state.get("started_at") and state.get("first_sql_error_at"):
+        reask_seconds = state["first_sql_error_at"] - state["started_at"]
+        repair_seconds = time.time() - state["first_sql_error_at"]
+        METRICS.observe("sql_repair_latency_saved_seconds", reask_seconds - repair_seconds)
+
 def extract_sql_from_markdown(llm_output_string: str) -> str:
     """
     Extracts a SQL query from a string that might contain a Markdown code block.
@@ -273,9 +634,11 @@ def extract_sql_from_markdown(llm_output_string: str) -> str:
         # If no markdown block is found, assume the string is already the SQL query (or just needs stripping)
         return llm_output_string.strip()
     
+_BIGQUERY_FLIGHTS = SingleFlight("bigquery")
+
 def execute_sql_node(state: AgentState) -> dict:
     """Executes the SQL query against BigQuery."""
-    print("--- Executing SQL ---")
+    logger.debug("Executing SQL")
     sql_query = state["sql_query"]
     if not sql_query:
         return {"error_message": "No SQL query to execute."}
@@ -284,30 +647,87 @@ def execute_sql_node(state: AgentState) -> dict:
     # Clean the SQL query
     cleaned_sql_query = extract_sql_from_markdown(sql_query)
 
-    print(f"Original raw query: '{sql_query}'")
-    print(f"Cleaned SQL query: '{cleaned_sql_query}'")
+    logger.debug("Original raw query: '%s'", sql_query)
+    logger.debug("Cleaned SQL query: '%s'", cleaned_sql_query)
+
+    logger.info("Executing query: %s", cleaned_sql_query)
+
+    budget = remaining_seconds(state.get("deadline"))
+    if budget is not None and budget <= 0:
+        return _timeout_update("SQL execution")
+    # Let BigQuery itself stop the job when the request budget runs out
+    job_config = bigquery.QueryJobConfig(job_timeout_ms=int(budget * 1000)) if budget is not None else None
+    started_jobs = []
+    answered = [] # Set once a job's result is used; attempts still starting then cancel themselves
+
+    def run_query():
+        query_job = bq_client.query(cleaned_sql_query, job_config=job_config)
+        started_jobs.append(query_job)
+        if answered:
+            _cancel_jobs([query_job])
+        results = query_job.result(timeout=remaining_seconds(state.get("deadline"))) # Waits for the job to complete
+        # Convert results to a list of dictionaries for easier handling
+        return [dict(row) for row in results], query_job
 
-    print(f"Executing query: {cleaned_sql_query}")
+    def run_shared():
+        records, job = call_with_resilience("bigquery", run_query, deadline=state.get("deadline"))
+        answered.append(job)
+        # Attempts that timed out client-side and hedged duplicates keep running (and billing) unless cancelled
+        _cancel_jobs([other for other in started_jobs if other is not job])
+        return records, job
 
     try:
-        query_job = bq_client.query(cleaned_sql_query)
-        results = query_job.result() # Waits for the job to complete
-        # Convert results to a list of dictionaries for easier handling
-        records = [dict(row) for row in results]
-        print(f"Query returned {len(records)} records.")
-        print('records:',records)
+        check_cost_budget("execute_sql")
+        # Concurrent requests executing the same SQL share one job
+        (records, job), shared = _BIGQUERY_FLIGHTS.do(cleaned_sql_query, run_shared, state.get("deadline"))
+        records = list(records) # The shared list stays unchanged for the other requests
+        logger.info("Query returned %d records.", len(records))
+        if shared:
+            annotate(rows=len(records), bytes_processed=0, bytes_billed=0) # Billed to the request that ran the job
+        elif job is not None:
+            annotate(rows=len(records), bytes_processed=job.total_bytes_processed,
+                     bytes_billed=job.total_bytes_billed, bigquery_cache_hit=job.cache_hit)
+            record_bigquery("execute_sql", job.total_bytes_billed or 0)
+        logger.debug("Records: %s", records)
+        RESULT_SETS.add(state.get("session_id"), state["question"], records) # Full result set, for local drill-downs
         # Limit results passed to LLM if too large (optional)
         max_results_for_llm = 50
         if len(records) > max_results_for_llm:
-            print(f"Warning: Truncating results from {len(records)} to {max_results_for_llm} for LLM context.")
+            logger.warning("Truncating results from %d to %d for LLM context.", len(records), max_results_for_llm)
             # Consider summarizing large results instead of just truncating
             records = records[:max_results_for_llm]
 
-        return {"query_results": records}
+        if state.get("repair_attempts"):
+            _record_repair_outcome(state, succeeded=True)
+        _record_sql_outcome(state, answered=True)
+        if records:
+            _add_verified_example(state, cleaned_sql_query)
+        if state.get("is_followup"):
+            _record_followup_answer("bigquery")
+        return {"query_results": records, "answer_source": "bigquery"}
+    except DeadlineExceededError as e:
+        _cancel_jobs(started_jobs)
+        return _timeout_update("SQL execution", e)
     except Exception as e:
-        print(f"Error executing BigQuery query: {e}")
+        _cancel_jobs(started_jobs)
+        if _deadline_passed(state): # e.g. BigQuery's own job/result timeout fired at the deadline
+            return _timeout_update("SQL execution")
+        logger.error("Error executing BigQuery query: %s", e)
+        if isinstance(e, google_exceptions.BadRequest):
+            # BigQuery rejected the query itself (syntax, unknown name, type error): feed the message to repair_sql
+            return _sql_error_update(state, sql_query, getattr(e, "message", None) or str(e), "Failed to execute BigQuery query")
         # Provide specific BQ errors if possible
         return {"error_message": f"Failed to execute BigQuery query: {e}"}
+
+def _cancel_jobs(jobs) -> None:
+    """Cancels BigQuery jobs that are still running so abandoned queries stop using slots."""
+    for job in jobs:
+        try:
+            if not job.done():
+                job.cancel()
+                logger.info("Cancelled BigQuery job %s.", job.job_id)
+        except Exception as e:
+            logger.warning("Could not cancel BigQuery job: %s", e)
     
 def format_results(results):
     """
@@ -331,78 +751,150 @@ def format_results(results):
     return ", ".join(row_strings[:-1]) + ", and " + row_strings[-1]
 
 
+def build_response_prompt(question: str, query_results: List[Dict[str, Any]], company: Optional[str] = None) -> ChatPromptTemplate:
+    """
+    The LLM prompt that phrases a query result as an answer (also used by scripts/compare_answer_templates.py).
+    `company` is the tenant's company (default: COMPANY_NAME). The question and results are bound as
+    template variables, so braces in them reach the LLM as text; the prompt renders with no inputs.
+    """
+    # Prepare results for the prompt (e.g., format as JSON or a table string)
+    #results_string = json.dumps(query_results, indent=2, default=str) # Use default=str for dates/times
+    results_string = format_results(query_results)
+    return ChatPromptTemplate.from_messages([
+        ("system", """You are a helpful assistant answering questions about {company} sales data.
+        Based on the user's original question and the provided data (which is the result of a database query), formulate a clear and concise natural language answer.
+        Do not mention the SQL query or the database. Just provide the answer to the question.
+
+        Data:
+        {results}
+        """),
+        ("user", "Original Question: {question}")
+    ]).partial(company=company or config.COMPANY, results=results_string, question=question)
+
+def _record_response_renderer(renderer: str, seconds: float) -> None:
+    """Counts template vs LLM answers and updates the template fast-path rate gauge."""
+    path = "llm" if renderer == "llm" else "template"
+    METRICS.increment("response_renders", renderer=renderer)
+    METRICS.observe("response_render_seconds", seconds, path=path)
+    METRICS.increment("response_render_paths", path=path)
+    templated = METRICS.counter("response_render_paths", path="template")
+    llm_phrased = METRICS.counter("response_render_paths", path="llm")
+    METRICS.set_gauge("response_template_rate", templated / (templated + llm_phrased))
+
 def generate_response_node(state: AgentState) -> dict:
-    """Generates the final natural language response."""
-    print("--- Generating Response ---")
+    """
+    Generates the final natural language response. Common result shapes
+    (single value, single row, small ranked list, time series) are rendered from
+    templates (tools/answer_templates.py); other shapes are phrased by the LLM.
+    """
+    logger.debug("Generating response")
     question = state["question"]
     query_results = state["query_results"]
 
     if query_results is None: # Check for None explicitly, as empty list is valid
          return {"error_message": "No query results available to generate response."}
+    if _deadline_passed(state):
+        return _timeout_update("response generation")
 
     # Handle empty results
     if not query_results:
         final_response = "I found no data matching your request."
         return {"final_response": final_response}
 
-    # Prepare results for the prompt (e.g., format as JSON or a table string)
-    #results_string = json.dumps(query_results, indent=2, default=str) # Use default=str for dates/times
-    results_string = format_results(query_results)
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", f"""You are a helpful assistant answering questions about {config.COMPANY} sales data.
-        Based on the user's original question and the provided data (which is the result of a database query), formulate a clear and concise natural language answer.
-        Do not mention the SQL query or the database. Just provide the answer to the question.
-
-        Data:
-        {results_string}
-        """),
-        ("user", f"Original Question: {question}")
-    ])
-    response_generator_chain = prompt | llm | StrOutputParser()
+    start_time = time.perf_counter()
+    rendered = render_answer(query_results) if config.ANSWER_TEMPLATES_ENABLED else None
+    if rendered is not None:
+        shape, final_response = rendered
+        _record_response_renderer(f"template:{shape}", time.perf_counter() - start_time)
+        logger.debug("Answer rendered from the '%s' template.", shape)
+        return {"final_response": final_response, "response_renderer": f"template:{shape}"}
 
+    prompt = build_response_prompt(question, query_results, get_tenant(state.get("tenant")).company)
     try:
-        final_response = response_generator_chain.invoke({})
+        final_response = invoke_llm("generate_response", prompt, deadline=state.get("deadline"))
         #print(f"Generated Response: {final_response}")
-        return {"final_response": final_response}
+        _record_response_renderer("llm", time.perf_counter() - start_time)
+        return {"final_response": final_response, "response_renderer": "llm"}
+    except DeadlineExceededError as e:
+        return _timeout_update("response generation", e)
     except Exception as e:
-        print(f"Error generating response: {e}")
+        logger.error("Error generating response: %s", e)
         return {"error_message": f"LLM failed to generate the final response: {e}"}
 
 def handle_error_node(state: AgentState) -> dict:
     """Generates a user-facing error message."""
-    print("--- Handling Error ---")
+    logger.debug("Handling error")
     error = state.get("error_message", "An unknown error occurred.")
+    if state.get("busy_backend"):
+        final_response = (f"Sorry, the service is busy right now ({state['busy_backend']} is at capacity). "
+                          f"Please try again in {config.ADMISSION_BUSY_RETRY_AFTER_SECONDS} seconds.")
+        return {"final_response": final_response}
+    if state.get("timed_out"):
+        budget = state.get("deadline_seconds")
+        if budget is None:
+            budget = config.REQUEST_DEADLINE_SECONDS
+        final_response = f"Sorry, I could not answer within the time allowed ({budget:g}s)."
+        if state.get("query_results"):
+            # The data was fetched before time ran out: return it unphrased as a partial answer
+            final_response += f" Here is the raw result I found: {format_results(state['query_results'])}"
+        return {"final_response": final_response}
+    if state.get("repair_attempts"):
+        _record_repair_outcome(state, succeeded=False)
+    if state.get("few_shot_examples") is not None: # The question reached SQL generation
+        _record_sql_outcome(state, answered=False)
     # You could add more sophisticated error routing here
     final_response = f"Sorry, I encountered an issue: {error}"
     return {"final_response": final_response}
 
 # --- Conditional Logic ---
 
+def _can_repair(state: AgentState) -> bool:
+    """True if the current error is a SQL error that repair_sql may fix within the attempt limit and deadline."""
+    return (
+        bool(state.get("sql_error"))
+        and not state.get("timed_out")
+        and (state.get("repair_attempts") or 0) < config.SQL_REPAIR_MAX_ATTEMPTS
+        and not _deadline_passed(state)
+    )
+
 def should_execute_sql(state: AgentState) -> str:
     """Determines the next step after SQL generation."""
-    print("--- Checking SQL Generation ---")
+    logger.debug("Checking SQL generation")
     if state.get("error_message"):
-        print(f"Error flag set: {state['error_message']}. Routing to error handler.")
+        if _can_repair(state):
+            logger.info("SQL rejected: %s. Routing to SQL repair.", state['error_message'])
+            return "repair_sql"
+        logger.warning("Error flag set: %s. Routing to error handler.", state['error_message'])
         return "handle_error" # Route to error handler if generation failed
     if state.get("sql_query"):
-        print("SQL query generated. Proceeding to execution.")
+        logger.debug("SQL query generated. Proceeding to execution.")
         return "execute_sql" # Route to execution if SQL is present
     else:
         # This case shouldn't happen if generate_sql_node handles NO_QUERY correctly, but as a fallback:
-        print("No SQL query generated and no error flag. Routing to error handler.")
+        logger.warning("No SQL query generated and no error flag. Routing to error handler.")
         state["error_message"] = "Failed to produce a SQL query." # Set error message
         return "handle_error"
 
+def should_sanitize_response(state: AgentState) -> str:
+    """Determines the next step after response generation."""
+    if state.get("error_message") and not state.get("final_response"):
+        logger.warning("Error flag set during response generation: %s. Routing to error handler.", state['error_message'])
+        return "handle_error"
+    return "sanitize_response"
+
 def should_generate_response(state: AgentState) -> str:
     """Determines the next step after SQL execution."""
-    print("--- Checking SQL Execution ---")
+    logger.debug("Checking SQL execution")
     if state.get("error_message"):
-        print(f"Error flag set during execution: {state['error_message']}. Routing to error handler.")
+        if _can_repair(state):
+            logger.info("BigQuery rejected the query: %s. Routing to SQL repair.", state['error_message'])
+            return "repair_sql"
+        logger.warning("Error flag set during execution: %s. Routing to error handler.", state['error_message'])
         return "handle_error" # Route to error handler if execution failed
     if state.get("query_results") is not None: # Check if results are present (even empty list is valid)
-         print("SQL executed successfully. Proceeding to response generation.")
+         logger.debug("SQL executed successfully. Proceeding to response generation.")
          return "generate_response"
     else:
-        print("No query results found and no error flag. Routing to error handler.")
+        logger.warning("No query results found and no error flag. Routing to error handler.")
         state["error_message"] = "Query execution did not return results or failed silently." # Set error message
         return "handle_error"
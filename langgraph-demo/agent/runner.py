@@ -0,0 +1,156 @@
+# /nl2sql-agent/agent/runner.py
+
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+import config
+from .graph import app
+from .sessions import session_config, has_history, touch_session, compact_session, evict_sessions
+from tools.retriever import start_schema_refresher
+from utils.admission import admit, request_priority
+from utils.log import get_logger, log_context
+from utils.metrics import METRICS
+from utils.request_log import REQUEST_LOG, build_record, normalize_question, request_trace
+from utils.resilience import BackendBusyError
+from utils.single_flight import SingleFlight
+from utils.tenants import get_tenant, tenant_key
+from utils.usage import request_usage
+
+logger = get_logger(__name__)
+
+# Per-turn fields reset at the start of every question; `history` is kept by the checkpointer.
+_TURN_FIELDS = (
+    "intent_type", "schema_context", "sql_query", "sql_validation_errors", "sql_error", "first_sql_error_at",
+    "query_results", "final_response", "error_message", "original_question", "timed_out",
+    "is_followup", "reuse_schema_context", "local_sql", "answer_source", "schema_version",
+    "response_renderer", "busy_backend", "few_shot_examples",
+)
+_first_request_done = False
+_QUESTION_FLIGHTS = SingleFlight("question")
+
+start_schema_refresher() # Hot reload of the schema state (and local embeddings) for this process
+
+
+def build_inputs(question: str, deadline_seconds: Optional[float] = None, session_id: Optional[str] = None,
+                 tenant: Optional[str] = None) -> Dict[str, Any]:
+    """Initial graph state for one question, stamped with its absolute deadline."""
+    budget = config.REQUEST_DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds
+    started_at = time.time()
+    inputs = {field: None for field in _TURN_FIELDS}
+    inputs.update({"question": question, "deadline": started_at + budget, "deadline_seconds": budget, "started_at": started_at,
+                   "repair_attempts": 0, "session_id": session_id, "tenant": tenant or config.ADMISSION_DEFAULT_TENANT})
+    return inputs
+
+
+def _run_graph(inputs: Dict[str, Any], graph_config: dict) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """Runs the graph; returns the final state and the seconds spent in each node (summed if it ran more than once)."""
+    final_state, node_seconds = inputs, {}
+    last_event = time.perf_counter()
+    # Nodes run one after another, so the time between consecutive events is the node that just finished
+    for mode, chunk in app.stream(inputs, config=graph_config, stream_mode=["updates", "values"]):
+        now = time.perf_counter()
+        if mode == "updates":
+            for node in chunk:
+                node_seconds[node] = node_seconds.get(node, 0.0) + now - last_event
+                METRICS.observe("node_seconds", now - last_event, node=node)
+        else:
+            final_state = chunk
+        last_event = now
+    return final_state, node_seconds
+
+
+def _log_request(question: str, final_state: Dict[str, Any], trace: Dict[str, Any], node_seconds: Dict[str, float],
+                 total_seconds: float, session_id: str, error: Optional[str] = None) -> None:
+    if not config.REQUEST_LOG_ENABLED:
+        return
+    try:
+        REQUEST_LOG.log(build_record(question, final_state, trace, node_seconds, total_seconds, session_id, error))
+    except Exception as e:
+        logger.warning("Could not build the request log record: %s", e)
+
+
+def _coalesce_key(question: str, session_id: str, tenant: str) -> Tuple[str, str, str]:
+    """
+    Identical questions share one run within the tenant: across fresh sessions,
+    but only within the same session once it has history (follow-ups depend on it).
+    """
+    scope = session_id if has_history(session_id) else ""
+    return tenant, scope, normalize_question(question)
+
+
+def _adopt_shared_turn(final_state: Dict[str, Any], session_id: str) -> Dict[str, Any]:
+    """A coalesced request's copy of the shared final state, with the turn also saved to its own session."""
+    if final_state.get("session_id") != session_id:
+        try:
+            app.update_state(session_config(session_id), {"history": final_state.get("history") or []}, as_node="record_turn")
+        except Exception as e:
+            logger.warning("Could not save the shared turn to session %s: %s", session_id, e)
+    return dict(final_state, session_id=session_id)
+
+
+def _request_outcome(final_state: Dict[str, Any]) -> str:
+    if final_state.get("busy_backend"):
+        return "busy"
+    if final_state.get("timed_out"):
+        return "timed_out"
+    return "error" if final_state.get("error_message") else "answered"
+
+
+def run_question(question: str, run_config: Optional[dict] = None, deadline_seconds: Optional[float] = None,
+                 session_id: Optional[str] = None, tenant: Optional[str] = None,
+                 priority: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Runs the agent graph for one question within the request deadline and returns the final state.
+    Questions sharing a session_id are follow-ups in one conversation; without one, a new session is used.
+    `tenant` (utils/tenants.py) selects the dataset, schema and examples the question is answered from;
+    sessions and caches are namespaced by it. Raises UnknownTenantError for a tenant that is not configured,
+    and BackendBusyError when the tenant is at its request limit for longer than the deadline allows.
+    `tenant` and `priority` ("high", "normal", "low") also place its backend calls in the fair admission queues.
+    An identical question already running (see _coalesce_key) is awaited and its answer shared.
+    The returned state also carries "node_seconds", the time spent in each graph node (empty if shared),
+    and "usage", the request's tokens, bytes billed and estimated cost (utils/usage.py).
+    """
+    global _first_request_done
+    tenant = get_tenant(tenant).name
+    session_id = session_id or uuid.uuid4().hex
+    thread_id = tenant_key(tenant, session_id) # The same session ID under two tenants is two conversations
+    inputs = build_inputs(question, deadline_seconds, thread_id, tenant)
+    start_time = time.perf_counter()
+    request_id = uuid.uuid4().hex
+
+    def run_graph():
+        # Only the run that does the work holds one of the tenant's request slots; coalesced requests wait for free
+        with admit(f"tenant:{tenant}", inputs["deadline"]):
+            return _run_graph(inputs, session_config(thread_id, run_config))
+
+    with request_trace() as trace, request_usage() as usage, request_priority(tenant, priority), \
+            log_context(request_id=request_id, session_id=session_id, tenant=tenant):
+        trace["request_id"] = request_id
+        try:
+            key = _coalesce_key(question, thread_id, tenant) if _QUESTION_FLIGHTS.enabled else None
+            (final_state, node_seconds), shared = _QUESTION_FLIGHTS.do(key, run_graph, inputs["deadline"])
+        except Exception as e:
+            trace["usage"] = usage.summary()
+            METRICS.increment("tenant_requests", tenant=tenant, outcome="busy" if isinstance(e, BackendBusyError) else "failed")
+            _log_request(question, inputs, trace, {}, time.perf_counter() - start_time, session_id, f"{type(e).__name__}: {e}")
+            raise
+    if shared:
+        final_state, node_seconds = _adopt_shared_turn(final_state, thread_id), {}
+    total_seconds = time.perf_counter() - start_time
+    # First request of the process vs steady state, to measure what warm-up (tools/clients.py) saves
+    METRICS.observe("request_seconds", total_seconds, phase="steady" if _first_request_done else "first", tenant=tenant)
+    _first_request_done = True
+    trace["usage"] = usage.summary() # Empty for a coalesced request: it paid for nothing
+    METRICS.observe("request_cost_usd", trace["usage"]["cost_usd"], tenant=tenant)
+    METRICS.increment("tenant_requests", tenant=tenant, outcome=_request_outcome(final_state))
+    _log_request(question, final_state, trace, node_seconds, total_seconds, session_id)
+    final_state["node_seconds"] = node_seconds
+    final_state["usage"] = trace["usage"]
+    try:
+        touch_session(thread_id)
+        compact_session(thread_id)
+        evict_sessions()
+    except Exception as e:
+        logger.warning("Session store maintenance failed: %s", e)
+    return final_state
@@ -0,0 +1,121 @@
+# /nl2sql-agent/agent/sessions.py
+
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import config
+from utils.log import get_logger
+
+logger = get_logger(__name__)
+
+# LangGraph checkpointer backed by a local SQLite file. Each session is a LangGraph
+# thread; only the latest checkpoint of a session is kept (see compact_session).
+try:
+    from langgraph.checkpoint.sqlite import SqliteSaver
+    _connection = sqlite3.connect(config.SESSION_DB_PATH, check_same_thread=False)
+    CHECKPOINTER = SqliteSaver(_connection)
+    CHECKPOINTER.setup()
+    # Housekeeping (activity, compaction, eviction) uses its own connection: the saver serialises access to
+    # its connection with its own lock, so sharing it here would interleave statements with checkpoint writes
+    _housekeeping = sqlite3.connect(config.SESSION_DB_PATH, timeout=30, check_same_thread=False)
+    logger.info("Session checkpointer using SQLite database '%s'.", config.SESSION_DB_PATH)
+except Exception as e:
+    # langgraph-checkpoint-sqlite missing or the database is unusable: keep sessions in memory only
+    from langgraph.checkpoint.memory import MemorySaver
+    logger.warning("SQLite session store unavailable (%s). Sessions will not survive a restart.", e)
+    _housekeeping = None
+    CHECKPOINTER = MemorySaver()
+
+_lock = threading.Lock() # Guards _housekeeping
+if _housekeeping is not None:
+    with _lock:
+        _housekeeping.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (thread_id TEXT PRIMARY KEY, last_active REAL NOT NULL)"
+        )
+        _housekeeping.commit()
+
+
+def session_config(session_id: str, run_config: Optional[dict] = None) -> dict:
+    """Merges the session's thread_id into a LangGraph run config (callbacks etc. are kept)."""
+    merged = dict(run_config or {})
+    merged["configurable"] = {**merged.get("configurable", {}), "thread_id": session_id}
+    return merged
+
+
+def has_history(session_id: str) -> bool:
+    """Whether the session has a saved turn, i.e. its next question may be a follow-up."""
+    return CHECKPOINTER.get_tuple(session_config(session_id)) is not None
+
+
+def compact_turn(state: Dict[str, Any]) -> Dict[str, Any]:
+    """The part of a finished turn that follow-ups need, with the result set capped to a preview."""
+    results = state.get("query_results") or []
+    return {
+        "question": state.get("question"),
+        "schema_context": state.get("schema_context"),
+        "schema_version": state.get("schema_version"),
+        "sql_query": state.get("sql_query"),
+        "results_preview": results[:config.SESSION_RESULT_PREVIEW_ROWS],
+        "row_count": len(results),
+        "answer": state.get("final_response"),
+    }
+
+
+def append_turn(history: Optional[List[Dict[str, Any]]], turn: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Appends a turn, keeping only the last SESSION_HISTORY_TURNS turns."""
+    return (list(history or []) + [turn])[-config.SESSION_HISTORY_TURNS:]
+
+
+def compact_session(session_id: str) -> None:
+    """Deletes every checkpoint of a session except the latest; intermediate graph steps are not needed."""
+    if _housekeeping is None:
+        return
+    with _lock, _housekeeping: # Commits, or rolls back so no write lock is left held
+        latest = _housekeeping.execute(
+            "SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ''", (session_id,)
+        ).fetchone()[0]
+        if latest is None:
+            return
+        _housekeeping.execute("DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_id != ?", (session_id, latest))
+        _housekeeping.execute("DELETE FROM writes WHERE thread_id = ? AND checkpoint_id != ?", (session_id, latest))
+
+
+def touch_session(session_id: str) -> None:
+    if _housekeeping is None:
+        return
+    with _lock, _housekeeping:
+        _housekeeping.execute(
+            "INSERT INTO sessions (thread_id, last_active) VALUES (?, ?) "
+            "ON CONFLICT(thread_id) DO UPDATE SET last_active = excluded.last_active",
+            (session_id, time.time()),
+        )
+
+
+def evict_sessions(ttl_seconds: Optional[float] = None, max_sessions: Optional[int] = None) -> int:
+    """
+    Deletes sessions idle for longer than ttl_seconds, then the least recently
+    active ones beyond max_sessions. Returns the number of sessions evicted.
+    """
+    if _housekeeping is None:
+        return 0
+    ttl_seconds = config.SESSION_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+    max_sessions = config.SESSION_MAX_COUNT if max_sessions is None else max_sessions
+    cutoff = time.time() - ttl_seconds
+    with _lock, _housekeeping:
+        expired = [row[0] for row in _housekeeping.execute(
+            "SELECT thread_id FROM sessions WHERE last_active < ?", (cutoff,)
+        )]
+        overflow = [row[0] for row in _housekeeping.execute(
+            "SELECT thread_id FROM sessions WHERE last_active >= ? ORDER BY last_active DESC LIMIT -1 OFFSET ?",
+            (cutoff, max_sessions),
+        )]
+        evicted = expired + overflow
+        for session_id in evicted:
+            _housekeeping.execute("DELETE FROM checkpoints WHERE thread_id = ?", (session_id,))
+            _housekeeping.execute("DELETE FROM writes WHERE thread_id = ?", (session_id,))
+            _housekeeping.execute("DELETE FROM sessions WHERE thread_id = ?", (session_id,))
+    if evicted:
+        logger.info("Evicted %d session(s) from the session store.", len(evicted))
+    return len(evicted)
@@ -5,8 +5,28 @@ class AgentState(TypedDict):
     intent_type: Optional[str]
     schema_context: Optional[str]
     sql_query: Optional[str]
+    sql_validation_errors: Optional[List[Dict[str, str]]] # Structured errors from tools/sql_validator.py
     query_results: Optional[List[Dict[str, Any]]]
     final_response: Optional[str]
     error_message: Optional[str]
     original_question: Optional[str]
+    deadline: Optional[float] # Absolute time.time() by which the request must finish
+    deadline_seconds: Optional[float] # The request's time budget, reported when it runs out
+    timed_out: Optional[bool]
+    busy_backend: Optional[str] # Backend whose admission queue shed the request (utils/admission.py)
+    started_at: Optional[float] # time.time() when the request started
+    sql_error: Optional[str] # Validator or BigQuery error for the current sql_query, fed to repair_sql
+    repair_attempts: Optional[int]
+    first_sql_error_at: Optional[float] # time.time() of the first SQL error (for repair latency metrics)
+    few_shot_examples: Optional[int] # Examples in the SQL generation prompt (tools/example_store.py); None if SQL was never generated
+    # Multi-turn sessions (persisted by the checkpointer, see agent/sessions.py)
+    history: Optional[List[Dict[str, Any]]] # Compact previous turns, oldest first, bounded
+    is_followup: Optional[bool] # The question refines the previous turn
+    reuse_schema_context: Optional[bool] # The previous turn's schema context covers the follow-up
+    session_id: Optional[str] # Namespaced by tenant (utils/tenants.py), like every session-keyed cache
+    tenant: Optional[str] # Tenant whose dataset, schema and examples the question is answered from
+    local_sql: Optional[str] # DuckDB query over cached result sets, when answered locally
+    answer_source: Optional[str] # "local" (cached result sets) or "bigquery"
+    response_renderer: Optional[str] # "template:<shape>" (tools/answer_templates.py) or "llm"
+    schema_version: Optional[int] # Version of the schema state the answer was built from (tools/retriever.py)
     # Add other state variables if needed
\ No newline at end of file
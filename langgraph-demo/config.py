@@ -1,4 +1,5 @@
 import os
+import json
 from dotenv import load_dotenv
 
 # Load variables from .env file if it exists
@@ -16,15 +17,163 @@ VECTOR_SEARCH_DEPLOYED_INDEX_ID = os.environ.get("VECTOR_SEARCH_DEPLOYED_INDEX_I
 SCHEMA_LOOKUP_GCS_URI = os.environ.get("SCHEMA_LOOKUP_GCS_URI")
 EMBEDDINGS_GCS_JSONL_PATH = os.environ.get("EMBEDDINGS_GCS_JSONL_PATH")
 EMBEDDING_MODEL_NAME = os.environ.get("EMBEDDING_MODEL_NAME", "text-embedding-004") # Default if not set
+# Hierarchical schema retrieval: neighbours fetched, then tables kept, then columns kept per table
+SCHEMA_RETRIEVAL_CANDIDATES = int(os.environ.get("SCHEMA_RETRIEVAL_CANDIDATES", "20"))
+SCHEMA_MAX_TABLES = int(os.environ.get("SCHEMA_MAX_TABLES", "3"))
+SCHEMA_MAX_COLUMNS_PER_TABLE = int(os.environ.get("SCHEMA_MAX_COLUMNS_PER_TABLE", "6"))
+# Per-call Vector Search timeout; beyond it, schema retrieval falls back to the local lexical (BM25) index alone
+VECTOR_SEARCH_TIMEOUT_SECONDS = float(os.environ.get("VECTOR_SEARCH_TIMEOUT_SECONDS", "3.0"))
+# "remote" queries the Vector Search endpoint; "local" searches the embedding matrix in process (tools/embedding_store.py)
+VECTOR_SEARCH_BACKEND = os.environ.get("VECTOR_SEARCH_BACKEND", "remote").lower()
+# Local backend: "binary" memory-maps the artifact next to the JSONL (falling back to the JSONL), "jsonl" always parses the JSONL
+EMBEDDING_STORE_FORMAT = os.environ.get("EMBEDDING_STORE_FORMAT", "binary").lower()
+EMBEDDING_STORE_DTYPE = os.environ.get("EMBEDDING_STORE_DTYPE", "float32").lower() # "float32" or "int8" (4x smaller)
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", "embedding_cache") # Local copies of the binary artifact
+# Local snapshot of the parsed schema, catalog and BM25 index, stamped with the source's GCS generation; empty disables it
+SCHEMA_SNAPSHOT_PATH = os.environ.get("SCHEMA_SNAPSHOT_PATH", "schema_snapshot.pkl")
+# How often each process polls the schema source (and the local embedding artifact) for changes; 0 disables hot reload
+SCHEMA_REFRESH_INTERVAL_SECONDS = float(os.environ.get("SCHEMA_REFRESH_INTERVAL_SECONDS", "60"))
 
 # --- LLM Configuration ---
-GEMINI_MODEL_NAME = os.environ.get("GEMINI_MODEL_NAME", "gemini-2.0-flash-001")
+GEMINI_MODEL_NAME = os.environ.get("GEMINI_MODEL_NAME", "gemini-2.0-flash-001") # The "standard" tier
+# Model tiers (tools/llm_services.py): each graph node calls its tier's model; SQL repair escalates one tier per attempt
+GEMINI_FAST_MODEL_NAME = os.environ.get("GEMINI_FAST_MODEL_NAME", "gemini-2.0-flash-lite-001")
+GEMINI_STRONG_MODEL_NAME = os.environ.get("GEMINI_STRONG_MODEL_NAME", "gemini-2.5-pro")
+LLM_NODE_TIERS = os.environ.get(
+    "LLM_NODE_TIERS",
+    "contextualize_question=fast,classify_intent=fast,answer_from_cache=standard,"
+    "generate_sql=standard,repair_sql=standard,generate_response=fast",
+)
+# USD per million [input, output] tokens, for the llm_cost_usd metric and per-request costs (utils/usage.py)
+LLM_PRICES_PER_MILLION_TOKENS = json.loads(os.environ.get("LLM_PRICES_PER_MILLION_TOKENS", json.dumps({
+    "gemini-2.0-flash-lite-001": [0.075, 0.30],
+    "gemini-2.0-flash-001": [0.10, 0.40],
+    "gemini-2.5-pro": [1.25, 10.00],
+})))
+LLM_CACHED_INPUT_PRICE_RATIO = float(os.environ.get("LLM_CACHED_INPUT_PRICE_RATIO", "0.25")) # Cached prompt tokens cost this share of the input price
+EMBEDDING_PRICE_PER_MILLION_CHARS = float(os.environ.get("EMBEDDING_PRICE_PER_MILLION_CHARS", "0.025"))
+BIGQUERY_PRICE_PER_TIB = float(os.environ.get("BIGQUERY_PRICE_PER_TIB", "6.25")) # On-demand price per TiB billed
+# Budgets, enforced before each paid call (0: no limit)
+LLM_MAX_PROMPT_TOKENS = int(os.environ.get("LLM_MAX_PROMPT_TOKENS", "0")) # Estimated prompt tokens of one LLM call
+REQUEST_MAX_LLM_TOKENS = int(os.environ.get("REQUEST_MAX_LLM_TOKENS", "0")) # LLM input plus output tokens of one request
+REQUEST_MAX_COST_USD = float(os.environ.get("REQUEST_MAX_COST_USD", "0")) # Estimated spend of one request
 COMPANY = os.environ.get("COMPANY_NAME")
 
 
 #Model Armor template id
 MA_TEMPLATE_ID = os.environ.get("MA_TEMPLATE_ID")
 
+# --- Request deadline: end-to-end latency budget for one question ---
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "60"))
+
+# --- SQL self-repair: rewrite attempts after a validator or BigQuery error, within the request deadline ---
+SQL_REPAIR_MAX_ATTEMPTS = int(os.environ.get("SQL_REPAIR_MAX_ATTEMPTS", "2"))
+
+# --- Few-shot SQL examples: verified (question, SQL) pairs retrieved by question similarity (tools/example_store.py) ---
+FEW_SHOT_ENABLED = os.environ.get("FEW_SHOT_ENABLED", "true").lower() == "true"
+FEW_SHOT_STORE_PATH = os.environ.get("FEW_SHOT_STORE_PATH", "few_shot_examples.sqlite") # Shared by all server workers
+FEW_SHOT_EXAMPLES = int(os.environ.get("FEW_SHOT_EXAMPLES", "3")) # Most examples added to the SQL prompt
+FEW_SHOT_MIN_SIMILARITY = float(os.environ.get("FEW_SHOT_MIN_SIMILARITY", "0.75")) # Cosine similarity of the questions
+FEW_SHOT_MAX_TOKENS = int(os.environ.get("FEW_SHOT_MAX_TOKENS", "800")) # Estimated prompt tokens for all examples together
+FEW_SHOT_MAX_EXAMPLES = int(os.environ.get("FEW_SHOT_MAX_EXAMPLES", "5000")) # Oldest examples beyond this are evicted
+FEW_SHOT_RELOAD_SECONDS = float(os.environ.get("FEW_SHOT_RELOAD_SECONDS", "30")) # How often to pick up other workers' examples
+EMBEDDING_QUERY_CACHE_SIZE = int(os.environ.get("EMBEDDING_QUERY_CACHE_SIZE", "128")) # Recent question embeddings kept per process
+
+# --- Multi-turn sessions (LangGraph checkpointer on local SQLite) ---
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", "sessions.sqlite")
+SESSION_HISTORY_TURNS = int(os.environ.get("SESSION_HISTORY_TURNS", "5")) # Prior turns kept per session
+SESSION_RESULT_PREVIEW_ROWS = int(os.environ.get("SESSION_RESULT_PREVIEW_ROWS", "20")) # Result rows kept per turn
+SESSION_TTL_SECONDS = float(os.environ.get("SESSION_TTL_SECONDS", "86400")) # Idle sessions older than this are evicted
+SESSION_MAX_COUNT = int(os.environ.get("SESSION_MAX_COUNT", "1000")) # Least recently active sessions beyond this are evicted
+# Template answers: common result shapes are phrased without an LLM call (tools/answer_templates.py)
+ANSWER_TEMPLATES_ENABLED = os.environ.get("ANSWER_TEMPLATES_ENABLED", "true").lower() == "true"
+ANSWER_TEMPLATE_MAX_ROWS = int(os.environ.get("ANSWER_TEMPLATE_MAX_ROWS", "10")) # Longest ranked list rendered
+ANSWER_TEMPLATE_MAX_SERIES_POINTS = int(os.environ.get("ANSWER_TEMPLATE_MAX_SERIES_POINTS", "24")) # Longest time series rendered
+# Local result-set engine: recent result sets per session kept as Arrow tables for drill-down follow-ups
+RESULT_CACHE_SETS_PER_SESSION = int(os.environ.get("RESULT_CACHE_SETS_PER_SESSION", "3"))
+RESULT_CACHE_MAX_SESSIONS = int(os.environ.get("RESULT_CACHE_MAX_SESSIONS", "200"))
+RESULT_CACHE_MAX_ROWS = int(os.environ.get("RESULT_CACHE_MAX_ROWS", "100000")) # Larger result sets are not cached
+
+# --- Resilience for external calls (timeouts, retries, hedging, circuit breakers) ---
+LLM_TIMEOUT_SECONDS = float(os.environ.get("LLM_TIMEOUT_SECONDS", "30"))
+EMBEDDING_TIMEOUT_SECONDS = float(os.environ.get("EMBEDDING_TIMEOUT_SECONDS", "5"))
+MODEL_ARMOR_TIMEOUT_SECONDS = float(os.environ.get("MODEL_ARMOR_TIMEOUT_SECONDS", "5"))
+BIGQUERY_TIMEOUT_SECONDS = float(os.environ.get("BIGQUERY_TIMEOUT_SECONDS", "60"))
+EXTERNAL_CALL_MAX_RETRIES = int(os.environ.get("EXTERNAL_CALL_MAX_RETRIES", "2"))
+RETRY_BASE_DELAY_SECONDS = float(os.environ.get("RETRY_BASE_DELAY_SECONDS", "0.2"))
+RETRY_MAX_DELAY_SECONDS = float(os.environ.get("RETRY_MAX_DELAY_SECONDS", "5"))
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "95")) # Hedge idempotent calls slower than this percentile
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20")) # Latency samples needed before hedging starts
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "5"))
+CIRCUIT_BREAKER_RESET_SECONDS = float(os.environ.get("CIRCUIT_BREAKER_RESET_SECONDS", "30"))
+RESILIENCE_MAX_WORKERS = int(os.environ.get("RESILIENCE_MAX_WORKERS", "32"))
+
+# --- Admission control: per-backend concurrency and rate limits with a fair queue (utils/admission.py) ---
+ADMISSION_CONTROL_ENABLED = os.environ.get("ADMISSION_CONTROL_ENABLED", "true").lower() == "true"
+# Per service: max concurrent calls and a token bucket (calls per second, burst) sized to the project's quotas.
+# Limits apply per process: divide the quota by SERVER_WORKERS times the number of instances. Unlisted services are not limited.
+ADMISSION_LIMITS = json.loads(os.environ.get("ADMISSION_LIMITS", json.dumps({
+    "llm": {"concurrency": 16, "rate_per_second": 8, "burst": 16},
+    "bigquery": {"concurrency": 8, "rate_per_second": 4, "burst": 8},
+    "embeddings": {"concurrency": 16, "rate_per_second": 25, "burst": 50},
+    "vector_search": {"concurrency": 16, "rate_per_second": 25, "burst": 50},
+    "model_armor": {"concurrency": 16, "rate_per_second": 25, "burst": 50},
+})))
+ADMISSION_DEFAULT_TENANT = os.environ.get("ADMISSION_DEFAULT_TENANT", "default") # Tenant of requests that name none
+ADMISSION_BUSY_RETRY_AFTER_SECONDS = int(os.environ.get("ADMISSION_BUSY_RETRY_AFTER_SECONDS", "5")) # Retry-After of a "busy" response
+
+# --- Tenants: one process serving several datasets (utils/tenants.py) ---
+# The default tenant (ADMISSION_DEFAULT_TENANT) is the configuration above. Others, by name:
+# {"<tenant>": {"dataset", "schema_uri", and optionally "project", "company", "embeddings_uri",
+#  "index_endpoint", "deployed_index_id", "limits"}}; unset fields are taken from the default tenant.
+TENANTS = json.loads(os.environ.get("TENANTS", "{}"))
+# Admission limits on each tenant's concurrent requests (same keys as ADMISSION_LIMITS), unless the tenant sets "limits"
+TENANT_DEFAULT_LIMITS = json.loads(os.environ.get("TENANT_DEFAULT_LIMITS", "{}"))
+
+# --- Single-flight: identical concurrent calls share one in-flight run (utils/single_flight.py) ---
+# Groups that coalesce: whole questions (same tenant, session scope and normalized text), embeddings of the same text,
+# executions of the same SQL and Model Armor checks of the same text
+SINGLE_FLIGHT_GROUPS = os.environ.get("SINGLE_FLIGHT_GROUPS", "question,embeddings,bigquery,model_armor")
+
+# --- Shared Google clients: connection pools, token refresh and startup warm-up ---
+HTTP_POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", "10")) # Hosts with a pooled keep-alive connection
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", str(RESILIENCE_MAX_WORKERS))) # Connections per host (= concurrent calls)
+TOKEN_REFRESH_MARGIN_SECONDS = float(os.environ.get("TOKEN_REFRESH_MARGIN_SECONDS", "300")) # Refresh this long before expiry
+WARMUP_ON_START = os.environ.get("WARMUP_ON_START", "true").lower() == "true"
+WARMUP_SERVICES = os.environ.get("WARMUP_SERVICES", "bigquery,gcs,embeddings,vector_search,llm")
+
+# --- Pre-fork HTTP server (server.py) ---
+SERVER_HOST = os.environ.get("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.environ.get("SERVER_PORT", "8080"))
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", str(os.cpu_count() or 1))) # One worker per core
+SERVER_BACKLOG = int(os.environ.get("SERVER_BACKLOG", "128"))
+SERVER_MAX_REQUESTS_PER_WORKER = int(os.environ.get("SERVER_MAX_REQUESTS_PER_WORKER", "1000")) # Then the worker is recycled
+SERVER_MAX_REQUESTS_JITTER = int(os.environ.get("SERVER_MAX_REQUESTS_JITTER", "100")) # Spreads recycling across workers
+SERVER_METRICS_DIR = os.environ.get("SERVER_METRICS_DIR", "worker_metrics") # Per-worker metrics snapshots
+
+# --- Request log: one structured record per question, written in background batches (utils/request_log.py) ---
+REQUEST_LOG_ENABLED = os.environ.get("REQUEST_LOG_ENABLED", "true").lower() == "true"
+REQUEST_LOG_FORMAT = os.environ.get("REQUEST_LOG_FORMAT", "sqlite") # "sqlite" or "parquet" (needs pyarrow)
+# SQLite database file, or the directory of Parquet batch files
+REQUEST_LOG_PATH = os.environ.get("REQUEST_LOG_PATH", "request_log.sqlite" if REQUEST_LOG_FORMAT == "sqlite" else "request_log")
+REQUEST_LOG_BATCH_SIZE = int(os.environ.get("REQUEST_LOG_BATCH_SIZE", "50"))
+REQUEST_LOG_FLUSH_SECONDS = float(os.environ.get("REQUEST_LOG_FLUSH_SECONDS", "5")) # Partial batches are written after this
+REQUEST_LOG_QUEUE_SIZE = int(os.environ.get("REQUEST_LOG_QUEUE_SIZE", "10000")) # Records beyond this are dropped, never blocking a request
+
+# --- Logging: leveled records written as JSON lines by a background thread (utils/log.py) ---
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "httpx=WARNING,urllib3=WARNING") # Per-logger levels, e.g. "tools.retriever=DEBUG"
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json") # "json" (one object per line) or "text" (for reading in a terminal)
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get("LOG_DEBUG_SAMPLE_RATE", "0.1")) # Share of DEBUG records kept
+LOG_MAX_MESSAGE_CHARS = int(os.environ.get("LOG_MAX_MESSAGE_CHARS", "2000")) # Longer messages and fields are truncated
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000")) # Records beyond this are dropped, never blocking a request
+
+# --- Fake backends for load testing (tools/fake_backends.py) ---
+# Comma-separated services replaced by local fakes: llm, bigquery, embeddings, vector_search, model_armor, or "all"
+FAKE_BACKENDS = os.environ.get("FAKE_BACKENDS", "")
+# Latency of the fakes: a built-in profile (fast, typical, slow) or JSON {"<service>": [p50_seconds, p99_seconds]}
+FAKE_LATENCY_PROFILE = os.environ.get("FAKE_LATENCY_PROFILE", "typical")
+
 # --- Basic Validation (Optional but Recommended) ---
 required_vars = [
     GCP_PROJECT_ID, GCP_REGION, BIGQUERY_DATASET_ID,
@@ -35,5 +184,4 @@ if not all(required_vars):
     missing = [name for name, var in locals().items() if name.isupper() and var is None and name != 'BIGQUERY_PROJECT_ID'] # Simple check
     raise ValueError(f"Missing required environment variables: {missing}")
 
-print("Configuration loaded successfully.")
 # You might add more checks (e.g., validate GCS URI format)
\ No newline at end of file
@@ -1,7 +1,24 @@
 import sys
-from agent.graph import app # Import the compiled graph application
+import json
+import uuid
+from agent.runner import run_question # Runs the compiled graph within the request deadline
 import config # Ensure config is loaded (implicitly happens on import)
 from utils.callbacks import CustomCallbackHandler # Optional
+from utils.metrics import METRICS
+from tools.clients import warm_up
+
+def _schema_version_note(final_state) -> str:
+    """Which schema version an answer was built from, so answers given across a schema reload can be told apart."""
+    version = final_state.get("schema_version")
+    return f" (schema version {version})" if version is not None else ""
+
+def _usage_note(final_state) -> str:
+    """Tokens and estimated cost of the request (utils/usage.py)."""
+    usage = final_state.get("usage") or {}
+    if not usage:
+        return ""
+    return (f"[Usage: {usage['input_tokens']} prompt / {usage['output_tokens']} completion / {usage['cached_tokens']} cached tokens, "
+            f"{usage['bytes_billed'] / 1024 ** 3:.3f} GiB billed, ~${usage['cost_usd']:.5f}]")
 
 def main():
     print("--- NL2SQL Agent ---")
@@ -12,10 +29,9 @@ def main():
     if len(sys.argv) > 1:
         question = " ".join(sys.argv[1:])
         print(f"Processing question: {question}")
-        inputs = {"question": question}
         try:
             # Invoke the agent graph
-            final_state = app.invoke(inputs, config=run_config) # Pass config if using callbacks
+            final_state = run_question(question, run_config) # Pass config if using callbacks
 
             # Print the final response or error
             response = final_state.get("final_response", "Agent finished without a final response.")
@@ -23,29 +39,40 @@ def main():
             if error and response == "Agent finished without a final response.": # If handle_error didn't set a final response
                 print(f"\nAgent Error: {error}")
             else:
-                 print(f"\nAgent Response:\n{response}")
+                 print(f"\nAgent Response{_schema_version_note(final_state)}:\n{response}")
+            print(_usage_note(final_state))
 
         except Exception as e:
             print(f"\nAn unexpected error occurred during agent execution: {e}")
 
     else: # Interactive mode
-         print("Enter your question (or type 'quit' to exit):")
+         if config.WARMUP_ON_START:
+             warm_up() # Pay TLS handshakes, token fetch and endpoint lookups before the first question
+         print("Enter your question (or type 'metrics' to show call metrics, 'new' to start a new conversation, 'quit' to exit):")
+         session_id = uuid.uuid4().hex # Follow-up questions in this loop share one session
          while True:
              question = input("> ")
              if question.lower() == 'quit':
                  break
+             if question.lower() == 'new':
+                 session_id = uuid.uuid4().hex
+                 print("Started a new conversation.")
+                 continue
+             if question.lower() == 'metrics':
+                 print(json.dumps(METRICS.snapshot(), indent=2))
+                 continue
              if not question:
                  continue
 
-             inputs = {"question": question}
              try:
-                 final_state = app.invoke(inputs, config=run_config)
+                 final_state = run_question(question, run_config, session_id=session_id)
                  response = final_state.get("final_response", "Agent finished without a final response.")
                  error = final_state.get("error_message")
                  if error and response == "Agent finished without a final response.":
                      print(f"Agent Error: {error}\n")
                  else:
-                     print(f"Agent Response:\n{response}\n")
+                     print(f"Agent Response{_schema_version_note(final_state)}:\n{response}")
+                     print(f"{_usage_note(final_state)}\n")
              except Exception as e:
                   print(f"\nAn unexpected error occurred: {e}\n")
 
@@ -0,0 +1,202 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # For utils/ when run as a script
+import config
+from utils.request_log import read_records
+
+REPORTS = ("shapes", "nodes", "sql", "cache", "cost", "attempts", "tenants")
+
+
+def _percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))] if values else 0.0
+
+
+def _gib(num_bytes: float) -> str:
+    return f"{num_bytes / 1024 ** 3:.3f}"
+
+
+def report_shapes(records, top: int):
+    """Most frequent question shapes (literals masked), with their latency, intent and error rate."""
+    groups = defaultdict(list)
+    for record in records:
+        groups[record["question_shape"]].append(record)
+    print(f"\nTop question shapes ({len(groups)} distinct in {len(records)} requests)\n")
+    print(f"{'count':>7}{'share':>8}{'p50 s':>9}{'errors':>8}  {'intent':<18}shape")
+    for shape, group in sorted(groups.items(), key=lambda item: -len(item[1]))[:top]:
+        intents = defaultdict(int)
+        for record in group:
+            intents[record["intent"] or "-"] += 1
+        errors = sum(1 for record in group if record["error"]) / len(group)
+        print(f"{len(group):>7}{len(group) / len(records):>8.1%}{_percentile([r['total_seconds'] for r in group], 50):>9.2f}"
+              f"{errors:>8.0%}  {max(intents, key=intents.get):<18}{shape[:80]}")
+
+
+def report_nodes(records, top: int):
+    """Graph nodes by total time spent, so optimization starts where the time goes."""
+    seconds = defaultdict(list)
+    for record in records:
+        for node, value in record["node_seconds"].items():
+            seconds[node].append(value)
+    total = sum(sum(values) for values in seconds.values()) or 1.0
+    print(f"\nSlowest nodes (share of all node time)\n")
+    print(f"{'node':<26}{'runs':>7}{'mean s':>9}{'p50 s':>9}{'p95 s':>9}{'share':>8}")
+    for node, values in sorted(seconds.items(), key=lambda item: -sum(item[1]))[:top]:
+        print(f"{node:<26}{len(values):>7}{statistics.mean(values):>9.3f}{_percentile(values, 50):>9.3f}"
+              f"{_percentile(values, 95):>9.3f}{sum(values) / total:>8.1%}")
+
+
+def report_sql(records, top: int):
+    """SQL fingerprints (queries differing only in literals) by total bytes processed in BigQuery."""
+    groups = defaultdict(list)
+    for record in records:
+        if record["sql_fingerprint"] and record["answer_source"] == "bigquery":
+            groups[record["sql_fingerprint"]].append(record)
+    print(f"\nMost expensive SQL fingerprints ({len(groups)} distinct)\n")
+    print(f"{'fingerprint':<18}{'runs':>6}{'total GiB':>11}{'mean GiB':>10}{'mean exec s':>13}  shape")
+    ranked = sorted(groups.items(), key=lambda item: -sum(r["bytes_processed"] or 0 for r in item[1]))
+    for fingerprint, group in ranked[:top]:
+        total_bytes = sum(record["bytes_processed"] or 0 for record in group)
+        exec_seconds = [record["node_seconds"].get("execute_sql", 0.0) for record in group]
+        print(f"{fingerprint:<18}{len(group):>6}{_gib(total_bytes):>11}{_gib(total_bytes / len(group)):>10}"
+              f"{statistics.mean(exec_seconds):>13.2f}  {group[-1]['sql_shape'][:80]}")
+
+
+def report_cache(records, ttl_seconds: float):
+    """
+    Current cache hits, and the hits a cache would add: a request repeats an
+    earlier one if the same question (answer cache) or the same SQL (result
+    cache) was seen within the TTL on the same schema version.
+    """
+    hits = defaultdict(int)
+    for record in records:
+        for cache in record["cache_hits"]:
+            hits[cache] += 1
+    print(f"\nCache hits over {len(records)} requests: "
+          + (", ".join(f"{cache} {count} ({count / len(records):.1%})" for cache, count in sorted(hits.items())) or "none"))
+
+    print(f"\nCache-hit potential (repeats within {ttl_seconds:.0f}s on the same schema version)\n")
+    print(f"{'cache key':<22}{'repeats':>9}{'rate':>8}{'seconds saved':>15}{'GiB saved':>11}")
+    for label, key in (("question (answer)", "question_hash"), ("SQL (result)", "sql_hash")):
+        last_seen, repeats, seconds_saved, bytes_saved = {}, 0, 0.0, 0
+        for record in records:
+            if not record[key] or record["error"]:
+                continue
+            cache_key = (record[key], record["schema_version"])
+            if cache_key in last_seen and record["ts"] - last_seen[cache_key] <= ttl_seconds:
+                repeats += 1
+                if key == "question_hash":
+                    seconds_saved += record["total_seconds"] # The whole pipeline is skipped
+                else:
+                    seconds_saved += record["node_seconds"].get("execute_sql", 0.0)
+                bytes_saved += record["bytes_processed"] or 0
+            last_seen[cache_key] = record["ts"]
+        print(f"{label:<22}{repeats:>9}{repeats / len(records):>8.1%}{seconds_saved:>15.1f}{_gib(bytes_saved):>11}")
+
+
+def report_cost(records, top: int):
+    """Estimated spend (utils/usage.py): per request, per node, and the question shapes that cost the most."""
+    costs = [record.get("cost_usd") or 0.0 for record in records]
+    tokens = sum((record.get("llm_input_tokens") or 0) + (record.get("llm_output_tokens") or 0) for record in records)
+    cached = sum(record.get("llm_cached_tokens") or 0 for record in records)
+    print(f"\nEstimated cost: ${sum(costs):.4f} total, ${statistics.mean(costs):.5f} mean, "
+          f"${_percentile(costs, 95):.5f} p95 per request; {tokens} LLM tokens ({cached} cached)\n")
+    by_node = defaultdict(float)
+    for record in records:
+        for node, cost in record.get("cost_by_node", {}).items():
+            by_node[node] += cost
+    total = sum(by_node.values()) or 1.0
+    print(f"{'node':<26}{'cost $':>12}{'share':>8}")
+    for node, cost in sorted(by_node.items(), key=lambda item: -item[1])[:top]:
+        print(f"{node:<26}{cost:>12.6f}{cost / total:>8.1%}")
+
+    shapes = defaultdict(list)
+    for record in records:
+        shapes[record["question_shape"]].append(record.get("cost_usd") or 0.0)
+    print(f"\n{'cost $':>12}{'count':>7}{'mean $':>11}  shape")
+    for shape, values in sorted(shapes.items(), key=lambda item: -sum(item[1]))[:top]:
+        print(f"{sum(values):>12.6f}{len(values):>7}{statistics.mean(values):>11.6f}  {shape[:80]}")
+
+
+def report_attempts(records):
+    """SQL first-attempt success rate and attempts per answered question, with and without few-shot examples."""
+    groups = defaultdict(list)
+    for record in records:
+        if record.get("few_shot_examples") is not None and not record["timed_out"]: # Reached SQL generation
+            groups["with examples" if record["few_shot_examples"] else "without examples"].append(record)
+    print(f"\nSQL attempts (questions that reached SQL generation, timeouts excluded)\n")
+    print(f"{'prompt':<18}{'questions':>10}{'first try':>11}{'answered':>10}{'attempts/answer':>17}")
+    for label in ("with examples", "without examples"):
+        group = groups.get(label, [])
+        answered = [record for record in group if record["answer_source"] == "bigquery" and not record["error"]]
+        first_try = sum(1 for record in answered if not record["repair_attempts"])
+        attempts = statistics.mean(record["repair_attempts"] + 1 for record in answered) if answered else 0.0
+        print(f"{label:<18}{len(group):>10}{first_try / (len(group) or 1):>11.1%}{len(answered) / (len(group) or 1):>10.1%}"
+              f"{attempts:>17.2f}")
+
+
+def _tenant(record) -> str:
+    return record.get("tenant") or config.ADMISSION_DEFAULT_TENANT # Records logged before tenants were recorded
+
+
+def report_tenants(records):
+    """Requests, latency, error rate, BigQuery bytes and estimated spend per tenant (utils/tenants.py)."""
+    groups = defaultdict(list)
+    for record in records:
+        groups[_tenant(record)].append(record)
+    print(f"\nTenants ({len(groups)})\n")
+    print(f"{'tenant':<20}{'requests':>9}{'p50 s':>8}{'p95 s':>8}{'errors':>8}{'GiB billed':>12}{'cost $':>11}")
+    for tenant, group in sorted(groups.items(), key=lambda item: -len(item[1])):
+        seconds = [record["total_seconds"] for record in group]
+        errors = sum(1 for record in group if record["error"]) / len(group)
+        billed = sum(record.get("bytes_billed") or 0 for record in group)
+        cost = sum(record.get("cost_usd") or 0.0 for record in group)
+        print(f"{tenant[:19]:<20}{len(group):>9}{_percentile(seconds, 50):>8.2f}{_percentile(seconds, 95):>8.2f}"
+              f"{errors:>8.0%}{_gib(billed):>12}{cost:>11.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Workload report from the request log (utils/request_log.py).")
+    parser.add_argument("--path", default=config.REQUEST_LOG_PATH, help="SQLite file or Parquet directory")
+    parser.add_argument("--format", default=config.REQUEST_LOG_FORMAT, choices=("sqlite", "parquet"))
+    parser.add_argument("--since-hours", type=float, default=0, help="Only requests from the last N hours (0: all)")
+    parser.add_argument("--top", type=int, default=10, help="Rows per report")
+    parser.add_argument("--cache-ttl-seconds", type=float, default=3600, help="Lifetime assumed for a potential cache entry")
+    parser.add_argument("--report", action="append", choices=REPORTS, help="Report to print (repeatable; default: all)")
+    parser.add_argument("--tenant", help="Only requests of this tenant")
+    args = parser.parse_args()
+
+    since = time.time() - args.since_hours * 3600 if args.since_hours else None
+    records = read_records(args.path, args.format, since)
+    if args.tenant:
+        records = [record for record in records if _tenant(record) == args.tenant]
+    if not records:
+        print(f"No requests logged in {args.path}.")
+        return
+    hours = (records[-1]["ts"] - records[0]["ts"]) / 3600
+    print(f"{len(records)} requests from {args.path} over {hours:.1f} hours.")
+    reports = args.report or REPORTS
+    if "shapes" in reports:
+        report_shapes(records, args.top)
+    if "nodes" in reports:
+        report_nodes(records, args.top)
+    if "sql" in reports:
+        report_sql(records, args.top)
+    if "cache" in reports:
+        report_cache(records, args.cache_ttl_seconds)
+    if "cost" in reports:
+        report_cost(records, args.top)
+    if "attempts" in reports:
+        report_attempts(records)
+    if "tenants" in reports:
+        report_tenants(records)
+
+
+# --- Main execution ---
+if __name__ == "__main__":
+    main()
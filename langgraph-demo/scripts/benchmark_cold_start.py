@@ -0,0 +1,46 @@
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+# Each run starts a fresh interpreter that imports the agent (schema load, indexes, graph compilation),
+# which is what a new container or server worker pays before it can answer.
+COLD_START_RUNS = int(os.getenv("COLD_START_RUNS", "5"))
+COLD_START_COMMAND = [sys.executable, "-c", "import agent.runner"]
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# --- End Configuration ---
+
+
+def time_cold_start(snapshot_path: str) -> float:
+    """Seconds for one fresh process to import the agent; an empty snapshot_path disables the schema snapshot."""
+    env = dict(os.environ, SCHEMA_SNAPSHOT_PATH=snapshot_path)
+    start_time = time.perf_counter()
+    subprocess.run(COLD_START_COMMAND, cwd=PROJECT_DIR, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start_time
+
+
+def run_benchmark():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        snapshot_path = os.path.join(temp_dir, "schema_snapshot.pkl")
+        time_cold_start(snapshot_path) # Writes the snapshot that the "with snapshot" runs load
+        results = {
+            "without snapshot": [time_cold_start("") for _ in range(COLD_START_RUNS)],
+            "with snapshot": [time_cold_start(snapshot_path) for _ in range(COLD_START_RUNS)],
+        }
+    print(f"\nCold start over {COLD_START_RUNS} runs (seconds until the agent is importable)\n")
+    print(f"{'mode':<20}{'median':>10}{'min':>10}{'max':>10}")
+    for mode, seconds in results.items():
+        print(f"{mode:<20}{statistics.median(seconds):>10.3f}{min(seconds):>10.3f}{max(seconds):>10.3f}")
+
+
+# --- Main execution ---
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,113 @@
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # For tools/ when run as a script
+from tools.embedding_format import artifact_files, normalize_rows, read_artifact, write_artifact
+
+load_dotenv()
+
+# --- Configuration ---
+BUCKET_NAME = os.getenv("BUCKET_NAME")
+# Float JSONL baseline written by generate_schema_embeddings.py: a gs:// URI or a local path.
+# Set BENCHMARK_SYNTHETIC_ROWS instead to benchmark random unit vectors without GCS access.
+BENCHMARK_SOURCE = os.getenv("BENCHMARK_SOURCE", f"gs://{BUCKET_NAME}/embeddings/schema_embeddings.jsonl")
+BENCHMARK_SYNTHETIC_ROWS = int(os.getenv("BENCHMARK_SYNTHETIC_ROWS", "0"))
+BENCHMARK_SYNTHETIC_DIM = int(os.getenv("BENCHMARK_SYNTHETIC_DIM", "768"))
+BENCHMARK_QUERIES = int(os.getenv("BENCHMARK_QUERIES", "200"))
+BENCHMARK_K = int(os.getenv("BENCHMARK_K", "10"))
+BENCHMARK_QUERY_NOISE = float(os.getenv("BENCHMARK_QUERY_NOISE", "0.05")) # Queries are perturbed stored vectors
+BENCHMARK_DIMENSIONS = [int(d) for d in os.getenv("BENCHMARK_DIMENSIONS", "256").split(",") if d.strip()] # Reduced-dimension variants
+BENCHMARK_REPEATS = int(os.getenv("BENCHMARK_REPEATS", "5"))
+# --- End Configuration ---
+
+
+def read_jsonl_text(source: str) -> str:
+    if source.startswith("gs://"):
+        from google.cloud import storage
+        bucket_name, blob_name = source[5:].split("/", 1)
+        return storage.Client().bucket(bucket_name).blob(blob_name).download_as_text()
+    with open(source, "r", encoding="utf-8") as handle:
+        return handle.read()
+
+
+def parse_jsonl(text: str):
+    """The baseline load: parse every record and build the normalised float32 matrix."""
+    ids, rows = [], []
+    for line in text.splitlines():
+        if line.strip():
+            item = json.loads(line)
+            ids.append(item["id"])
+            rows.append(item["embedding"])
+    return ids, normalize_rows(rows)
+
+
+def best_of(fn, repeats: int = BENCHMARK_REPEATS):
+    """Runs fn `repeats` times; returns (fastest seconds, last result)."""
+    best, result = float("inf"), None
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start_time)
+    return best, result
+
+
+def top_k(vectors: np.ndarray, scales, queries: np.ndarray, k: int) -> np.ndarray:
+    """Exact top-k row indices per query, scoring the stored form the way EmbeddingStore.search does."""
+    queries = normalize_rows(queries[:, :vectors.shape[1]])
+    scores = vectors.astype(np.float32) @ queries.T
+    if scales is not None:
+        scores *= np.asarray(scales)[:, None]
+    return np.argsort(-scores, axis=0)[:k].T
+
+
+def recall_at_k(expected: np.ndarray, found: np.ndarray) -> float:
+    return float(np.mean([len(set(e) & set(f)) / len(e) for e, f in zip(expected, found)]))
+
+
+def run_benchmark():
+    if BENCHMARK_SYNTHETIC_ROWS:
+        print(f"Benchmarking {BENCHMARK_SYNTHETIC_ROWS} synthetic {BENCHMARK_SYNTHETIC_DIM}-d vectors.")
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((BENCHMARK_SYNTHETIC_ROWS, BENCHMARK_SYNTHETIC_DIM)).astype(np.float32)
+        text = "\n".join(json.dumps({"id": f"item_{i}", "embedding": row.tolist()}) for i, row in enumerate(vectors))
+    else:
+        print(f"Benchmarking embeddings from {BENCHMARK_SOURCE}.")
+        text = read_jsonl_text(BENCHMARK_SOURCE)
+
+    jsonl_seconds, (ids, baseline) = best_of(lambda: parse_jsonl(text))
+    k = min(BENCHMARK_K, len(ids))
+    rng = np.random.default_rng(1)
+    picks = rng.choice(len(ids), size=min(BENCHMARK_QUERIES, len(ids)), replace=False)
+    queries = baseline[picks] + rng.normal(0, BENCHMARK_QUERY_NOISE, (len(picks), baseline.shape[1])).astype(np.float32)
+    expected = top_k(baseline, None, queries, k)
+
+    rows = [("jsonl float32 (parse)", baseline.shape[1], len(text.encode("utf-8")), baseline.nbytes, jsonl_seconds, 1.0)]
+    variants = [("float32", None), ("int8", None)] + [(dtype, d) for d in BENCHMARK_DIMENSIONS for dtype in ("float32", "int8")]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for dtype, dimensions in variants:
+            if dimensions and dimensions >= baseline.shape[1]:
+                continue
+            prefix = os.path.join(temp_dir, f"schema_embeddings.{dtype}.{dimensions or 'full'}")
+            write_artifact(prefix, ids, baseline, dtype, dimensions)
+            file_bytes = sum(os.path.getsize(path) for path in artifact_files(prefix, dtype))
+            load_seconds, (_, vectors, scales) = best_of(lambda: read_artifact(prefix, mmap=True))
+            matrix_bytes = vectors.nbytes + (scales.nbytes if scales is not None else 0)
+            recall = recall_at_k(expected, top_k(vectors, scales, queries, k))
+            rows.append((f"mmap {dtype}", vectors.shape[1], file_bytes, matrix_bytes, load_seconds, recall))
+
+    print(f"\n{len(ids)} vectors, {len(picks)} queries, recall@{k} against the float32 JSONL baseline\n")
+    print(f"{'format':<24}{'dim':>6}{'file bytes':>14}{'matrix bytes':>14}{'load ms':>12}{'recall':>9}")
+    for name, dim, file_bytes, matrix_bytes, seconds, recall in rows:
+        print(f"{name:<24}{dim:>6}{file_bytes:>14}{matrix_bytes:>14}{seconds * 1000:>12.3f}{recall:>9.3f}")
+    print("\nMapped load times exclude page faults: matrix pages are read from the page cache on first search.")
+
+
+# --- Main execution ---
+if __name__ == "__main__":
+    run_benchmark()
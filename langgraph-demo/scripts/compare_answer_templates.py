@@ -0,0 +1,113 @@
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # For agent/ and tools/ when run as a script
+load_dotenv()
+
+from agent.nodes import build_response_prompt
+from tools.answer_templates import render_answer
+from tools.llm_services import LLM_TIER_ORDER, invoke_llm
+
+# --- Configuration ---
+# Fixed question set: each case is a question with the rows its SQL returned, so both arms phrase identical data.
+ANSWER_EVAL_CASES = os.getenv("ANSWER_EVAL_CASES", os.path.join(os.path.dirname(os.path.abspath(__file__)), "answer_eval_cases.json"))
+ANSWER_EVAL_JUDGE = os.getenv("ANSWER_EVAL_JUDGE", "true").lower() == "true" # LLM-as-judge scoring on the strongest tier
+# --- End Configuration ---
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def numbers_in(text: str) -> set:
+    """Numbers mentioned in a text, thousands separators removed (1,234.50 -> 1234.5)."""
+    return {float(match) for match in _NUMBER.findall(text.replace(",", ""))}
+
+
+def numeric_fidelity(records, answer: str) -> float:
+    """Share of the numbers in the result rows that the answer states (exactly or rounded to two decimals)."""
+    expected = {round(float(value), 2) for row in records for value in row.values()
+                if isinstance(value, (int, float)) and not isinstance(value, bool)}
+    if not expected:
+        return 1.0
+    stated = {round(number, 2) for number in numbers_in(answer)}
+    return len(expected & stated) / len(expected)
+
+
+def judge(question: str, records, answers: dict) -> dict:
+    """
+    Scores each answer 1-5 for correctness against the data and clarity. Answers are shown
+    under neutral, shuffled labels so the judge can not favour a position or a style it recognises.
+    """
+    arms = list(answers)
+    random.shuffle(arms)
+    labels = {arm: chr(ord("A") + i) for i, arm in enumerate(arms)}
+    listing = "\n\n".join(f"Answer {labels[arm]}:\n{answers[arm]}" for arm in arms)
+    prompt = (
+        "You grade answers to questions about sales data. For each answer give a score from 1 (wrong or unclear) "
+        "to 5 (correct, complete and easy to read), judged only against the data.\n\n"
+        f"Question: {question}\n\nData:\n{json.dumps(records, default=str)}\n\n{listing}\n\n"
+        f"Return only a JSON object mapping each answer letter to its score, e.g. {{\"A\": 4, \"B\": 5}}."
+    )
+    raw = invoke_llm("answer_judge", prompt, escalation=len(LLM_TIER_ORDER))
+    try:
+        scores = json.loads(raw[raw.index("{"):raw.rindex("}") + 1])
+        return {arm: float(scores[labels[arm]]) for arm in arms}
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"[WARNING] Unparseable judge output for '{question}': {e}")
+        return {}
+
+
+def run_comparison():
+    with open(ANSWER_EVAL_CASES, "r", encoding="utf-8") as handle:
+        cases = json.load(handle)
+    print(f"Comparing template and LLM answers on {len(cases)} cases from {ANSWER_EVAL_CASES}.")
+
+    results = []
+    for case in cases:
+        question, records = case["question"], case["records"]
+        start_time = time.perf_counter()
+        rendered = render_answer(records)
+        template_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        llm_answer = invoke_llm("generate_response", build_response_prompt(question, records)).strip()
+        llm_seconds = time.perf_counter() - start_time
+
+        result = {"question": question, "shape": rendered[0] if rendered else None,
+                  "llm": {"seconds": llm_seconds, "fidelity": numeric_fidelity(records, llm_answer)}}
+        answers = {"llm": llm_answer}
+        if rendered:
+            answers["template"] = rendered[1]
+            result["template"] = {"seconds": template_seconds, "fidelity": numeric_fidelity(records, rendered[1])}
+        if ANSWER_EVAL_JUDGE:
+            for arm, score in judge(question, records, answers).items():
+                result[arm]["score"] = score
+        results.append(result)
+
+    print(f"\n{'question':<52}{'shape':<14}{'tpl score':>10}{'llm score':>10}{'tpl fid':>9}{'llm fid':>9}")
+    for result in results:
+        template = result.get("template", {})
+        print(f"{result['question'][:50]:<52}{result['shape'] or '-':<14}"
+              f"{template.get('score', float('nan')):>10.1f}{result['llm'].get('score', float('nan')):>10.1f}"
+              f"{template.get('fidelity', float('nan')):>9.2f}{result['llm']['fidelity']:>9.2f}")
+
+    covered = [result for result in results if result["shape"]]
+    print(f"\nTemplate fast-path coverage: {len(covered)}/{len(results)} ({len(covered) / max(len(results), 1):.0%})")
+    # Quality is compared on the covered cases only: elsewhere the agent still answers with the LLM
+    for arm in ("template", "llm"):
+        def mean(key):
+            values = [result[arm][key] for result in covered if key in result[arm]]
+            return statistics.mean(values) if values else float("nan")
+        print(f"{arm:<10} on covered cases: judge score {mean('score'):.2f}, numeric fidelity {mean('fidelity'):.2f}, "
+              f"mean latency {mean('seconds') * 1000:.1f} ms")
+
+
+# --- Main execution ---
+if __name__ == "__main__":
+    run_comparison()
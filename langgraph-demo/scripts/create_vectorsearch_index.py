@@ -1,4 +1,8 @@
 import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
 from google.cloud import aiplatform
 from google.cloud.aiplatform import MatchingEngineIndex, MatchingEngineIndexEndpoint   # Specific class for endpoint
 from google.api_core import exceptions as google_exceptions # For more specific error handling
@@ -33,50 +37,295 @@ DEPLOYMENT_MIN_REPLICAS = 1
 DEPLOYMENT_MAX_REPLICAS = 1
 
 # Data Upsert Configuration
-EMBEDDINGS_GCS_URI = f"gs://{BUCKET_NAME}/embeddings/schema_embeddings.jsonl" # Path to embeddings JSONL
+# Tenants share the index (datapoints carry tenant/table restricts); set SCHEMA_TENANT to sync one tenant's files,
+# as written by generate_schema_embeddings.py with the same setting
+DEFAULT_TENANT = os.getenv("ADMISSION_DEFAULT_TENANT", "default")
+SCHEMA_TENANT = os.getenv("SCHEMA_TENANT") or DEFAULT_TENANT
+TENANT_DIR = "" if SCHEMA_TENANT == DEFAULT_TENANT else f"{SCHEMA_TENANT}/"
+EMBEDDINGS_GCS_URI = f"gs://{BUCKET_NAME}/embeddings/{TENANT_DIR}schema_embeddings.jsonl" # Path to embeddings JSONL
+# Deletion list written by generate_schema_embeddings.py
+EMBEDDINGS_DELETIONS_GCS_URI = f"gs://{BUCKET_NAME}/embeddings/{TENANT_DIR}delta/schema_embeddings_deletions.json"
+# Set EMBEDDINGS_SOURCE to the delta JSONL (or a local file) to sync only what changed
+EMBEDDINGS_SOURCE = os.getenv("EMBEDDINGS_SOURCE", EMBEDDINGS_GCS_URI)
+EMBEDDINGS_DELETIONS_SOURCE = os.getenv("EMBEDDINGS_DELETIONS_SOURCE", EMBEDDINGS_DELETIONS_GCS_URI)
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "500")) # Datapoints per upsert/remove request
+UPSERT_PARALLELISM = int(os.getenv("UPSERT_PARALLELISM", "4")) # Concurrent upsert/remove requests
+UPSERT_MAX_RETRIES = 5
+UPSERT_RETRY_BASE_DELAY = 1.0 # seconds, doubled on each retry
+
+# Offline mode: set LOCAL_INDEX_PATH to sync into a local JSON file instead of Vector Search
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", "")
 
+# --- End Configuration ---
 
+RETRYABLE_INDEX_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+)
 
-# --- End Configuration ---
+
+def parse_gcs_uri(gcs_uri: str) -> tuple[str, str]:
+    """Splits gs://bucket/path/to/blob into (bucket, blob path)."""
+    if not gcs_uri.startswith("gs://"):
+        raise ValueError(f"Invalid GCS URI: {gcs_uri}. Must start with 'gs://'")
+
+    # Remove 'gs://' and split into bucket/path components
+    path_parts = gcs_uri[5:].split("/", 1)
+    if len(path_parts) < 2 or not path_parts[1]:
+        raise ValueError(f"No blob path specified in GCS URI: {gcs_uri}")
+    return path_parts[0], path_parts[1]
+
+
+@contextmanager
+def open_text(uri: str):
+    """Opens a gs:// URI or a local path for streaming text reads."""
+    if uri.startswith("gs://"):
+        bucket_name, blob_path = parse_gcs_uri(uri)
+        blob = storage.Client().bucket(bucket_name).blob(blob_path)
+        with blob.open("r", encoding="utf-8") as handle: # Chunked download, not one big string
+            yield handle
+    else:
+        with open(uri, "r", encoding="utf-8") as handle:
+            yield handle
+
+
+def iter_embedding_records(uri: str):
+    """Streams embedding records ({"id": ..., "embedding": [...]}) from a JSONL file line by line."""
+    with open_text(uri) as handle:
+        for line_number, line in enumerate(handle, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if "id" not in item or "embedding" not in item:
+                print(f"Warning: Skipping line {line_number} without 'id'/'embedding'.")
+                continue
+            yield item
+
+
+def load_deleted_ids(uri: str) -> list[str]:
+    """Loads the deletion list written by generate_schema_embeddings.py (missing file means nothing to delete)."""
+    try:
+        with open_text(uri) as handle:
+            return json.load(handle)
+    except (google_exceptions.NotFound, FileNotFoundError):
+        return []
+
+
+def to_datapoint(item: dict) -> IndexDatapoint:
+    restricts = [IndexDatapoint.Restriction(namespace=restrict["namespace"], allow_list=restrict["allow"])
+                 for restrict in item.get("restricts", [])]
+    return IndexDatapoint(datapoint_id=item["id"], feature_vector=item["embedding"], restricts=restricts)
+
+
+def restricts_key(restricts) -> list:
+    """Comparable form of a datapoint's restricts, from a record ({"namespace", "allow"}) or an IndexDatapoint."""
+    return sorted(
+        (restrict["namespace"], sorted(restrict["allow"])) if isinstance(restrict, dict)
+        else (restrict.namespace, sorted(restrict.allow_list))
+        for restrict in restricts or []
+    )
 
 
 def load_embeddings_from_gcs(gcs_uri: str) -> list[IndexDatapoint]:
     """Loads embeddings from GCS URI and converts to IndexDatapoint list.
-    
+
+    Prefer `iter_embedding_records` + `sync_datapoints`, which stream instead
+    of materialising every datapoint in memory.
+
     Args:
         gcs_uri: Full GCS path to JSONL embeddings file (gs://bucket/path/file.jsonl)
     """
-    # Parse GCS URI into bucket and blob path
-    if not gcs_uri.startswith("gs://"):
-        raise ValueError(f"Invalid GCS URI: {gcs_uri}. Must start with 'gs://'")
-    
-    # Remove 'gs://' and split into bucket/path components
-    path_parts = gcs_uri[5:].split("/", 1)
-    bucket_name = path_parts[0]
-    
-    if len(path_parts) > 1:
-        blob_path = path_parts[1]
-    else:
-        raise ValueError(f"No blob path specified in GCS URI: {gcs_uri}")
+    parse_gcs_uri(gcs_uri) # Validate early with a clear error
+    return [to_datapoint(item) for item in iter_embedding_records(gcs_uri)]
 
-    # Load data from GCS
-    client = storage.Client()
-    bucket = client.get_bucket(bucket_name)
-    blob = bucket.blob(blob_path)
-    
-    data = blob.download_as_text()
-    datapoints = []
-    
-    for line in data.splitlines():
-        item = json.loads(line)
-        datapoints.append(
-            IndexDatapoint(
-                datapoint_id=item["id"],
-                feature_vector=item["embedding"]
+
+def iter_batches(iterable, batch_size: int):
+    """Groups an iterable into lists of at most batch_size items."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def call_with_retry(fn, description: str, max_retries: int = UPSERT_MAX_RETRIES):
+    """Calls fn(), retrying transient API errors with exponential backoff and jitter."""
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except RETRYABLE_INDEX_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = random.uniform(0, UPSERT_RETRY_BASE_DELAY * (2 ** attempt))
+            print(f"  {description} failed ({type(e).__name__}). Retrying in {delay:.1f}s (attempt {attempt + 1}/{max_retries})...")
+            time.sleep(delay)
+
+
+def vectors_equal(a, b, tolerance: float = 1e-6) -> bool:
+    return len(a) == len(b) and all(abs(x - y) <= tolerance for x, y in zip(a, b))
+
+
+def sync_datapoints(index, records, deleted_ids=(), read_deployed=None,
+                    batch_size: int = UPSERT_BATCH_SIZE, parallelism: int = UPSERT_PARALLELISM) -> dict:
+    """
+    Streams embedding records into an index in parallel batches.
+
+    Each batch is first diffed against what is already deployed (via
+    `read_deployed(ids) -> {id: (vector, restricts)}`, when available) so
+    unchanged datapoints are not re-upserted. `deleted_ids` are removed in batches too.
+    Works with a MatchingEngineIndex or the offline LocalIndex stand-in.
+
+    Returns a stats dict (counts, elapsed seconds, datapoints/s).
+    """
+    stats = {"read": 0, "upserted": 0, "unchanged": 0, "removed": 0, "batches": 0}
+    stats_lock = threading.Lock()
+
+    def upsert_batch(batch: list):
+        if read_deployed is not None:
+            deployed = read_deployed([item["id"] for item in batch])
+            changed = [item for item in batch
+                       if item["id"] not in deployed or not vectors_equal(deployed[item["id"]][0], item["embedding"])
+                       or deployed[item["id"]][1] != restricts_key(item.get("restricts"))]
+        else:
+            changed = batch
+        if changed:
+            datapoints = [to_datapoint(item) for item in changed]
+            call_with_retry(lambda: index.upsert_datapoints(datapoints=datapoints), f"Upsert of {len(datapoints)} datapoints")
+        with stats_lock:
+            stats["upserted"] += len(changed)
+            stats["unchanged"] += len(batch) - len(changed)
+            stats["batches"] += 1
+
+    def remove_batch(ids: list):
+        call_with_retry(lambda: index.remove_datapoints(datapoint_ids=ids), f"Removal of {len(ids)} datapoints")
+        with stats_lock:
+            stats["removed"] += len(ids)
+            stats["batches"] += 1
+
+    start_time = time.time()
+    max_in_flight = parallelism * 2 # Bounds memory: at most this many batches are held at once
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        pending = set()
+
+        def submit(fn, arg):
+            nonlocal pending
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result() # Surface the first failure
+            pending.add(executor.submit(fn, arg))
+
+        def counted(items):
+            for item in items:
+                stats["read"] += 1
+                yield item
+
+        for batch in iter_batches(counted(records), batch_size):
+            submit(upsert_batch, batch)
+        for ids in iter_batches(deleted_ids, batch_size):
+            submit(remove_batch, ids)
+        for future in pending:
+            future.result()
+
+    elapsed = time.time() - start_time
+    stats["elapsed_seconds"] = round(elapsed, 3)
+    stats["datapoints_per_second"] = round((stats["upserted"] + stats["removed"]) / elapsed, 1) if elapsed > 0 else 0.0
+    print(f"Sync finished in {elapsed:.2f}s: {stats['read']} read, {stats['upserted']} upserted, "
+          f"{stats['unchanged']} unchanged, {stats['removed']} removed in {stats['batches']} batches "
+          f"({stats['datapoints_per_second']} datapoints/s).")
+    return stats
+
+
+def make_endpoint_reader(endpoint, deployed_index_id: str):
+    """
+    Returns a read_deployed(ids) function backed by the endpoint's
+    read_index_datapoints API. If the deployment cannot be read (not yet
+    deployed, private endpoint), it falls back to treating every datapoint as new.
+    """
+    state = {"available": True}
+
+    def read_deployed(ids: list) -> dict:
+        if not state["available"]:
+            return {}
+        try:
+            datapoints = call_with_retry(
+                lambda: endpoint.read_index_datapoints(deployed_index_id=deployed_index_id, ids=ids),
+                f"Read of {len(ids)} deployed datapoints"
             )
-        )
-    
-    return datapoints
+            return {dp.datapoint_id: (list(dp.feature_vector), restricts_key(dp.restricts)) for dp in datapoints}
+        except Exception as e:
+            print(f"Warning: Cannot read deployed datapoints ({e}). Upserting without diff.")
+            state["available"] = False
+            return {}
+
+    return read_deployed
+
+
+class LocalIndex:
+    """
+    File-backed stand-in for a deployed Vector Search index. It implements
+    the subset of the MatchingEngineIndex/Endpoint API the upsert pipeline
+    uses, so the whole pipeline can be run and checked offline.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._vectors: dict[str, list[float]] = {}
+        self._restricts: dict[str, list[dict]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as handle:
+                stored = json.load(handle)
+            if "vectors" in stored and isinstance(stored["vectors"], dict):
+                self._vectors, self._restricts = stored["vectors"], stored.get("restricts", {})
+            else:
+                self._vectors = stored # Written before restricts were stored
+
+    def upsert_datapoints(self, datapoints):
+        with self._lock:
+            for dp in datapoints:
+                self._vectors[dp.datapoint_id] = list(dp.feature_vector)
+                self._restricts[dp.datapoint_id] = [{"namespace": r.namespace, "allow": list(r.allow_list)} for r in dp.restricts]
+
+    def remove_datapoints(self, datapoint_ids):
+        with self._lock:
+            for datapoint_id in datapoint_ids:
+                self._vectors.pop(datapoint_id, None)
+                self._restricts.pop(datapoint_id, None)
+
+    def read_index_datapoints(self, deployed_index_id: str = None, ids=()):
+        with self._lock:
+            return [to_datapoint({"id": i, "embedding": self._vectors[i], "restricts": self._restricts.get(i, [])})
+                    for i in ids if i in self._vectors]
+
+    def save(self):
+        with self._lock:
+            with open(self.path, "w", encoding="utf-8") as handle:
+                json.dump({"vectors": self._vectors, "restricts": self._restricts}, handle)
+
+    def __len__(self):
+        return len(self._vectors)
+
+
+def sync_local_index(index_path: str, embeddings_uri: str, deletions_uri: str) -> dict:
+    """Runs the streaming upsert pipeline against a LocalIndex file (no Vector Search calls)."""
+    print(f"Syncing {embeddings_uri} into local index {index_path}...")
+    index = LocalIndex(index_path)
+    stats = sync_datapoints(
+        index,
+        iter_embedding_records(embeddings_uri),
+        deleted_ids=load_deleted_ids(deletions_uri),
+        read_deployed=make_endpoint_reader(index, DEPLOYED_INDEX_ID),
+    )
+    index.save()
+    print(f"Local index now holds {len(index)} datapoints.")
+    return stats
 
 def setup_vector_search_idempotent():
     """
@@ -212,14 +461,15 @@ def setup_vector_search_idempotent():
     try:
         # Use the index resource name which we reliably have
         the_index_for_upsert = aiplatform.MatchingEngineIndex(index_name=index_resource_name)
-        # Load embeddings from GCS
-
-        datapoints = load_embeddings_from_gcs(EMBEDDINGS_GCS_URI)
 
-        print('datapoints -------',datapoints)
-
-        print(f"Upserting datapoints from {EMBEDDINGS_GCS_URI} to index {the_index_for_upsert.resource_name}...")
-        the_index_for_upsert.upsert_datapoints(datapoints=datapoints) # This is async
+        print(f"Streaming datapoints from {EMBEDDINGS_SOURCE} to index {the_index_for_upsert.resource_name} "
+              f"(batch size {UPSERT_BATCH_SIZE}, parallelism {UPSERT_PARALLELISM})...")
+        sync_datapoints(
+            the_index_for_upsert,
+            iter_embedding_records(EMBEDDINGS_SOURCE),
+            deleted_ids=load_deleted_ids(EMBEDDINGS_DELETIONS_SOURCE),
+            read_deployed=make_endpoint_reader(endpoint, DEPLOYED_INDEX_ID),
+        )
 
         print("Datapoint upsert process initiated. Monitor index datapoint count in the Cloud Console.")
         # Actual indexing takes time after this call returns.
@@ -229,6 +479,11 @@ def setup_vector_search_idempotent():
 
 # --- Main execution ---
 if __name__ == "__main__":
+    if LOCAL_INDEX_PATH:
+        # Offline run: no Vertex AI resources are created or touched
+        sync_local_index(LOCAL_INDEX_PATH, EMBEDDINGS_SOURCE, EMBEDDINGS_DELETIONS_SOURCE)
+        raise SystemExit(0)
+
     # Basic validation for placeholders
     placeholders = {
         "GCP_PROJECT_ID": GCP_PROJECT_ID,
@@ -242,4 +497,4 @@ if __name__ == "__main__":
          print("Error: Please replace the placeholder values (e.g., [YOUR_GCP_PROJECT_ID], [YOUR_BUCKET_NAME], [PATH_...]) in the script's Configuration section.")
          print("Ensure GCS URIs (INDEX_METADATA_GCS_URI, EMBEDDINGS_GCS_URI) start with 'gs://' and the metadata URI ends with '/'.")
     else:
-        setup_vector_search_idempotent()
\ No newline at end of file
+        setup_vector_search_idempotent()
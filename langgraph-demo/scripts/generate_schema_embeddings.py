@@ -1,12 +1,20 @@
 import json
 import time
+import random
+import hashlib
+import sys
+import tempfile
 from google.cloud import storage
 from google.cloud import aiplatform
+from google.api_core import exceptions as google_exceptions # For retryable quota/availability errors
 from langchain_google_vertexai import VertexAIEmbeddings
 import os # Optional
 
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # For tools/ when run as a script
+from tools.embedding_format import artifact_files, artifact_prefix, write_artifact
+
 load_dotenv()
 
 # --- Configuration ---
@@ -14,24 +22,172 @@ load_dotenv()
 GCP_PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT")
 GCP_REGION = os.getenv("GOOGLE_CLOUD_REGION") # e.g., "us-central1", "asia-southeast1"
 
+# Tenant whose schema is embedded (see TENANTS in config.py). Tenants share one Vector Search index: every
+# datapoint is restricted to its tenant and table, and a non-default tenant's IDs and paths carry its name.
+DEFAULT_TENANT = os.getenv("ADMISSION_DEFAULT_TENANT", "default")
+SCHEMA_TENANT = os.getenv("SCHEMA_TENANT") or DEFAULT_TENANT
+TENANT_DIR = "" if SCHEMA_TENANT == DEFAULT_TENANT else f"{SCHEMA_TENANT}/"
+
 # GCS Bucket/Paths
 # Input schema JSON location
 SCHEMA_GCS_BUCKET = os.getenv("BUCKET_NAME")
-SCHEMA_GCS_JSON_PATH = "schema/schema_descriptions.json" # Path from previous step
+SCHEMA_GCS_JSON_PATH = f"schema/{TENANT_DIR}schema_descriptions.json" # Path from previous step
 
 # Output embeddings JSONL location (Vector Search uses this)
 EMBEDDINGS_GCS_BUCKET = os.getenv("BUCKET_NAME") # Can be the same bucket
-EMBEDDINGS_GCS_JSONL_PATH = "embeddings/schema_embeddings.jsonl" # Choose output path/name
+EMBEDDINGS_GCS_JSONL_PATH = f"embeddings/{TENANT_DIR}schema_embeddings.jsonl" # Full snapshot of every embedding
+# Incremental outputs written next to the full snapshot
+EMBEDDINGS_MANIFEST_PATH = f"embeddings/{TENANT_DIR}schema_embeddings_manifest.json" # id -> description hash of what is already embedded
+EMBEDDINGS_DELTA_JSONL_PATH = f"embeddings/{TENANT_DIR}delta/schema_embeddings_delta.jsonl" # Only added/changed embeddings
+EMBEDDINGS_DELETIONS_PATH = f"embeddings/{TENANT_DIR}delta/schema_embeddings_deletions.json" # IDs to remove from the index
 
 # Vertex AI Embedding Model
 # Make sure the chosen model's dimensions match your Vector Search index dimensions (e.g., 768 for gecko)
 EMBEDDING_MODEL_NAME = "text-embedding-004"
+
+# Embedding request batching. text-embedding-004 accepts at most 250 texts and
+# 20k input tokens per request, so batches are bounded by both count and size.
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+EMBEDDING_BATCH_MAX_CHARS = int(os.getenv("EMBEDDING_BATCH_MAX_CHARS", "50000")) # ~4 chars per token
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+EMBEDDING_RETRY_BASE_DELAY = 2.0 # seconds, doubled on each retry
+# Binary artifacts written next to the JSONL for the local search backend (tools/embedding_store.py):
+# one memory-mappable matrix per dtype ("float32", "int8" = 4x smaller with per-vector scales)
+EMBEDDING_BINARY_DTYPES = [dtype.strip() for dtype in os.getenv("EMBEDDING_BINARY_DTYPES", "float32,int8").split(",") if dtype.strip()]
+# Keep only the first N dimensions in the binary artifacts (text-embedding-004 output_dimensionality
+# truncates the same way); empty keeps the full model dimension used by the Vector Search index
+EMBEDDING_OUTPUT_DIMENSIONALITY = int(os.getenv("EMBEDDING_OUTPUT_DIMENSIONALITY") or 0) or None
+# Set FULL_REBUILD=true to ignore the manifest and re-embed everything
+FULL_REBUILD = os.getenv("FULL_REBUILD", "false").lower() == "true"
 # --- End Configuration ---
 
-def generate_and_upload_embeddings(project_id, region, schema_bucket, schema_path, embeddings_bucket, embeddings_path, model_name):
+RETRYABLE_EMBEDDING_ERRORS = (
+    google_exceptions.TooManyRequests, # 429 / quota exhausted
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+)
+
+
+def make_schema_id(item: dict) -> str:
+    """
+    Builds a stable Vector Search datapoint ID from what a schema item describes
+    (type, table and name) rather than from its position in the list, so that
+    adding or removing an entry does not shift the IDs of every entry after it.
+    """
+    parts = ["schema", item.get('type', 'unknown'), item.get('table', ''), item.get('name', '')]
+    # Empty table for table descriptions; basic sanitization for ID characters
+    return "_".join(part for part in parts if part).replace(' ', '_')
+
+
+def datapoint_id(schema_id: str, tenant: str = SCHEMA_TENANT) -> str:
+    """The ID in the shared index: namespaced like utils.tenants.tenant_key, so tenants' IDs never collide."""
+    return schema_id if tenant == DEFAULT_TENANT else f"{tenant}:{schema_id}"
+
+
+def datapoint_restricts(item: dict, tenant: str = SCHEMA_TENANT) -> list:
+    """Vector Search token restricts of a datapoint: queries filter on "tenant" (and can filter on "table")."""
+    table = item.get('table') or item.get('name', '') # A table description is restricted to its own table
+    return [{"namespace": "tenant", "allow": [tenant]}, {"namespace": "table", "allow": [table]}]
+
+
+def description_hash(item: dict, model_name: str) -> str:
+    """Content hash of a schema item; the model name is included so a model change re-embeds everything."""
+    payload = f"{model_name}\n{item['description']}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def iter_embedding_batches(ids: list, texts: list, max_items: int, max_chars: int):
+    """Yields (ids, texts) batches bounded by item count and total characters."""
+    batch_ids, batch_texts, batch_chars = [], [], 0
+    for doc_id, text in zip(ids, texts):
+        if batch_texts and (len(batch_texts) >= max_items or batch_chars + len(text) > max_chars):
+            yield batch_ids, batch_texts
+            batch_ids, batch_texts, batch_chars = [], [], 0
+        batch_ids.append(doc_id)
+        batch_texts.append(text)
+        batch_chars += len(text)
+    if batch_texts:
+        yield batch_ids, batch_texts
+
+
+def embed_batch_with_retry(embeddings_service, texts: list, max_retries: int = EMBEDDING_MAX_RETRIES) -> list:
+    """Embeds one batch, retrying quota/availability errors with exponential backoff and jitter."""
+    for attempt in range(max_retries + 1):
+        try:
+            return embeddings_service.embed_documents(texts)
+        except RETRYABLE_EMBEDDING_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = EMBEDDING_RETRY_BASE_DELAY * (2 ** attempt)
+            delay = random.uniform(delay / 2, delay) # Jitter so parallel runs do not retry in lockstep
+            print(f"  Embedding batch failed ({type(e).__name__}: {e}). Retrying in {delay:.1f}s (attempt {attempt + 1}/{max_retries})...")
+            time.sleep(delay)
+
+
+def load_json_blob(bucket, path: str, default):
+    """Downloads and parses a JSON blob, returning `default` if it does not exist yet."""
+    blob = bucket.blob(path)
+    if not blob.exists():
+        return default
+    return json.loads(blob.download_as_text(encoding='utf-8'))
+
+
+def load_existing_embeddings(bucket, path: str) -> dict:
+    """Reads the current full embeddings JSONL (if any) into an id -> record dict."""
+    blob = bucket.blob(path)
+    records = {}
+    if not blob.exists():
+        return records
+    with blob.open("r", encoding="utf-8") as handle: # Streams the file instead of one large download
+        for line in handle:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                records[record["id"]] = record
+    return records
+
+
+def upload_jsonl(bucket, path: str, records: list):
+    """Uploads records as JSONL to the given path."""
+    jsonl_content = "\n".join(json.dumps(record) for record in records)
+    bucket.blob(path).upload_from_string(
+        data=jsonl_content,
+        content_type='application/json' # Often treated as plain text by GCS, but good practice
+    )
+
+
+def upload_binary_artifacts(bucket, embeddings_path: str, records: list,
+                            dtypes: list = EMBEDDING_BINARY_DTYPES, dimensions=EMBEDDING_OUTPUT_DIMENSIONALITY):
+    """Writes the memory-mappable binary form of `records` for each dtype and uploads it next to the JSONL."""
+    if not records:
+        return
+    ids = [record["id"] for record in records]
+    vectors = [record["embedding"] for record in records]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for dtype in dtypes:
+            blob_prefix = artifact_prefix(embeddings_path, dtype)
+            local_files = write_artifact(os.path.join(temp_dir, os.path.basename(blob_prefix)), ids, vectors, dtype, dimensions)
+            # Metadata (the ID table) first in the list; upload it last so readers never see IDs without their matrix
+            for local_path, blob_name in reversed(list(zip(local_files, artifact_files(blob_prefix, dtype)))):
+                bucket.blob(blob_name).upload_from_filename(local_path)
+            print(f"Uploaded {dtype} binary embeddings ({len(ids)} vectors) to gs://{bucket.name}/{blob_prefix}.*")
+
+
+def generate_and_upload_embeddings(project_id, region, schema_bucket, schema_path, embeddings_bucket, embeddings_path, model_name, full_rebuild=FULL_REBUILD):
     """
-    Loads schema descriptions, generates embeddings, formats as JSONL,
-    and uploads the JSONL file to GCS for Vector Search indexing.
+    Loads schema descriptions and embeds only those that were added or changed
+    since the last run (tracked by a manifest of description hashes).
+
+    Writes to GCS:
+      * a delta JSONL with the new/changed embeddings (for incremental upsert),
+      * a deletion list with the IDs that disappeared from the schema,
+      * the merged full embeddings JSONL (for fresh index builds),
+      * the updated manifest (written last, only after the data files).
+
+    Every record carries the tenant/table `restricts` used for filtered search
+    on a shared index. Records embedded before restricts were added are sent
+    again in the delta (with their existing vectors, not re-embedded).
     """
     print("Starting embedding generation process...")
 
@@ -43,99 +199,135 @@ def generate_and_upload_embeddings(project_id, region, schema_bucket, schema_pat
         input_blob = input_bucket.blob(schema_path)
         schema_content = input_blob.download_as_string()
         schema_data = json.loads(schema_content)
-        print('schema_data',schema_data)
         print(f"Loaded {len(schema_data)} schema descriptions.")
     except Exception as e:
         print(f"Error loading schema descriptions from GCS: {e}")
         return
 
-    # --- 2. Initialize Vertex AI & Embeddings Service ---
-    try:
-        print(f"Initializing Vertex AI for project {project_id} in {region}...")
-        aiplatform.init(project=project_id, location=region)
-        print(f"Using embedding model: {model_name}")
-        # Increase default timeout for potentially long embedding calls
-        embeddings_service = VertexAIEmbeddings(
-            model_name=model_name,
-            request_parallelism=5 # Adjust based on quota/needs
-        )
-        print("Vertex AI Embeddings service initialized.")
-    except Exception as e:
-        print(f"Error initializing Vertex AI or Embeddings service: {e}")
-        return
+    # --- 2. Build stable IDs and content hashes ---
+    items_by_id = {}
+    current_hashes = {}
+    for item in schema_data:
+        if not item.get('description'):
+            print(f"Warning: Skipping schema item without description: {str(item)[:100]}")
+            continue
+        derived_id = make_schema_id(item)
+        schema_id = datapoint_id(derived_id) # The retriever namespaces the JSON's IDs the same way (tools/retriever.py)
+        if schema_id in items_by_id:
+            print(f"Error: Duplicate schema ID '{schema_id}'. Each (type, table, name) must be unique.")
+            return
+        if item.get('id') and item['id'] != derived_id:
+            print(f"Warning: Item id '{item['id']}' differs from derived ID '{derived_id}'. The retriever lookup will not match; regenerate the schema JSON.")
+        items_by_id[schema_id] = item
+        current_hashes[schema_id] = description_hash(item, model_name)
 
-    # --- 3. Prepare Data for Embedding ---
-    # Extract only the 'description' field which will be embedded
-    description_texts = [item['description'] for item in schema_data]
-
-    # Create unique IDs for each description - important for Vector Search
-    # Making IDs somewhat informative can help debugging
-    schema_ids = []
-    for i, item in enumerate(schema_data):
-        type_str = item.get('type', 'unknown')
-        table_str = item.get('table', '') # Empty for table descriptions
-        name_str = item.get('name', f'item_{i}')
-        # Basic sanitization for ID (replace spaces, ensure valid chars if needed)
-        unique_id = f"schema_{type_str}_{table_str}_{name_str}".replace('__','_').replace(' ','_').lower()
-        # Add index to ensure uniqueness if names clash after sanitization
-        unique_id = f"{unique_id}_{i}"
-        schema_ids.append(unique_id)
-
-    if not description_texts:
+    if not items_by_id:
         print("No description texts found to embed.")
         return
 
-    # --- 4. Generate Embeddings ---
+    # --- 3. Diff against the manifest of what is already embedded ---
     try:
-        print(f"Generating embeddings for {len(description_texts)} descriptions...")
-        start_time = time.time()
-        # This might take some time depending on the number of descriptions
-        vectors = embeddings_service.embed_documents(description_texts)
-        end_time = time.time()
-        print(f"Embeddings generated successfully in {end_time - start_time:.2f} seconds.")
-        if len(vectors) != len(description_texts):
-             print(f"Warning: Number of vectors ({len(vectors)}) does not match number of descriptions ({len(description_texts)}).")
-             # Handle potential partial failures if necessary
-             return # Or adjust logic
+        output_bucket = storage_client.bucket(embeddings_bucket) # Use same client
+        # Loaded even for a full rebuild: its IDs are what the index holds, so they give the deletions
+        manifest = load_json_blob(output_bucket, EMBEDDINGS_MANIFEST_PATH, {})
+        existing_records = {} if full_rebuild else load_existing_embeddings(output_bucket, embeddings_path)
+        # Deletions of earlier runs that may not have been synced into the index yet
+        pending_deleted_ids = load_json_blob(output_bucket, EMBEDDINGS_DELETIONS_PATH, [])
     except Exception as e:
-        print(f"Error generating embeddings: {e}")
+        print(f"Error loading previous manifest/embeddings from GCS: {e}")
         return
 
-    # --- 5. Format Data for Vector Search JSONL ---
-    print("Formatting data into JSONL format...")
-    jsonl_lines = []
-    for i, vector in enumerate(vectors):
-        if i < len(schema_ids): # Ensure we have a corresponding ID
-            record = {
-                "id": schema_ids[i],
-                "embedding": vector
-                # Note: Vector Search 'restricts' (metadata) are not added here,
-                # but you have schema_ids mapped back to schema_data if needed later.
-                # If adding restrictions, the JSON structure would change.
-            }
-            jsonl_lines.append(json.dumps(record))
-        else:
-            print(f"Warning: Skipping vector {i} due to missing corresponding ID.")
-
-    jsonl_content = "\n".join(jsonl_lines)
-    print(f"Generated {len(jsonl_lines)} lines for JSONL file.")
-
-    # --- 6. Upload JSONL to GCS ---
+    model_changed = bool(manifest) and manifest.get("model") != model_name
+    previous_hashes = {} if full_rebuild or model_changed else manifest.get("items", {})
+    if model_changed and not full_rebuild:
+        print(f"Embedding model changed ({manifest.get('model')} -> {model_name}). Re-embedding everything.")
+
+    changed_ids = [
+        schema_id for schema_id, digest in current_hashes.items()
+        if previous_hashes.get(schema_id) != digest or schema_id not in existing_records
+    ]
+    # Diffed against every ID embedded before, whatever the model or FULL_REBUILD
+    deleted_ids = sorted(set(manifest.get("items", {})) - set(current_hashes))
+    print(f"{len(changed_ids)} added/changed, {len(deleted_ids)} deleted, {len(current_hashes) - len(changed_ids)} unchanged.")
+    # Datapoints upserted before restricts existed would be invisible to tenant-filtered queries
+    missing_restricts = bool(manifest) and not manifest.get("restricts") and not full_rebuild
+    if missing_restricts:
+        print("Previous embeddings have no tenant/table restricts. Re-sending every unchanged record with restricts.")
+
+    if not changed_ids and not deleted_ids and not missing_restricts:
+        print("Embeddings are up to date. Nothing to do.")
+        return
+
+    # --- 4. Initialize Vertex AI & Embeddings Service ---
+    new_records = []
+    if changed_ids:
+        try:
+            print(f"Initializing Vertex AI for project {project_id} in {region}...")
+            aiplatform.init(project=project_id, location=region)
+            print(f"Using embedding model: {model_name}")
+            embeddings_service = VertexAIEmbeddings(
+                model_name=model_name,
+                request_parallelism=5 # Adjust based on quota/needs
+            )
+            print("Vertex AI Embeddings service initialized.")
+        except Exception as e:
+            print(f"Error initializing Vertex AI or Embeddings service: {e}")
+            return
+
+        # --- 5. Generate Embeddings in bounded, retried batches ---
+        try:
+            texts = [items_by_id[schema_id]['description'] for schema_id in changed_ids]
+            start_time = time.time()
+            num_calls = 0
+            for batch_ids, batch_texts in iter_embedding_batches(changed_ids, texts, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_MAX_CHARS):
+                vectors = embed_batch_with_retry(embeddings_service, batch_texts)
+                num_calls += 1
+                if len(vectors) != len(batch_texts):
+                    print(f"Error: Number of vectors ({len(vectors)}) does not match number of descriptions ({len(batch_texts)}) in batch.")
+                    return
+                new_records.extend({"id": schema_id, "embedding": vector, "restricts": datapoint_restricts(items_by_id[schema_id])}
+                                   for schema_id, vector in zip(batch_ids, vectors))
+            print(f"Embedded {len(new_records)} descriptions in {num_calls} call(s), {time.time() - start_time:.2f} seconds.")
+        except Exception as e:
+            print(f"Error generating embeddings: {e}")
+            return
+
+    # --- 6. Upload delta, deletions, merged snapshot and manifest to GCS ---
     try:
-        print(f"Uploading embeddings JSONL to gs://{embeddings_bucket}/{embeddings_path}...")
-        output_bucket = storage_client.bucket(embeddings_bucket) # Use same client
-        output_blob = output_bucket.blob(embeddings_path)
+        delta_records = list(new_records)
+        if missing_restricts:
+            changed = set(changed_ids)
+            delta_records.extend(
+                dict(existing_records[schema_id], restricts=datapoint_restricts(items_by_id[schema_id]))
+                for schema_id in current_hashes if schema_id not in changed and schema_id in existing_records
+            )
+        print(f"Uploading delta ({len(delta_records)} records) to gs://{embeddings_bucket}/{EMBEDDINGS_DELTA_JSONL_PATH}...")
+        upload_jsonl(output_bucket, EMBEDDINGS_DELTA_JSONL_PATH, delta_records)
 
-        # Upload the JSONL string content
-        output_blob.upload_from_string(
-            data=jsonl_content,
-            content_type='application/json' # Often treated as plain text by GCS, but good practice
+        # Merged with the pending list, so an unsynced earlier run's deletions are kept; re-added IDs are dropped
+        all_deleted_ids = sorted((set(pending_deleted_ids) | set(deleted_ids)) - set(current_hashes))
+        print(f"Uploading deletion list ({len(all_deleted_ids)} IDs, {len(deleted_ids)} new) to gs://{embeddings_bucket}/{EMBEDDINGS_DELETIONS_PATH}...")
+        output_bucket.blob(EMBEDDINGS_DELETIONS_PATH).upload_from_string(
+            data=json.dumps(all_deleted_ids), content_type='application/json'
         )
-        print(f"Successfully uploaded embeddings JSONL to gs://{embeddings_bucket}/{embeddings_path}")
-        print("\nProcess Complete. The embeddings JSONL file is ready in GCS for index upsert.")
+
+        merged = {schema_id: record for schema_id, record in existing_records.items() if schema_id in current_hashes}
+        merged.update((record["id"], record) for record in new_records)
+        print(f"Uploading merged embeddings ({len(merged)} records) to gs://{embeddings_bucket}/{embeddings_path}...")
+        merged_records = [dict(merged[schema_id], restricts=datapoint_restricts(items_by_id[schema_id]))
+                          for schema_id in current_hashes if schema_id in merged]
+        upload_jsonl(output_bucket, embeddings_path, merged_records)
+        upload_binary_artifacts(output_bucket, embeddings_path, merged_records)
+
+        # Manifest goes last: if anything above failed, the next run re-embeds the same delta.
+        output_bucket.blob(EMBEDDINGS_MANIFEST_PATH).upload_from_string(
+            data=json.dumps({"model": model_name, "restricts": True, "items": current_hashes}, indent=2),
+            content_type='application/json'
+        )
+        print("\nProcess Complete. Delta JSONL and deletion list are ready in GCS for index upsert.")
 
     except Exception as e:
-        print(f"Error uploading embeddings JSONL to GCS: {e}")
+        print(f"Error uploading embeddings to GCS: {e}")
 
 # --- Main execution ---
 if __name__ == "__main__":
@@ -159,4 +351,4 @@ if __name__ == "__main__":
             EMBEDDINGS_GCS_BUCKET,
             EMBEDDINGS_GCS_JSONL_PATH,
             EMBEDDING_MODEL_NAME
-        )
\ No newline at end of file
+        )
@@ -0,0 +1,260 @@
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # For agent/ and tools/ when run as a script
+
+# Synthetic mix over the demo schema (stores, products, sales_transactions): (weight, template)
+SYNTHETIC_MIX = [
+    (4, "What were the total sales in FY{fy}?"),
+    (3, "Top {n} stores by revenue in FY{fy}"),
+    (3, "Which product category sold the most units in {city}?"),
+    (2, "Monthly sales for {store} in {year}"),
+    (2, "How many stores are there in {country}?"),
+    (1, "Compare the average transaction value of {store} and {other_store} in FY{fy}"),
+    (1, "What can you help me with?"),
+]
+_FILLERS = {
+    "fy": ["2022", "2023", "2024"], "year": ["2022", "2023", "2024"], "n": ["3", "5", "10"],
+    "city": ["Singapore", "Kuala Lumpur"], "country": ["Singapore", "Malaysia"],
+    "store": ["Tampines", "Jurong", "Alexandra"], "other_store": ["Punggol", "Cheras"],
+}
+SATURATION_THROUGHPUT_RATIO = 0.95 # A step is saturated when it completes less than this share of the offered rate
+
+
+def load_questions(path: str):
+    """Questions to replay: a text file (one per line) or JSONL with a "question" field per line."""
+    with open(path, "r", encoding="utf-8") as handle:
+        lines = [line.strip() for line in handle if line.strip()]
+    if path.endswith(".jsonl"):
+        return [json.loads(line)["question"] for line in lines]
+    return lines
+
+
+def synthetic_question(rng: random.Random) -> str:
+    template = rng.choices([template for _, template in SYNTHETIC_MIX], weights=[weight for weight, _ in SYNTHETIC_MIX])[0]
+    return template.format(**{name: rng.choice(values) for name, values in _FILLERS.items()})
+
+
+def in_process_sender():
+    """Runs questions through the agent graph in this process (fake backends are selected by FAKE_BACKENDS)."""
+    from agent.runner import run_question
+
+    def send(question: str):
+        final_state = run_question(question)
+        return final_state.get("error_message"), final_state.get("node_seconds") or {}
+    return send
+
+
+def http_sender(url: str, timeout: float):
+    """POSTs questions to a running server.py (start it with FAKE_BACKENDS to load test without live services)."""
+    def send(question: str):
+        request = urllib.request.Request(url.rstrip("/") + "/query", data=json.dumps({"question": question}).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            payload = json.loads(response.read())
+        return payload.get("error"), payload.get("node_seconds") or {}
+    return send
+
+
+def _percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))] if values else float("nan")
+
+
+def _arrival_offset(expected: float, from_qps: float, qps: float, ramp_seconds: float) -> float:
+    """
+    Seconds into the step at which `expected` arrivals are due, inverting the cumulative arrival
+    count of a rate that ramps linearly from from_qps to qps and then stays at qps.
+    """
+    slope = (qps - from_qps) / ramp_seconds if ramp_seconds else 0.0
+    ramp_arrivals = from_qps * ramp_seconds + slope * ramp_seconds ** 2 / 2
+    if expected >= ramp_arrivals:
+        return ramp_seconds + (expected - ramp_arrivals) / qps
+    if slope == 0:
+        return expected / from_qps
+    return (-from_qps + math.sqrt(from_qps ** 2 + 2 * slope * expected)) / slope
+
+
+def run_step(send, next_question, from_qps: float, qps: float, ramp_seconds: float, steady_seconds: float,
+             arrivals: str, max_in_flight: int, rng: random.Random):
+    """
+    One open-loop step: arrivals are scheduled from the clock (Poisson or evenly spaced), never from
+    completions, so a slow server does not slow the offered load. The rate ramps linearly from
+    `from_qps` to `qps` over `ramp_seconds`; only requests arriving in the steady part are measured.
+    Latency is counted from the scheduled arrival, so time a request waited to be sent is included.
+    """
+    results, completions, lock = [], [], threading.Lock()
+    in_flight = [0]
+    shed = 0
+    executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="load")
+
+    def one(question: str, scheduled_at: float, measured: bool):
+        error, node_seconds = None, {}
+        try:
+            error, node_seconds = send(question)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        latency = time.perf_counter() - scheduled_at
+        with lock:
+            in_flight[0] -= 1
+            if not error:
+                completions.append(time.perf_counter())
+            if measured:
+                results.append({"latency": latency, "error": error, "node_seconds": node_seconds})
+
+    start = time.perf_counter()
+    steady_at, end = start + ramp_seconds, start + ramp_seconds + steady_seconds
+    expected = 0.0 # Arrivals expected so far; each arrival adds one (uniform) or an exponential draw (Poisson)
+    while True:
+        expected += rng.expovariate(1.0) if arrivals == "poisson" else 1.0
+        next_at = start + _arrival_offset(expected, from_qps, qps, ramp_seconds)
+        if next_at >= end:
+            break
+        time.sleep(max(0.0, next_at - time.perf_counter()))
+        measured = next_at >= steady_at
+        with lock:
+            if in_flight[0] >= max_in_flight:
+                shed += measured # Client limit reached: dropped rather than queued, keeping the load open-loop
+                continue
+            in_flight[0] += 1
+        executor.submit(one, next_question(), next_at, measured)
+    executor.shutdown(wait=True)
+
+    latencies = [result["latency"] for result in results]
+    errors = sum(1 for result in results if result["error"])
+    offered = len(results) + shed
+    # Throughput: successful completions (of any arrival) during the steady part
+    completed_in_window = sum(1 for done_at in completions if steady_at <= done_at < end)
+    return {
+        "target_qps": qps,
+        "offered_qps": offered / steady_seconds,
+        "offered": offered,
+        "completed": len(results) - errors,
+        "errors": errors,
+        "shed": shed,
+        "throughput_qps": completed_in_window / steady_seconds,
+        "p50": _percentile(latencies, 50), "p95": _percentile(latencies, 95), "p99": _percentile(latencies, 99),
+        "node_p50": {node: _percentile([r["node_seconds"][node] for r in results if node in r["node_seconds"]], 50)
+                     for node in {node for r in results for node in r["node_seconds"]}},
+    }
+
+
+def _queue_waits(metrics):
+    """p95 wait for a worker in the external-call pool, per service (in-process target only)."""
+    histograms = metrics.snapshot().get("histograms", {})
+    prefix = "external_call_queue_seconds{service="
+    return {key[len(prefix):-1]: summary["p95"] for key, summary in histograms.items() if key.startswith(prefix)}
+
+
+def print_report(steps, slo_p95: float):
+    print(f"\n{'target qps':>11}{'offered/s':>10}{'achieved':>10}{'offered':>9}{'ok':>7}{'errors':>8}{'shed':>6}{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}")
+    for step in steps:
+        print(f"{step['target_qps']:>11.2f}{step['offered_qps']:>10.2f}{step['throughput_qps']:>10.2f}{step['offered']:>9}{step['completed']:>7}"
+              f"{step['errors']:>8}{step['shed']:>6}{step['p50']:>8.2f}{step['p95']:>8.2f}{step['p99']:>8.2f}")
+
+    sustained = [step for step in steps if step["throughput_qps"] >= SATURATION_THROUGHPUT_RATIO * step["offered_qps"]
+                 and step["p95"] <= slo_p95 and step["errors"] + step["shed"] <= 0.01 * max(step["offered"], 1)]
+    last_ok = max((step["target_qps"] for step in sustained), default=0.0)
+    # The first step above the highest sustained one (short low-rate steps can miss the ratio by chance)
+    saturated = [step for step in steps if step not in sustained and step["target_qps"] > last_ok]
+    if not saturated:
+        print(f"\nNo saturation up to {steps[-1]['target_qps']:.2f} QPS (p95 SLO {slo_p95:.1f}s); extend --qps.")
+    else:
+        best = max(step["throughput_qps"] for step in steps)
+        print(f"\nSaturation point: {saturated[0]['target_qps']:.2f} QPS target; last sustained step {last_ok:.2f} QPS "
+              f"(p95 SLO {slo_p95:.1f}s); peak throughput {best:.2f} QPS.")
+
+    # Queueing per node: how much longer a node takes at each step than at the lightest step
+    baseline = steps[0]["node_p50"]
+    nodes = sorted(baseline, key=lambda node: -baseline[node])
+    if nodes:
+        print(f"\nPer-node p50 seconds at the lightest step, and queueing added at each step (p50 minus that baseline)\n")
+        print(f"{'node':<24}{'base':>8}" + "".join(f"{step['target_qps']:>9.2f}" for step in steps[1:]))
+        for node in nodes:
+            print(f"{node:<24}{baseline[node]:>8.3f}" + "".join(
+                f"{step['node_p50'].get(node, float('nan')) - baseline[node]:>+9.3f}" for step in steps[1:]))
+    if any(step.get("queue_p95") for step in steps):
+        services = sorted({service for step in steps for service in step.get("queue_p95", {})})
+        print(f"\nExternal-call pool wait p95 seconds (RESILIENCE_MAX_WORKERS)\n")
+        print(f"{'service':<24}" + "".join(f"{step['target_qps']:>9.2f}" for step in steps))
+        for service in services:
+            print(f"{service:<24}" + "".join(f"{step.get('queue_p95', {}).get(service, 0.0):>9.3f}" for step in steps))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load test of the agent: latency vs throughput and saturation point.")
+    parser.add_argument("--target", default="inprocess", help="'inprocess' or the base URL of server.py, e.g. http://localhost:8080")
+    parser.add_argument("--questions", help="Question log to replay (.txt, one per line, or .jsonl); default: synthetic mix")
+    parser.add_argument("--qps", default="0.5,1,2,4,8", help="Comma-separated target arrival rates, one step each")
+    parser.add_argument("--step-seconds", type=float, default=60, help="Measured (steady) seconds per step")
+    parser.add_argument("--ramp-up-seconds", type=float, default=10, help="Linear ramp from the previous rate before each step")
+    parser.add_argument("--arrivals", choices=("poisson", "uniform"), default="poisson")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Outstanding requests before new arrivals are shed")
+    parser.add_argument("--timeout", type=float, default=120, help="HTTP timeout per request")
+    parser.add_argument("--slo-p95", type=float, default=None, help="p95 latency SLO in seconds (default: REQUEST_DEADLINE_SECONDS)")
+    parser.add_argument("--fake-backends", help="In-process target: services to fake (sets FAKE_BACKENDS, e.g. 'all')")
+    parser.add_argument("--latency-profile", help="In-process target: fake latency profile (sets FAKE_LATENCY_PROFILE)")
+    parser.add_argument("--output", help="Also write the step results as JSON to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Before config is imported: the fakes are chosen when the clients are built
+    if args.fake_backends is not None:
+        os.environ["FAKE_BACKENDS"] = args.fake_backends
+    if args.latency_profile is not None:
+        os.environ["FAKE_LATENCY_PROFILE"] = args.latency_profile
+    import config
+    from utils.metrics import METRICS
+
+    rng = random.Random(args.seed)
+    replay = load_questions(args.questions) if args.questions else None
+    position = [0]
+    replay_lock = threading.Lock()
+
+    def next_question() -> str:
+        if replay is None:
+            with replay_lock:
+                return synthetic_question(rng)
+        with replay_lock: # Replays the log in order, looping
+            question = replay[position[0] % len(replay)]
+            position[0] += 1
+        return question
+
+    in_process = args.target == "inprocess"
+    send = in_process_sender() if in_process else http_sender(args.target, args.timeout)
+    slo_p95 = args.slo_p95 or config.REQUEST_DEADLINE_SECONDS
+    if in_process:
+        print(f"In-process target; fake backends: {config.FAKE_BACKENDS or 'none (live services)'}, "
+              f"latency profile: {config.FAKE_LATENCY_PROFILE}.")
+    else:
+        print(f"HTTP target {args.target}.")
+
+    steps, previous_qps = [], 0.0
+    for qps in [float(value) for value in args.qps.split(",") if value.strip()]:
+        print(f"Step {qps:.2f} QPS: {args.ramp_up_seconds:.0f}s ramp-up, {args.step_seconds:.0f}s measured...")
+        if in_process:
+            METRICS.reset() # Pool wait percentiles per step
+        step = run_step(send, next_question, previous_qps, qps, args.ramp_up_seconds, args.step_seconds,
+                        args.arrivals, args.max_in_flight, rng)
+        if in_process:
+            step["queue_p95"] = _queue_waits(METRICS)
+        steps.append(step)
+        previous_qps = qps
+
+    print_report(steps, slo_p95)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(steps, handle, indent=2)
+
+
+# --- Main execution ---
+if __name__ == "__main__":
+    main()
@@ -15,144 +15,144 @@ DESTINATION_BLOB_NAME = "schema_descriptions.json"
 # --- Paste the updated schema_descriptions list here ---
 schema_descriptions = [
   {
-    "id": "schema_table_stores_0", 
+    "id": "schema_table_stores", 
     "type": "table",
     "name": "stores",
     "description": "Table 'stores' contains information about company store locations. It includes unique store identifiers (store_id), the public name of the store (store_name), the city (city) and country (country) where it's located, and the date it opened (opening_date)."
   },
   {
-    "id": "schema_table_products_1", 
+    "id": "schema_table_products", 
     "type": "table",
     "name": "products",
     "description": "Table 'products' holds details about the items available for sale. It contains a unique identifier for each product (product_id), the product's name (product_name), its category (category), and its current standard selling price (price)."
   },
   {
-    "id": "schema_table_sales_transactions_2", 
+    "id": "schema_table_sales_transactions", 
     "type": "table",
     "name": "sales_transactions",
     "description": "Table 'sales_transactions' records individual product sales events. Each row represents a specific product line item within a larger customer transaction. It includes a unique identifier for the sale line (sales_id), an identifier for the overall transaction (transaction_id), foreign keys linking to the store (store_id) and product (product_id) involved, the date of the sale (sale_date), the fiscal year of the sale (FY), the number of units sold (quantity), the price per unit at the time of sale (price_at_sale), and the total amount for that line item (total_amount)."
   },
   {
-    "id": "schema_column_stores_store_id_3", 
+    "id": "schema_column_stores_store_id", 
     "type": "column",
     "table": "stores",
     "name": "store_id",
     "description": "Column 'store_id' in the 'stores' table is the unique identifier for each store location. It serves as the primary key for this table and can be used to link to the 'sales_transactions' table."
   },
   {
-    "id": "schema_column_stores_store_name_4", 
+    "id": "schema_column_stores_store_name", 
     "type": "column",
     "table": "stores",
     "name": "store_name",
     "description": "Column 'store_name' in the 'stores' table holds the common, public name of the company store."
   },
   {
-    "id": "schema_column_stores_city_5", 
+    "id": "schema_column_stores_city", 
     "type": "column",
     "table": "stores",
     "name": "city",
     "description": "Column 'city' in the 'stores' table indicates the city where the store is situated."
   },
   {
-    "id": "schema_column_stores_country_6", 
+    "id": "schema_column_stores_country", 
     "type": "column",
     "table": "stores",
     "name": "country",
     "description": "Column 'country' in the 'stores' table specifies the country where the store is located."
   },
   {
-    "id": "schema_column_stores_opening_date_7", 
+    "id": "schema_column_stores_opening_date", 
     "type": "column",
     "table": "stores",
     "name": "opening_date",
     "description": "Column 'opening_date' in the 'stores' table records the date when the store officially opened to the public."
   },
   {
-    "id": "schema_column_products_product_id_8", 
+    "id": "schema_column_products_product_id", 
     "type": "column",
     "table": "products",
     "name": "product_id",
     "description": "Column 'product_id' in the 'products' table is the unique identifier for each product. It serves as the primary key for this table and can be used to link to the 'sales_transactions' table."
   },
   {
-    "id": "schema_column_products_product_name_9", 
+    "id": "schema_column_products_product_name", 
     "type": "column",
     "table": "products",
     "name": "product_name",
     "description": "Column 'product_name' in the 'products' table contains the commercial name of the product."
   },
   {
-    "id": "schema_column_products_category_10", 
+    "id": "schema_column_products_category", 
     "type": "column",
     "table": "products",
     "name": "category",
     "description": "Column 'category' in the 'products' table classifies the product into a specific group, such as 'Furniture', 'Kitchenware', or 'Textiles'."
   },
   {
-    "id": "schema_column_products_price_11", 
+    "id": "schema_column_products_price", 
     "type": "column",
     "table": "products",
     "name": "price",
     "description": "Column 'price' in the 'products' table represents the current standard selling price per unit of the product. Note that the actual price paid in a transaction is recorded in 'sales_transactions.price_at_sale'."
   },
   {
-    "id": "schema_column_sales_transactions_sales_id_12", 
+    "id": "schema_column_sales_transactions_sales_id", 
     "type": "column",
     "table": "sales_transactions",
     "name": "sales_id",
     "description": "Column 'sales_id' in the 'sales_transactions' table is the unique identifier for each specific product line item sold within a transaction. It serves as the primary key for this table."
   },
   {
-    "id": "schema_column_sales_transactions_transaction_id_13", 
+    "id": "schema_column_sales_transactions_transaction_id", 
     "type": "column",
     "table": "sales_transactions",
     "name": "transaction_id",
     "description": "Column 'transaction_id' in the 'sales_transactions' table groups multiple sale line items belonging to the same customer purchase event (receipt)."
   },
   {
-    "id": "schema_column_sales_transactions_store_id_14", 
+    "id": "schema_column_sales_transactions_store_id", 
     "type": "column",
     "table": "sales_transactions",
     "name": "store_id",
     "description": "Column 'store_id' in the 'sales_transactions' table is a foreign key referencing the 'stores' table's 'store_id', indicating which store location made the sale."
   },
   {
-    "id": "schema_column_sales_transactions_product_id_15", 
+    "id": "schema_column_sales_transactions_product_id", 
     "type": "column",
     "table": "sales_transactions",
     "name": "product_id",
     "description": "Column 'product_id' in the 'sales_transactions' table is a foreign key referencing the 'products' table's 'product_id', identifying the specific product sold."
   },
   {
-    "id": "schema_column_sales_transactions_sale_date_16", 
+    "id": "schema_column_sales_transactions_sale_date", 
     "type": "column",
     "table": "sales_transactions",
     "name": "sale_date",
     "description": "Column 'sale_date' in the 'sales_transactions' table records the date (and potentially time) when the transaction occurred."
   },
   {
-    "id": "schema_column_sales_transactions_FY_17", 
+    "id": "schema_column_sales_transactions_FY", 
     "type": "column",
     "table": "sales_transactions",
     "name": "FY",
     "description": "Column 'FY' in the 'sales_transactions' table represents the fiscal year in which the sale occurred. This is often used for financial reporting and analysis and may be derived from the 'sale_date'."
   },
   {
-    "id": "schema_column_sales_transactions_quantity_18", 
+    "id": "schema_column_sales_transactions_quantity", 
     "type": "column",
     "table": "sales_transactions",
     "name": "quantity",
     "description": "Column 'quantity' in the 'sales_transactions' table specifies the number of units of the 'product_id' sold in this specific line item."
   },
   {
-    "id": "schema_column_sales_transactions_price_at_sale_19", 
+    "id": "schema_column_sales_transactions_price_at_sale", 
     "type": "column",
     "table": "sales_transactions",
     "name": "price_at_sale",
     "description": "Column 'price_at_sale' in the 'sales_transactions' table records the price per unit of the product *at the time the sale was made*. This might differ from the current price in the 'products' table due to promotions or price changes."
   },
   {
-    "id": "schema_column_sales_transactions_total_amount_20", 
+    "id": "schema_column_sales_transactions_total_amount", 
     "type": "column",
     "table": "sales_transactions",
     "name": "total_amount",
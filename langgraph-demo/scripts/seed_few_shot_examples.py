@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # For tools/ when run as a script
+import config
+from tools.example_store import get_example_store
+from tools.retriever import embed_query, get_schema_state
+from tools.sql_validator import validate_sql, format_validation_errors
+from utils.tenants import TENANTS, get_tenant
+
+
+def read_file(path: str):
+    """(question, sql, source) triples from a JSON list or a JSONL file of {"question": ..., "sql": ...} objects."""
+    with open(path, encoding="utf-8") as handle:
+        text = handle.read()
+    items = json.loads(text) if text.lstrip().startswith("[") else [json.loads(line) for line in text.splitlines() if line.strip()]
+    return [(item["question"], item["sql"], "seed") for item in items if item.get("question") and item.get("sql")]
+
+
+def _session_tenant(thread_id: str) -> str:
+    """The tenant a session belongs to: non-default tenants' thread IDs are "<tenant>:<session_id>" (agent/runner.py)."""
+    prefix = thread_id.split(":", 1)[0]
+    return prefix if ":" in thread_id and prefix in TENANTS else config.ADMISSION_DEFAULT_TENANT
+
+
+def read_sessions(tenant: str):
+    """(question, sql, source) triples of the tenant's past turns in the session store whose query ran and returned rows."""
+    from agent.sessions import CHECKPOINTER # Only needed for this source
+    pairs = []
+    for checkpoint in CHECKPOINTER.list(None):
+        if _session_tenant(checkpoint.config["configurable"]["thread_id"]) != tenant:
+            continue
+        for turn in checkpoint.checkpoint["channel_values"].get("history") or []:
+            if turn.get("question") and turn.get("sql_query") and turn.get("row_count"):
+                pairs.append((turn["question"], turn["sql_query"], "sessions"))
+    return pairs
+
+
+def verify(sql: str, tenant: str, dry_run: bool) -> str:
+    """Why the SQL cannot be used as an example of the tenant, or "" if it can."""
+    settings = get_tenant(tenant)
+    errors = validate_sql(sql, get_schema_state(tenant).catalog, settings.project, settings.dataset)
+    if errors:
+        return format_validation_errors(errors)
+    if dry_run:
+        from google.cloud import bigquery
+        from tools.bigquery_executor import bq_client
+        try:
+            bq_client.query(sql, job_config=bigquery.QueryJobConfig(dry_run=True, use_query_cache=False))
+        except Exception as e:
+            return f"BigQuery dry run failed: {e}"
+    return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seeds the few-shot example store (tools/example_store.py) with verified (question, SQL) pairs.")
+    parser.add_argument("--file", help="JSON list or JSONL file of {\"question\", \"sql\"} objects")
+    parser.add_argument("--from-sessions", action="store_true", help="Also use past turns in the session store that returned rows")
+    parser.add_argument("--dry-run-bigquery", action="store_true", help="Also check each query with a BigQuery dry run (no bytes billed)")
+    parser.add_argument("--tenant", default=config.ADMISSION_DEFAULT_TENANT, help="Tenant whose example store is seeded (see TENANTS)")
+    args = parser.parse_args()
+
+    store = get_example_store(args.tenant)
+    pairs = (read_file(args.file) if args.file else []) + (read_sessions(args.tenant) if args.from_sessions else [])
+    if not pairs:
+        parser.error("No examples to seed: pass --file and/or --from-sessions.")
+    added = skipped = rejected = 0
+    for question, sql, source in pairs:
+        problem = verify(sql.strip(), args.tenant, args.dry_run_bigquery)
+        if problem:
+            rejected += 1
+            print(f"Rejected '{question}': {problem}")
+            continue
+        if store.add(question, sql, embed_query(question, "seed_examples"), source=source):
+            added += 1
+        else:
+            skipped += 1
+    print(f"{added} examples added, {skipped} already stored, {rejected} rejected; "
+          f"{len(store)} in {store.path}.")
+
+
+# --- Main execution ---
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+# /nl2sql-agent/server.py
+
+import gc
+import json
+import os
+import random
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+import numpy as np
+
+import config
+# Loaded once in the parent, before forking: the schema catalog, lexical index and
+# embedding matrix are then shared with every worker (copy-on-write / shared memory).
+from tools import retriever
+from tools import embedding_store
+from utils.metrics import METRICS
+from utils.log import get_logger
+from utils.resilience import BackendBusyError
+from utils.tenants import UnknownTenantError, all_tenants
+
+logger = get_logger(__name__)
+
+_worker_index = None
+_requests_served = 0
+_requests_served_lock = threading.Lock() # Handler threads of one worker share the counter
+_max_requests = 0
+
+
+def _metrics_path(worker_index: int) -> str:
+    return os.path.join(config.SERVER_METRICS_DIR, f"worker-{worker_index}.json")
+
+
+def _publish_worker_metrics():
+    """Writes this worker's metrics snapshot atomically, so /metrics on any worker can report all of them."""
+    snapshot = {"pid": os.getpid(), "requests_served": _requests_served, "updated_at": time.time(), **METRICS.snapshot()}
+    path = _metrics_path(_worker_index)
+    # A temp file per call: handler threads publish concurrently and must not replace each other's file
+    fd, temp_path = tempfile.mkstemp(dir=config.SERVER_METRICS_DIR, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as handle:
+            json.dump(snapshot, handle, default=str)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+class AgentRequestHandler(BaseHTTPRequestHandler):
+    """POST /query {"question", "session_id"?, "tenant"?, "priority"?}; GET /metrics (all workers); GET /healthz."""
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/healthz":
+            self._send_json(200, {"status": "ok", "worker": _worker_index, "pid": os.getpid()})
+        elif self.path == "/metrics":
+            workers = {}
+            for name in sorted(os.listdir(config.SERVER_METRICS_DIR)):
+                if name.endswith(".json"):
+                    with open(os.path.join(config.SERVER_METRICS_DIR, name)) as handle:
+                        workers[name[:-len(".json")]] = json.load(handle)
+            self._send_json(200, {"workers": workers})
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        global _requests_served
+        if self.path != "/query":
+            self._send_json(404, {"error": "Not found"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            question = str(payload.get("question", "")).strip()
+        except (ValueError, TypeError):
+            self._send_json(400, {"error": "Body must be JSON with a 'question' field."})
+            return
+        if not question:
+            self._send_json(400, {"error": "Body must be JSON with a 'question' field."})
+            return
+
+        from agent.runner import run_question # Imported after fork (see _worker_main)
+        session_id = payload.get("session_id") or os.urandom(16).hex()
+        start_time = time.perf_counter()
+        try:
+            # Tenant and priority for the fair admission queues (utils/admission.py), from the body or headers
+            tenant = payload.get("tenant") or self.headers.get("X-Tenant")
+            priority = payload.get("priority") or self.headers.get("X-Priority")
+            final_state = run_question(question, session_id=session_id, tenant=tenant, priority=priority)
+            busy = bool(final_state.get("busy_backend"))
+            # Shed by admission control: 503 with Retry-After, so clients back off instead of piling on
+            self._send_json(503 if busy else 200, {
+                "answer": final_state.get("final_response") or final_state.get("error_message"),
+                "session_id": session_id,
+                "sql_query": final_state.get("sql_query"),
+                "answer_source": final_state.get("answer_source"),
+                "schema_version": final_state.get("schema_version"),
+                "error": final_state.get("error_message"),
+                "node_seconds": final_state.get("node_seconds"), # Per-node latency (scripts/load_test.py)
+                "usage": final_state.get("usage"), # Tokens, bytes billed and estimated cost
+                "busy_backend": final_state.get("busy_backend"),
+                "worker": _worker_index,
+            }, {"Retry-After": str(config.ADMISSION_BUSY_RETRY_AFTER_SECONDS)} if busy else None)
+        except UnknownTenantError as e:
+            self._send_json(400, {"error": str(e), "session_id": session_id})
+        except BackendBusyError as e:
+            # The tenant is at its request limit (utils/tenants.py): back off like any other shed request
+            self._send_json(503, {"error": str(e), "session_id": session_id, "busy_backend": e.service, "worker": _worker_index},
+                            {"Retry-After": str(config.ADMISSION_BUSY_RETRY_AFTER_SECONDS)})
+        except Exception as e:
+            logger.exception("Worker %s failed to answer: %s", _worker_index, e)
+            self._send_json(500, {"error": str(e), "session_id": session_id})
+        finally:
+            METRICS.observe("server_request_seconds", time.perf_counter() - start_time)
+            with _requests_served_lock:
+                _requests_served += 1
+                served = _requests_served
+            try:
+                _publish_worker_metrics()
+            except OSError as e:
+                logger.warning("Worker %s could not publish its metrics: %s", _worker_index, e)
+            if served == _max_requests:
+                # Recycle (once): stop accepting; the parent forks a fresh worker into this slot
+                logger.info("Worker %s (pid %d) served %d requests; recycling.", _worker_index, os.getpid(), served)
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    def log_message(self, format, *args):
+        pass # Request logging is done through metrics
+
+
+def _worker_main(worker_index: int, listen_socket: socket.socket):
+    """Worker process: imports the agent graph (creating its own clients) and serves on the shared socket."""
+    global _worker_index, _max_requests
+    _worker_index = worker_index
+    _max_requests = config.SERVER_MAX_REQUESTS_PER_WORKER + random.randint(0, config.SERVER_MAX_REQUESTS_JITTER)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # The parent handles Ctrl+C
+    import agent.runner # noqa: F401  Compiles the graph and opens this worker's clients/session store
+    METRICS.set_gauge("worker_index", worker_index)
+    _publish_worker_metrics()
+
+    server = ThreadingHTTPServer(listen_socket.getsockname()[:2], AgentRequestHandler, bind_and_activate=False)
+    server.socket = listen_socket
+    logger.info("Worker %s (pid %d) serving.", worker_index, os.getpid())
+    server.serve_forever()
+    server.server_close() # Waits for in-flight requests before the worker exits
+    os._exit(0)
+
+
+def _spawn_worker(worker_index: int, listen_socket: socket.socket) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _worker_main(worker_index, listen_socket)
+        except SystemExit:
+            pass
+        except Exception as e:
+            logger.exception("Worker %s crashed: %s", worker_index, e)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def serve(host: str = config.SERVER_HOST, port: int = config.SERVER_PORT, num_workers: int = config.SERVER_WORKERS):
+    """
+    Pre-fork server: the parent loads every tenant's schema state once, memory-maps the
+    embedding matrices or moves them into shared memory, then forks one worker per core on a shared
+    listening socket. Workers that exit (recycling or crash) are replaced.
+    """
+    os.makedirs(config.SERVER_METRICS_DIR, exist_ok=True)
+    for tenant in all_tenants():
+        logger.info("Parent %d: schema catalog of tenant %s with %d tables loaded.", os.getpid(), tenant.name,
+                    len(retriever.get_schema_state(tenant.name).catalog.tables))
+        embedding_store.get_embedding_store(tenant.embeddings_uri) # Tenants sharing a source share one store
+    stores = embedding_store.loaded_embedding_stores()
+    for store in stores:
+        store.share()
+        where = "memory-mapped" if isinstance(store.matrix, np.memmap) else "moved to shared memory"
+        logger.info("Parent %d: embedding matrix %s (%d bytes) %s.", os.getpid(), store.source_uri, store.nbytes, where)
+
+    listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listen_socket.bind((host, port))
+    listen_socket.listen(config.SERVER_BACKLOG)
+
+    gc.collect()
+    gc.freeze() # Keep the preloaded objects out of GC passes so their pages stay shared after fork
+
+    workers: Dict[int, int] = {} # pid -> worker index
+    started_at: Dict[int, float] = {} # worker index -> start time
+    for worker_index in range(num_workers):
+        workers[_spawn_worker(worker_index, listen_socket)] = worker_index
+        started_at[worker_index] = time.time()
+    logger.info("Serving on http://%s:%s with %d workers.", host, port, num_workers)
+
+    def shutdown(*_):
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(workers):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        for store in stores:
+            store.release()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    while True:
+        pid, status = os.wait()
+        worker_index = workers.pop(pid, None)
+        if worker_index is None:
+            continue
+        logger.warning("Worker %s (pid %d) exited with status %s; starting a replacement.", worker_index, pid, status)
+        if time.time() - started_at[worker_index] < 1.0:
+            time.sleep(1.0) # Avoid a tight respawn loop when workers fail at startup
+        workers[_spawn_worker(worker_index, listen_socket)] = worker_index
+        started_at[worker_index] = time.time()
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,45 @@
+# /nl2sql-agent/tests/conftest.py
+
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+# The agent reads its configuration at import time, so the test environment is set up before any test
+# module imports it. Every Google service is replaced by its local fake (tools/fake_backends.py) with no
+# latency, the schema comes from the repository's schema_descriptions.json, and local state goes to a temp dir.
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_STATE_DIR = tempfile.mkdtemp(prefix="nl2sql-tests-")
+atexit.register(shutil.rmtree, _STATE_DIR, ignore_errors=True)
+sys.path.insert(0, _REPO_DIR) # For agent/, tools/ and utils/
+
+for name, value in {
+    "GOOGLE_CLOUD_PROJECT": "test-project",
+    "GOOGLE_CLOUD_REGION": "us-central1",
+    "BQ_DATASET_ID": "retail",
+    "VECTOR_SEARCH_INDEX_ENDPOINT_NAME": "test-endpoint",
+    "VECTOR_SEARCH_DEPLOYED_INDEX_ID": "test-deployed-index",
+    "EMBEDDINGS_GCS_JSONL_PATH": "gs://test-bucket/embeddings.jsonl",
+    "MA_TEMPLATE_ID": "test-template",
+    "COMPANY_NAME": "Test Retail",
+}.items():
+    os.environ.setdefault(name, value)
+
+os.environ.update({
+    "FAKE_BACKENDS": "all",
+    "FAKE_LATENCY_PROFILE": json.dumps({service: [0, 0] for service in (
+        "llm_fast", "llm_standard", "llm_strong", "bigquery", "embeddings", "vector_search", "model_armor")}),
+    "SCHEMA_LOOKUP_GCS_URI": os.path.join(_REPO_DIR, "schema_descriptions.json"),
+    "SCHEMA_SNAPSHOT_PATH": "",
+    "SCHEMA_REFRESH_INTERVAL_SECONDS": "0",
+    "VECTOR_SEARCH_BACKEND": "remote",
+    "SESSION_DB_PATH": os.path.join(_STATE_DIR, "sessions.sqlite"),
+    "FEW_SHOT_STORE_PATH": os.path.join(_STATE_DIR, "few_shot_examples.sqlite"),
+    "EMBEDDING_CACHE_DIR": os.path.join(_STATE_DIR, "embedding_cache"),
+    "REQUEST_LOG_ENABLED": "false",
+    "WARMUP_ON_START": "false",
+    "TENANTS": "{}",
+    "LOG_LEVEL": "WARNING",
+})
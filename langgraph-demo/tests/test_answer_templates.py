@@ -0,0 +1,56 @@
+import datetime
+
+from tools.answer_templates import render_answer
+
+
+def test_scalar_uses_the_column_alias():
+    assert render_answer([{"total_sales": 1234567.5}]) == ("scalar", "Total sales: 1,234,567.50.")
+
+
+def test_single_row_lists_every_field():
+    shape, answer = render_answer([{"store_name": "Tampines", "store_id": 1001, "units_sold": 1840}])
+    assert shape == "single_row"
+    assert answer == "Store name: Tampines, store id: 1001, units sold: 1,840."
+
+
+def test_ranked_list_notes_the_order():
+    records = [{"store_name": "Tampines", "total_sales": 482310.25}, {"store_name": "Jurong", "total_sales": 410450.0}]
+    shape, answer = render_answer(records)
+    assert shape == "ranked_list"
+    assert answer.splitlines() == [
+        "Ranked by total sales:",
+        "1. Tampines - total sales: 482,310.25",
+        "2. Jurong - total sales: 410,450.00",
+    ]
+
+
+def test_time_series_is_sorted_and_summarised():
+    records = [
+        {"FY": 2024, "total_sales": 3655020.0},
+        {"FY": 2022, "total_sales": 3120400.0},
+        {"FY": 2023, "total_sales": 3398210.5},
+    ]
+    shape, answer = render_answer(records)
+    assert shape == "time_series"
+    lines = answer.splitlines()
+    assert lines[1:4] == ["- 2022: 3,120,400.00", "- 2023: 3,398,210.50", "- 2024: 3,655,020.00"]
+    assert lines[-1] == "Highest in 2024 (3,655,020.00), lowest in 2022 (3,120,400.00); +17.1% from first to last."
+
+
+def test_dates_are_periods():
+    records = [{"sale_date": datetime.date(2024, 1, day), "quantity": day * 10} for day in (2, 1)]
+    shape, answer = render_answer(records)
+    assert shape == "time_series"
+    assert answer.splitlines()[1] == "- 2024-01-01: 10"
+
+
+def test_auto_named_columns_are_left_to_the_llm():
+    assert render_answer([{"f0_": 1234567.5}]) is None
+    assert render_answer([{"store_name": "Tampines", "f1_": 3}]) is None
+    assert render_answer([{"store_name": "Tampines", "_field_2": 3}, {"store_name": "Jurong", "_field_2": 2}]) is None
+
+
+def test_unsupported_shapes_are_left_to_the_llm():
+    assert render_answer([]) is None
+    assert render_answer([{"a": 1}, {"b": 2}]) is None # Rows with different columns
+    assert render_answer([{"store_name": "Tampines", "city": "Singapore"}] * 3) is None # No measure
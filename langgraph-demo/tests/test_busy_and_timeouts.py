@@ -0,0 +1,68 @@
+import pytest
+
+import config
+from agent.runner import run_question
+from tools import fake_backends
+from utils import admission
+
+QUESTION = "What were the total sales in FY2024?"
+
+
+@pytest.fixture
+def shed(monkeypatch):
+    """Makes admission control shed every call to the given backend (a rate far below what the deadline allows)."""
+    monkeypatch.setattr(admission, "_limiters", {})
+
+    def shed_backend(service):
+        monkeypatch.setitem(config.ADMISSION_LIMITS, service, {"concurrency": 1, "rate_per_second": 0.001, "burst": 0})
+    return shed_backend
+
+
+@pytest.fixture
+def slow(monkeypatch):
+    """Gives a fake backend a fixed latency in seconds."""
+    def slow_backend(service, seconds):
+        monkeypatch.setitem(fake_backends._PROFILE, service, (seconds, seconds))
+    return slow_backend
+
+
+def test_shed_at_model_armor_stops_the_request(shed):
+    shed("model_armor")
+
+    final_state = run_question(QUESTION, session_id="shed-model-armor")
+
+    assert final_state["busy_backend"] == "model_armor"
+    assert final_state["final_response"].startswith("Sorry, the service is busy right now (model_armor")
+    assert final_state.get("intent_type") is None # Stopped before the LLM
+    assert final_state.get("sql_query") is None # and before BigQuery
+
+
+def test_shed_at_bigquery_returns_the_busy_answer(shed):
+    shed("bigquery")
+
+    final_state = run_question(QUESTION, session_id="shed-bigquery")
+
+    assert final_state["busy_backend"] == "bigquery"
+    assert final_state["sql_query"]
+    assert final_state.get("query_results") is None
+    assert "busy" in final_state["final_response"]
+
+
+def test_expired_deadline_stops_at_model_armor():
+    final_state = run_question(QUESTION, deadline_seconds=0, session_id="expired-deadline")
+
+    assert final_state["timed_out"]
+    assert not final_state.get("busy_backend")
+    assert final_state["final_response"].startswith("Sorry, I could not answer within the time allowed")
+    assert final_state.get("intent_type") is None
+
+
+def test_slow_bigquery_times_out_within_the_deadline(slow):
+    slow("bigquery", 2.0)
+
+    final_state = run_question(QUESTION, deadline_seconds=0.5, session_id="slow-bigquery")
+
+    assert final_state["timed_out"]
+    assert final_state["sql_query"]
+    assert final_state.get("query_results") is None
+    assert final_state["final_response"].startswith("Sorry, I could not answer within the time allowed (0.5s)")
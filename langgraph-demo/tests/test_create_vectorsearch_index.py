@@ -0,0 +1,112 @@
+import json
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from scripts import create_vectorsearch_index as vs
+
+RECORDS = [
+    {"id": "sales_transactions", "embedding": [0.1, 0.2, 0.3], "restricts": [{"namespace": "table", "allow": ["sales_transactions"]}]},
+    {"id": "stores", "embedding": [0.4, 0.5, 0.6], "restricts": [{"namespace": "table", "allow": ["stores"]}]},
+    {"id": "products", "embedding": [0.7, 0.8, 0.9], "restricts": [{"namespace": "table", "allow": ["products"]}]},
+]
+
+
+class _RecordingIndex(vs.LocalIndex):
+    """LocalIndex that records the IDs of every upsert and removal request, failing the first `failures` upserts."""
+
+    def __init__(self, path, failures=0):
+        super().__init__(path)
+        self.failures = failures
+        self.upserted = []
+        self.removed = []
+
+    def upsert_datapoints(self, datapoints):
+        if self.failures:
+            self.failures -= 1
+            raise google_exceptions.ServiceUnavailable("index busy")
+        self.upserted.extend(dp.datapoint_id for dp in datapoints)
+        super().upsert_datapoints(datapoints)
+
+    def remove_datapoints(self, datapoint_ids):
+        self.removed.extend(datapoint_ids)
+        super().remove_datapoints(datapoint_ids)
+
+
+def _write_jsonl(path, records):
+    path.write_text("".join(json.dumps(record) + "\n" for record in records))
+    return str(path)
+
+
+def _sync(index, records, deleted_ids=()):
+    return vs.sync_datapoints(index, records, deleted_ids=deleted_ids,
+                              read_deployed=vs.make_endpoint_reader(index, vs.DEPLOYED_INDEX_ID), batch_size=2)
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(vs, "UPSERT_RETRY_BASE_DELAY", 0)
+
+
+def test_unchanged_resync_upserts_nothing(tmp_path):
+    index_path = str(tmp_path / "index.json")
+    embeddings = _write_jsonl(tmp_path / "embeddings.jsonl", RECORDS)
+    deletions = str(tmp_path / "deletions.json") # Missing: nothing to delete
+
+    first = vs.sync_local_index(index_path, embeddings, deletions)
+    second = vs.sync_local_index(index_path, embeddings, deletions)
+
+    assert first["upserted"] == 3
+    assert second["upserted"] == 0
+    assert second["unchanged"] == 3
+    assert len(vs.LocalIndex(index_path)) == 3
+
+
+def test_changed_vector_or_restricts_upserts_only_that_id(tmp_path):
+    index = _RecordingIndex(str(tmp_path / "index.json"))
+    _sync(index, RECORDS)
+    index.upserted.clear()
+    changed = [dict(record) for record in RECORDS]
+    changed[0]["embedding"] = [0.1, 0.2, 0.35]
+    changed[1]["restricts"] = [{"namespace": "table", "allow": ["stores", "store_regions"]}]
+
+    stats = _sync(index, changed)
+
+    assert sorted(index.upserted) == ["sales_transactions", "stores"]
+    assert stats["upserted"] == 2 and stats["unchanged"] == 1
+    deployed = index.read_index_datapoints(ids=["sales_transactions", "stores"])
+    assert [list(dp.feature_vector) for dp in deployed][0] == pytest.approx([0.1, 0.2, 0.35])
+    assert vs.restricts_key(deployed[1].restricts) == [("table", ["store_regions", "stores"])]
+
+
+def test_deleted_ids_are_removed(tmp_path):
+    index_path = str(tmp_path / "index.json")
+    vs.sync_local_index(index_path, _write_jsonl(tmp_path / "embeddings.jsonl", RECORDS), str(tmp_path / "none.json"))
+    deletions = tmp_path / "deletions.json"
+    deletions.write_text(json.dumps(["products", "never_indexed"]))
+
+    stats = vs.sync_local_index(index_path, _write_jsonl(tmp_path / "delta.jsonl", []), str(deletions))
+
+    assert stats["removed"] == 2
+    index = vs.LocalIndex(index_path)
+    assert len(index) == 2
+    assert not index.read_index_datapoints(ids=["products"])
+
+
+def test_failing_batch_is_retried(tmp_path):
+    index = _RecordingIndex(str(tmp_path / "index.json"), failures=2)
+
+    stats = _sync(index, RECORDS)
+
+    assert stats["upserted"] == 3
+    assert sorted(index.upserted) == sorted(record["id"] for record in RECORDS)
+
+
+def test_batch_failing_every_retry_is_surfaced(tmp_path):
+    index = _RecordingIndex(str(tmp_path / "index.json"), failures=vs.UPSERT_MAX_RETRIES + 1)
+
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        _sync(index, RECORDS[:1])
+
+    assert index.failures == 0 # Every attempt was made
+    assert len(index) == 0
@@ -0,0 +1,118 @@
+import json
+
+import pytest
+
+import config
+from agent import nodes
+from agent.runner import run_question
+from tools.fake_backends import FakeChatModel
+
+TABLE = f"{config.GCP_PROJECT_ID}.{config.BIGQUERY_DATASET_ID}"
+VALID_SQL = f"SELECT SUM(total_amount) AS total_sales FROM `{TABLE}.sales_transactions` WHERE FY = 2024"
+# Braces in SQL (regex quantifiers, struct literals) must reach the LLM as text, not as prompt placeholders
+BRACED_SQL = f"SELECT REGEXP_EXTRACT(store_name, r'\\d{{4}}') AS store_code FROM `{TABLE}.orders`"
+
+
+class _ScriptedLLM:
+    def __init__(self):
+        self.replies = {} # Graph node -> reply; other nodes keep the fake's canned replies
+        self.prompts = [] # (node, rendered prompt) of every call
+
+    def prompt_for(self, node):
+        return [prompt for called, prompt in self.prompts if called == node][-1]
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """Scripts the fake LLM's reply per graph node and records the prompts it is sent."""
+    scripted = _ScriptedLLM()
+    canned_reply = FakeChatModel._reply
+    fake_invoke = FakeChatModel.invoke
+
+    def reply(model):
+        return scripted.replies.get(model.node) or canned_reply(model)
+
+    def invoke(model, input, run_config=None, **kwargs):
+        scripted.prompts.append((model.node, input if isinstance(input, str) else input.to_string()))
+        return fake_invoke(model, input, run_config, **kwargs)
+
+    monkeypatch.setattr(FakeChatModel, "_reply", reply)
+    monkeypatch.setattr(FakeChatModel, "invoke", invoke)
+    return scripted
+
+
+def test_invalid_sql_is_repaired_and_answered(llm):
+    llm.replies["generate_sql"] = BRACED_SQL
+    llm.replies["repair_sql"] = VALID_SQL
+
+    final_state = run_question("What were the total sales in FY2024?")
+
+    assert final_state["repair_attempts"] == 1
+    assert final_state["sql_query"] == VALID_SQL
+    assert final_state["query_results"]
+    assert not final_state.get("error_message")
+    assert "r'\\d{4}'" in llm.prompt_for("repair_sql") # The failing SQL, verbatim
+
+
+def test_repair_gives_up_after_the_attempt_limit(llm):
+    llm.replies["generate_sql"] = BRACED_SQL
+    llm.replies["repair_sql"] = BRACED_SQL
+
+    final_state = run_question("What were the total sales in FY2024?")
+
+    assert final_state["repair_attempts"] == config.SQL_REPAIR_MAX_ATTEMPTS
+    assert final_state["final_response"].startswith("Sorry, I encountered an issue")
+    assert final_state.get("query_results") is None
+
+
+def test_repair_prompt_keeps_braces_in_the_error_and_schema(llm):
+    llm.replies["repair_sql"] = VALID_SQL
+    sql_error = json.dumps({"error": {"code": 400, "message": "Unrecognized name: {store}"}})
+    state = {
+        "question": "Total sales?",
+        "sql_query": BRACED_SQL,
+        "sql_error": sql_error,
+        "schema_context": "Table sales_transactions: STRUCT<{amount}> columns",
+        "repair_attempts": 0,
+        "deadline": None,
+    }
+
+    update = nodes.repair_sql_node(state)
+
+    assert update["sql_query"] == VALID_SQL
+    assert update["error_message"] is None
+    prompt = llm.prompt_for("repair_sql")
+    assert sql_error in prompt and "STRUCT<{amount}>" in prompt
+
+
+def test_follow_up_prompt_keeps_braces_in_the_previous_sql(llm):
+    llm.replies["generate_sql"] = VALID_SQL
+    state = {
+        "question": "And only for codes {1234}?",
+        "schema_context": "Table sales_transactions: total_amount, FY",
+        "is_followup": True,
+        "history": [{"question": "Store codes", "sql_query": BRACED_SQL}],
+        "deadline": None,
+    }
+
+    update = nodes.generate_sql_node(state)
+
+    assert update["sql_query"] == VALID_SQL
+    assert not update.get("error_message")
+    prompt = llm.prompt_for("generate_sql")
+    assert BRACED_SQL in prompt and "{1234}" in prompt
+
+
+def test_response_prompt_keeps_braces_in_the_question_and_results(llm):
+    llm.replies["generate_response"] = "Sales were highest in {north}."
+    question = "Sales by {region}?"
+    records = [{"f0_": "{x}", "f1_": 3}] # Auto-named columns: phrased by the LLM, not a template
+
+    messages = nodes.build_response_prompt(question, records).format_messages()
+    update = nodes.generate_response_node({"question": question, "query_results": records, "deadline": None})
+
+    assert "{x}" in messages[0].content and messages[1].content == "Original Question: Sales by {region}?"
+    assert update["final_response"] == "Sales were highest in {north}."
+    assert update["response_renderer"] == "llm"
+    prompt = llm.prompt_for("generate_response")
+    assert "{x}" in prompt and "Sales by {region}?" in prompt
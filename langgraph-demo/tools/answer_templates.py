@@ -0,0 +1,127 @@
+# /nl2sql-agent/tools/answer_templates.py
+
+import datetime
+import decimal
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import config
+
+# Column-name hints: money-like columns get two decimals, period-like columns make a time series
+_AMOUNT_HINTS = ("amount", "sales", "revenue", "price", "cost", "spend", "value")
+_PERIOD_PATTERN = re.compile(r"(^|_)(date|day|week|month|quarter|year|fy|period)($|_)", re.IGNORECASE)
+_MAX_ROW_FIELDS = 6 # Wider single rows are left to the LLM
+_AUTO_COLUMN_PATTERN = re.compile(r"^(f\d+_|_field_\d+)$") # Names BigQuery gives unaliased expressions
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float, decimal.Decimal)) and not isinstance(value, bool)
+
+
+def _column_kind(name: str, values: List[Any]) -> str:
+    """'number', 'period' or 'text' (None values are ignored; a column of only None is 'text')."""
+    present = [value for value in values if value is not None]
+    if present and all(isinstance(value, (datetime.date, datetime.datetime)) for value in present):
+        return "period"
+    if _PERIOD_PATTERN.search(name) and present:
+        return "period" # e.g. FY = 2024 or month = '2024-01': an ordering key, not a measure
+    if present and all(_is_number(value) for value in present):
+        return "number"
+    return "text"
+
+
+def _label(name: str) -> str:
+    return name.replace("_", " ").strip()
+
+
+def _sentence(text: str) -> str:
+    return text[:1].upper() + text[1:]
+
+
+def _format_value(name: str, value: Any) -> str:
+    if value is None:
+        return "n/a"
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if _is_number(value):
+        if _PERIOD_PATTERN.search(name) or name.lower().endswith("id"):
+            return str(value) # FY 2024 or store ID 1001, not 2,024 / 1,001
+        if any(hint in name.lower() for hint in _AMOUNT_HINTS):
+            return f"{float(value):,.2f}"
+        if float(value).is_integer():
+            return f"{int(value):,}"
+        return f"{float(value):,.2f}"
+    return str(value)
+
+
+def _fields(row: Dict[str, Any], columns: List[str]) -> str:
+    return ", ".join(f"{_label(column)}: {_format_value(column, row[column])}" for column in columns)
+
+
+def _render_time_series(records: List[Dict[str, Any]], period: str, measure: str) -> str:
+    lines = [f"{_sentence(_label(measure))} by {_label(period)}:"]
+    lines += [f"- {_format_value(period, row[period])}: {_format_value(measure, row[measure])}" for row in records]
+    points = [row for row in records if row[measure] is not None]
+    if len(points) > 1:
+        highest = max(points, key=lambda row: row[measure])
+        lowest = min(points, key=lambda row: row[measure])
+        summary = (f"Highest in {_format_value(period, highest[period])} ({_format_value(measure, highest[measure])}), "
+                   f"lowest in {_format_value(period, lowest[period])} ({_format_value(measure, lowest[measure])})")
+        first, last = float(points[0][measure]), float(points[-1][measure])
+        if first:
+            summary += f"; {(last - first) / abs(first) * 100:+.1f}% from first to last"
+        lines.append(summary + ".")
+    return "\n".join(lines)
+
+
+def _render_ranked_list(records: List[Dict[str, Any]], labels: List[str], measures: List[str]) -> str:
+    values = [row[measures[0]] for row in records]
+    if None not in values and values == sorted(values, reverse=True):
+        header = f"Ranked by {_label(measures[0])}:"
+    elif None not in values and values == sorted(values):
+        header = f"Ranked by {_label(measures[0])} (lowest first):"
+    else:
+        header = f"{len(records)} results:"
+    lines = [header]
+    for number, row in enumerate(records, start=1):
+        name = " / ".join(str(row[label]) for label in labels)
+        lines.append(f"{number}. {name} - {_fields(row, measures)}")
+    return "\n".join(lines)
+
+
+def render_answer(records: List[Dict[str, Any]]) -> Optional[Tuple[str, str]]:
+    """
+    Renders common result shapes without an LLM: a single value, a single row,
+    a small ranked list (text labels with numbers) and a time series (one
+    period column with one number). Returns (shape, answer), or None for
+    shapes that need the LLM to phrase them, and for results with columns
+    BigQuery named itself (f0_), which only the question can explain.
+    """
+    if not records or len(records) > max(config.ANSWER_TEMPLATE_MAX_ROWS, config.ANSWER_TEMPLATE_MAX_SERIES_POINTS):
+        return None
+    columns = list(records[0])
+    if not columns or any(list(row) != columns for row in records):
+        return None
+    if any(_AUTO_COLUMN_PATTERN.match(column) for column in columns):
+        return None # "F0: 1,234,567.50." says nothing; the LLM phrases it from the question
+    kinds = {column: _column_kind(column, [row[column] for row in records]) for column in columns}
+    numbers = [column for column in columns if kinds[column] == "number"]
+    periods = [column for column in columns if kinds[column] == "period"]
+    texts = [column for column in columns if kinds[column] == "text"]
+
+    if len(records) == 1 and len(columns) == 1:
+        column = columns[0]
+        return "scalar", f"{_sentence(_label(column))}: {_format_value(column, records[0][column])}."
+    if len(records) == 1 and len(columns) <= _MAX_ROW_FIELDS:
+        return "single_row", _sentence(_fields(records[0], columns)) + "."
+    if len(periods) == 1 and len(numbers) == 1 and not texts and len(records) <= config.ANSWER_TEMPLATE_MAX_SERIES_POINTS:
+        period = periods[0]
+        try:
+            ordered = sorted(records, key=lambda row: (row[period] is None, row[period] if row[period] is not None else 0))
+        except TypeError:
+            return None # Mixed period types: no meaningful order
+        return "time_series", _render_time_series(ordered, period, numbers[0])
+    if texts and numbers and not periods and len(texts) <= 2 and len(numbers) <= 3 \
+            and len(records) <= config.ANSWER_TEMPLATE_MAX_ROWS:
+        return "ranked_list", _render_ranked_list(records, texts, numbers)
+    return None
@@ -5,14 +5,21 @@ from google.api_core.exceptions import GoogleAPICallError
 import pandas as pd
 from typing import List, Dict, Any, Optional
 import config # Import configuration
+from utils.resilience import call_with_resilience
+from tools.sql_validator import check_read_only, format_validation_errors
+from tools.clients import get_bigquery_client
+from utils.log import get_logger
+
+logger = get_logger(__name__)
 
 # Initialize BigQuery client globally (or manage lifespan appropriately)
 try:
     # Use project ID explicitly from config for clarity
-    bq_client = bigquery.Client(project=config.GCP_PROJECT_ID)
-    print(f"BigQuery client initialized for project '{config.GCP_PROJECT_ID}'.")
+    # Shared credentials and pooled HTTP session (tools/clients.py)
+    bq_client = get_bigquery_client()
+    logger.info("BigQuery client initialized for project '%s'.", config.GCP_PROJECT_ID)
 except Exception as e:
-    print(f"[CRITICAL] Failed to initialize BigQuery client: {e}. SQL execution will fail.")
+    logger.critical("Failed to initialize BigQuery client: %s. SQL execution will fail.", e)
     bq_client = None # Ensure bq_client is None if initialization fails
 
 def execute_bq_query(sql_query: str) -> Optional[List[Dict[str, Any]]]:
@@ -26,52 +33,54 @@ def execute_bq_query(sql_query: str) -> Optional[List[Dict[str, Any]]]:
         A list of dictionaries representing the query results,
         or None if the query fails or the client is unavailable.
     """
-    print(f"--- Executing BigQuery Query ---") # Avoid logging the full query in production
+    logger.debug("--- Executing BigQuery Query ---") # Avoid logging the full query in production
     if not bq_client:
-        print("[ERROR] BigQuery client is not available.")
+        logger.error("BigQuery client is not available.")
         return None # Return None to indicate failure
 
     if not sql_query or not isinstance(sql_query, str):
-        print("[ERROR] Invalid SQL query provided.")
+        logger.error("Invalid SQL query provided.")
         return None
 
-    # Basic safety check (can be expanded significantly)
-    disallowed_keywords = ["DROP", "DELETE", "UPDATE", "INSERT", "GRANT", "TRUNCATE", "ALTER"]
-    if any(keyword in sql_query.upper() for keyword in disallowed_keywords):
-        print(f"[ERROR] Query contains disallowed keywords: {sql_query}")
+    # Parsed read-only check (identifiers such as `last_updated` are not mistaken for UPDATE)
+    read_only_errors = check_read_only(sql_query)
+    if read_only_errors:
+        logger.error("Query rejected: %s", format_validation_errors(read_only_errors))
         return None # Reject potentially harmful queries
 
     try:
-        print(f"Running query against dataset: {config.BIGQUERY_DATASET_ID} (inferred project: {config.GCP_PROJECT_ID})")
+        logger.debug("Running query against dataset: %s (inferred project: %s)", config.BIGQUERY_DATASET_ID, config.GCP_PROJECT_ID)
         # Note: Table names in the query should ideally be fully qualified
         # e.g., `your-project-id.your-dataset-id.table_name`
         # The LLM should be prompted to generate fully qualified names if possible.
-        query_job = bq_client.query(sql_query)
+        def run_query():
+            query_job = bq_client.query(sql_query)
+
+            # Wait for the job to complete and fetch results
+            logger.debug("Waiting for query job to complete...")
+            results = query_job.result()
+            logger.debug("Query job finished.")
 
-        # Wait for the job to complete and fetch results
-        print("Waiting for query job to complete...")
-        results = query_job.result()
-        print("Query job finished.")
+            # Convert results to a list of dictionaries using Pandas for robust type handling
+            df = results.to_dataframe(create_bqstorage_client=True) # Use BQ Storage API for speed
+            return df.to_dict('records')
 
-        # Convert results to a list of dictionaries using Pandas for robust type handling
-        df = results.to_dataframe(create_bqstorage_client=True) # Use BQ Storage API for speed
-        records = df.to_dict('records')
+        # Timeout, retries and circuit breaker per utils/resilience.py
+        records = call_with_resilience("bigquery", run_query)
 
-        print(f"Query executed successfully, returned {len(records)} records.")
+        logger.info("Query executed successfully, returned %d records.", len(records))
         return records
 
     except GoogleAPICallError as api_error:
         # Catch specific BQ API errors
-        print(f"[ERROR] BigQuery API Error executing query: {api_error}")
-        # Log query for debugging if needed, but be careful in production
-        # print(f"Failed Query: {sql_query}")
+        logger.error("BigQuery API Error executing query: %s", api_error)
+        # The query itself only at DEBUG level (sampled and truncated, see utils/log.py)
+        logger.debug("Failed Query: %s", sql_query)
         return None # Indicate failure
     except Exception as e:
         # Catch any other unexpected errors
-        print(f"[ERROR] Unexpected error executing BigQuery query: {e}")
-        # print(f"Failed Query: {sql_query}") # Log query for debugging
-        import traceback
-        traceback.print_exc()
+        logger.exception("Unexpected error executing BigQuery query: %s", e)
+        logger.debug("Failed Query: %s", sql_query)
         return None # Indicate failure
 
 # Example of how to ensure fully qualified table names (could be a helper function)
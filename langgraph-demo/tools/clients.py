@@ -0,0 +1,199 @@
+# /nl2sql-agent/tools/clients.py
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional
+
+import google.auth
+import requests
+from google.auth.transport.requests import AuthorizedSession, Request
+from google.cloud import aiplatform, bigquery, storage
+from langchain_google_vertexai import VertexAIEmbeddings
+
+import config
+from tools.fake_backends import FakeBigQueryClient, FakeEmbeddings, FakeIndexEndpoint, fake_enabled
+from utils.metrics import METRICS
+from utils.log import get_logger
+
+logger = get_logger(__name__)
+
+_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+_credentials_lock = threading.Lock()
+_credentials = None
+_refresher_started = False
+
+
+def get_credentials():
+    """Application default credentials, loaded once and shared by every Google client in the process."""
+    global _credentials
+    with _credentials_lock:
+        if _credentials is None:
+            _credentials, _ = google.auth.default(scopes=_SCOPES)
+        return _credentials
+
+
+def _refresh_token():
+    credentials = get_credentials()
+    session = get_http_session() # Resolved before taking the lock: on a cold cache it calls get_credentials()
+    with _credentials_lock:
+        credentials.refresh(Request(session))
+
+
+def _token_refresh_loop():
+    """Refreshes the shared token before it expires, so no request pays for a token fetch."""
+    while True:
+        credentials = get_credentials()
+        expiry = getattr(credentials, "expiry", None)
+        if expiry is None or not credentials.valid:
+            wait_seconds = 0.0
+        else:
+            refresh_at = expiry - timedelta(seconds=config.TOKEN_REFRESH_MARGIN_SECONDS)
+            wait_seconds = max(0.0, (refresh_at - datetime.utcnow()).total_seconds())
+        time.sleep(wait_seconds)
+        try:
+            _refresh_token()
+        except Exception as e:
+            logger.warning("Background token refresh failed: %s", e)
+            time.sleep(30)
+
+
+def start_token_refresher():
+    global _refresher_started
+    with _credentials_lock:
+        if _refresher_started:
+            return
+        _refresher_started = True
+    threading.Thread(target=_token_refresh_loop, name="token-refresher", daemon=True).start()
+
+
+@lru_cache(maxsize=1)
+def get_http_session() -> AuthorizedSession:
+    """
+    One authorized HTTP session (keep-alive connection pool) for the REST
+    clients, sized to the number of concurrent external calls.
+    """
+    session = AuthorizedSession(get_credentials())
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=config.HTTP_POOL_CONNECTIONS,
+        pool_maxsize=config.HTTP_POOL_MAXSIZE,
+        pool_block=False,
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+@lru_cache(maxsize=1)
+def get_bigquery_client() -> bigquery.Client:
+    if fake_enabled("bigquery"):
+        return FakeBigQueryClient()
+    return bigquery.Client(project=config.GCP_PROJECT_ID, credentials=get_credentials(), _http=get_http_session())
+
+
+@lru_cache(maxsize=1)
+def get_storage_client() -> storage.Client:
+    return storage.Client(project=config.GCP_PROJECT_ID, credentials=get_credentials(), _http=get_http_session())
+
+
+@lru_cache(maxsize=1)
+def get_embeddings_client() -> VertexAIEmbeddings:
+    if fake_enabled("embeddings"):
+        return FakeEmbeddings()
+    return VertexAIEmbeddings(
+        model_name=config.EMBEDDING_MODEL_NAME,
+        project=config.GCP_PROJECT_ID,
+        credentials=get_credentials(),
+    )
+
+
+@lru_cache(maxsize=8)
+def get_index_endpoint(index_endpoint_name: str) -> aiplatform.MatchingEngineIndexEndpoint:
+    """Resolves the Vector Search endpoint once; its channel is then reused by every query."""
+    if fake_enabled("vector_search"):
+        return FakeIndexEndpoint()
+    return aiplatform.MatchingEngineIndexEndpoint(index_endpoint_name=index_endpoint_name, credentials=get_credentials())
+
+
+def _reset_after_fork():
+    """
+    gRPC channels, pooled connections and the refresher thread must not be
+    shared across fork(): a forked worker creates its own clients on first use.
+    """
+    global _credentials, _refresher_started, _credentials_lock
+    _credentials_lock = threading.Lock()
+    _credentials = None
+    _refresher_started = False
+    for factory in (get_http_session, get_bigquery_client, get_storage_client, get_embeddings_client, get_index_endpoint):
+        factory.cache_clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _warm_up_bigquery():
+    # Dry run: validates a trivial query without running a job or billing bytes
+    get_bigquery_client().query("SELECT 1", job_config=bigquery.QueryJobConfig(dry_run=True))
+
+
+def _warm_up_gcs():
+    bucket_name = (config.SCHEMA_LOOKUP_GCS_URI or "gs://")[5:].split("/", 1)[0]
+    get_storage_client().bucket(bucket_name).exists()
+
+
+def _warm_up_embeddings():
+    get_embeddings_client().embed_query("warm up")
+
+
+def _warm_up_vector_search():
+    get_index_endpoint(config.VECTOR_SEARCH_INDEX_ENDPOINT_NAME)
+
+
+def _warm_up_llm():
+    # Every tier a node is routed to (escalation tiers are created on first use)
+    from tools.llm_services import LLM_NODE_TIERS, get_llm, tier_for_node
+    for tier in sorted({tier_for_node(node) for node in LLM_NODE_TIERS} or {"standard"}):
+        get_llm(tier).invoke("Reply with OK.")
+
+
+_WARM_UP_CALLS: Dict[str, Callable[[], Any]] = {
+    "bigquery": _warm_up_bigquery,
+    "gcs": _warm_up_gcs,
+    "embeddings": _warm_up_embeddings,
+    "vector_search": _warm_up_vector_search,
+    "llm": _warm_up_llm,
+}
+
+
+def warm_up(services: Optional[list] = None) -> Dict[str, Optional[float]]:
+    """
+    Issues one cheap call per service in parallel at startup, so TLS
+    handshakes, token fetches and endpoint lookups are paid before the first
+    request. Returns the seconds each warm-up took (None if it failed).
+    """
+    services = services or [name.strip() for name in config.WARMUP_SERVICES.split(",") if name.strip()]
+    logger.info("--- Warming up clients: %s ---", ", ".join(services))
+    try:
+        _refresh_token()
+        start_token_refresher()
+    except Exception as e:
+        logger.warning("Could not fetch an access token during warm-up: %s", e)
+
+    def timed(service: str) -> Optional[float]:
+        start_time = time.perf_counter()
+        try:
+            _WARM_UP_CALLS[service]()
+        except Exception as e:
+            logger.warning("Warm-up call for '%s' failed: %s", service, e)
+            return None
+        elapsed = time.perf_counter() - start_time
+        METRICS.observe("warmup_seconds", elapsed, service=service)
+        return elapsed
+
+    known = [service for service in services if service in _WARM_UP_CALLS]
+    with ThreadPoolExecutor(max_workers=max(1, len(known))) as executor:
+        timings = dict(zip(known, executor.map(timed, known)))
+    logger.info("Warm-up finished: %s", {service: round(seconds, 3) if seconds is not None else None for service, seconds in timings.items()})
+    return timings
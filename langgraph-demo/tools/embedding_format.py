@@ -0,0 +1,81 @@
+# /nl2sql-agent/tools/embedding_format.py
+
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Binary embedding artifact, written next to the JSONL as files sharing a prefix
+# (see artifact_prefix, e.g. embeddings/schema_embeddings.int8):
+#   <prefix>.meta.json    {"ids": [...], "dtype": "float32" | "int8", "dim": d, "count": n}
+#   <prefix>.vectors.npy  (n, d) matrix of L2-normalised rows (float32), or their int8 quantization
+#   <prefix>.scales.npy   (n,) float32 per-row scales, int8 only: row ~= vectors[i] * scales[i]
+META_SUFFIX = ".meta.json"
+VECTORS_SUFFIX = ".vectors.npy"
+SCALES_SUFFIX = ".scales.npy"
+
+
+def artifact_prefix(jsonl_path: str, dtype: str) -> str:
+    """The artifact prefix for a JSONL snapshot path: schema_embeddings.jsonl -> schema_embeddings.<dtype>."""
+    base = jsonl_path[:-len(".jsonl")] if jsonl_path.endswith(".jsonl") else jsonl_path
+    return f"{base}.{dtype}"
+
+
+def artifact_files(prefix: str, dtype: str) -> List[str]:
+    """Paths making up an artifact (the scales file exists only for int8)."""
+    files = [prefix + META_SUFFIX, prefix + VECTORS_SUFFIX]
+    return files + [prefix + SCALES_SUFFIX] if dtype == "int8" else files
+
+
+def normalize_rows(matrix: np.ndarray, dimensions: Optional[int] = None) -> np.ndarray:
+    """
+    Optionally keeps the first `dimensions` components (how output_dimensionality
+    reduces Matryoshka-trained models such as text-embedding-004), then
+    L2-normalises every row so a dot product is the cosine similarity.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if dimensions:
+        matrix = matrix[:, :dimensions]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def quantize_int8(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization: returns (int8 matrix, float32 scales)."""
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+    quantized = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales
+
+
+def write_artifact(prefix: str, ids: List[str], vectors, dtype: str = "float32",
+                   dimensions: Optional[int] = None) -> List[str]:
+    """Writes the binary artifact for `vectors` (rows aligned with `ids`); returns the files written."""
+    if dtype not in ("float32", "int8"):
+        raise ValueError(f"Unsupported embedding dtype '{dtype}'. Use 'float32' or 'int8'.")
+    os.makedirs(os.path.dirname(prefix) or ".", exist_ok=True)
+    matrix = normalize_rows(vectors, dimensions)
+    if dtype == "int8":
+        matrix, scales = quantize_int8(matrix)
+        np.save(prefix + SCALES_SUFFIX, scales)
+    np.save(prefix + VECTORS_SUFFIX, matrix)
+    meta = {"ids": list(ids), "dtype": dtype, "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0, "count": len(ids)}
+    with open(prefix + META_SUFFIX, "w", encoding="utf-8") as handle:
+        json.dump(meta, handle)
+    return artifact_files(prefix, dtype)
+
+
+def read_artifact(prefix: str, mmap: bool = True) -> Tuple[List[str], np.ndarray, Optional[np.ndarray]]:
+    """
+    Opens an artifact. With mmap the matrix is mapped read-only rather than read,
+    so opening takes microseconds and pages are shared by every process using the file.
+    """
+    with open(prefix + META_SUFFIX, "r", encoding="utf-8") as handle:
+        meta: Dict = json.load(handle)
+    mode = "r" if mmap else None
+    vectors = np.load(prefix + VECTORS_SUFFIX, mmap_mode=mode)
+    scales = np.load(prefix + SCALES_SUFFIX, mmap_mode=mode) if meta["dtype"] == "int8" else None
+    if vectors.shape[0] != len(meta["ids"]):
+        raise ValueError(f"Embedding artifact '{prefix}' is inconsistent: {vectors.shape[0]} rows for {len(meta['ids'])} IDs.")
+    return meta["ids"], vectors, scales
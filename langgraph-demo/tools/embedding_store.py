@@ -0,0 +1,219 @@
+# /nl2sql-agent/tools/embedding_store.py
+
+import json
+import os
+import tempfile
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import config
+from utils.metrics import METRICS
+from utils.log import get_logger
+from tools.clients import get_storage_client
+from tools.embedding_format import META_SUFFIX, artifact_files, artifact_prefix, read_artifact
+
+logger = get_logger(__name__)
+
+_SCORE_CHUNK_ROWS = 65536 # Bounds the float32 temporary when scoring an int8 matrix
+
+
+class EmbeddingStore:
+    """
+    The schema embedding matrix (one L2-normalised row per schema description
+    ID) for in-process nearest-neighbour search. Rows are float32, or int8 with
+    a per-row scale. The matrix is either memory-mapped from a binary artifact
+    or moved into shared memory, so pre-forked workers read it without copies.
+    """
+
+    def __init__(self, ids: List[str], matrix: np.ndarray, scales: Optional[np.ndarray] = None):
+        self.ids = ids
+        self.matrix = matrix
+        self.scales = scales
+        # The GCS object (and its generation) this store was loaded from, for hot reload
+        self.source_uri: Optional[str] = None
+        self.generation: Optional[int] = None
+        self._shm: Optional[shared_memory.SharedMemory] = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_records(cls, records) -> "EmbeddingStore":
+        """Builds the store from {"id", "embedding"} records."""
+        ids: List[str] = []
+        rows: List[List[float]] = []
+        for record in records:
+            ids.append(record["id"])
+            rows.append(record["embedding"])
+        matrix = np.asarray(rows, dtype=np.float32).reshape(len(rows), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+        return cls(ids, matrix)
+
+    @classmethod
+    def from_artifact(cls, prefix: str) -> "EmbeddingStore":
+        """Memory-maps a binary artifact written by scripts/generate_schema_embeddings.py."""
+        ids, matrix, scales = read_artifact(prefix, mmap=True)
+        return cls(ids, matrix, scales)
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def share(self) -> None:
+        """Moves the matrix into a POSIX shared-memory block; forked workers inherit the mapping zero-copy."""
+        if self._shm is not None or self.matrix.size == 0 or isinstance(self.matrix, np.memmap):
+            return # A memory-mapped artifact is already shared through the page cache
+        self._shm = shared_memory.SharedMemory(create=True, size=self.matrix.nbytes)
+        shared = np.ndarray(self.matrix.shape, dtype=self.matrix.dtype, buffer=self._shm.buf)
+        shared[:] = self.matrix
+        shared.flags.writeable = False
+        self.matrix = shared
+
+    def release(self) -> None:
+        """Frees the shared-memory block (owner process only, at shutdown)."""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def search(self, query_embedding: List[float], num_results: int) -> List[Tuple[str, float]]:
+        """Returns up to num_results (id, cosine similarity) pairs, best first."""
+        if not self.ids:
+            return []
+        # Copy (normalised below), truncated when the artifact stores fewer dimensions
+        query = np.array(query_embedding, dtype=np.float32)[:self.matrix.shape[1]]
+        query /= (np.linalg.norm(query) or 1.0)
+        if self.scales is None:
+            scores = self.matrix @ query
+        else:
+            scores = np.empty(len(self.ids), dtype=np.float32)
+            for start in range(0, len(self.ids), _SCORE_CHUNK_ROWS):
+                chunk = self.matrix[start:start + _SCORE_CHUNK_ROWS]
+                scores[start:start + len(chunk)] = (chunk.astype(np.float32) @ query) * self.scales[start:start + len(chunk)]
+        count = min(num_results, len(self.ids))
+        top = np.argpartition(-scores, count - 1)[:count]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+
+def _blob_generation(gcs_uri: str) -> Optional[int]:
+    bucket_name, blob_name = gcs_uri[5:].split("/", 1)
+    blob = get_storage_client().bucket(bucket_name).get_blob(blob_name)
+    return blob.generation if blob is not None else None
+
+
+def iter_embedding_records(gcs_uri: str):
+    """Streams embedding records ({"id": ..., "embedding": [...]}) from a JSONL file on GCS."""
+    bucket_name, blob_name = gcs_uri[5:].split("/", 1)
+    blob = get_storage_client().bucket(bucket_name).blob(blob_name)
+    with blob.open("r", encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if line:
+                item = json.loads(line)
+                if "id" in item and "embedding" in item:
+                    yield item
+
+
+def fetch_artifact(gcs_prefix: str, dtype: str, cache_dir: str = config.EMBEDDING_CACHE_DIR) -> str:
+    """
+    Downloads a binary artifact from GCS into the local cache directory, skipping
+    files whose cached copy has the same GCS generation. Returns the local prefix.
+    """
+    bucket_name, blob_prefix = gcs_prefix[5:].split("/", 1)
+    bucket = get_storage_client().bucket(bucket_name)
+    # The full object path, so tenants' artifacts with the same file name do not overwrite each other
+    local_prefix = os.path.join(cache_dir, bucket_name, blob_prefix)
+    os.makedirs(os.path.dirname(local_prefix), exist_ok=True)
+    for blob_name, local_path in zip(artifact_files(blob_prefix, dtype), artifact_files(local_prefix, dtype)):
+        blob = bucket.get_blob(blob_name)
+        if blob is None:
+            raise FileNotFoundError(f"gs://{bucket_name}/{blob_name} does not exist.")
+        generation_path = local_path + ".generation"
+        if os.path.exists(local_path) and os.path.exists(generation_path):
+            with open(generation_path) as handle:
+                if handle.read().strip() == str(blob.generation):
+                    continue
+        # A temp file of its own: server workers and refreshers may download the same artifact at once
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(local_path), prefix=os.path.basename(local_path) + ".",
+                                         suffix=".tmp")
+        os.close(fd)
+        try:
+            blob.download_to_filename(temp_path)
+            os.replace(temp_path, local_path) # Never map a half-written file
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        with open(generation_path, "w") as handle:
+            handle.write(str(blob.generation))
+    return local_prefix
+
+
+def load_embedding_store(gcs_uri: str = config.EMBEDDINGS_GCS_JSONL_PATH) -> Optional[EmbeddingStore]:
+    """
+    Loads the embeddings written by scripts/generate_schema_embeddings.py, or None
+    on failure. The memory-mapped binary artifact is preferred (EMBEDDING_STORE_FORMAT
+    'binary'); the JSONL snapshot is parsed when it is missing or the format is 'jsonl'.
+    """
+    if config.EMBEDDING_STORE_FORMAT == "binary":
+        gcs_prefix = artifact_prefix(gcs_uri, config.EMBEDDING_STORE_DTYPE)
+        logger.info("--- Loading schema embeddings from: %s.* ---", gcs_prefix)
+        try:
+            local_prefix = fetch_artifact(gcs_prefix, config.EMBEDDING_STORE_DTYPE)
+            store = EmbeddingStore.from_artifact(local_prefix)
+            # The metadata file is uploaded last, so its generation versions the whole artifact
+            with open(local_prefix + META_SUFFIX + ".generation") as handle:
+                store.source_uri, store.generation = gcs_prefix + META_SUFFIX, int(handle.read().strip())
+            logger.info("Mapped %d %s embeddings (%d bytes, dim %d).", len(store), config.EMBEDDING_STORE_DTYPE, store.nbytes, store.matrix.shape[1])
+            return store
+        except Exception as e:
+            logger.warning("Could not load the binary embedding artifact (%s); falling back to the JSONL snapshot.", e)
+
+    logger.info("--- Loading schema embeddings from: %s ---", gcs_uri)
+    try:
+        generation = _blob_generation(gcs_uri)
+        store = EmbeddingStore.from_records(iter_embedding_records(gcs_uri))
+        store.source_uri, store.generation = gcs_uri, generation
+        logger.info("Loaded %d embeddings (%d bytes).", len(store), store.nbytes)
+        return store
+    except Exception as e:
+        logger.error("Could not load schema embeddings from %s: %s", gcs_uri, e)
+        return None
+
+
+# Loaded once per process and source (server.py loads them in the parent before forking); tenants
+# whose "embeddings_uri" is the same share one store
+_STORES: Dict[str, Optional[EmbeddingStore]] = {}
+
+
+def get_embedding_store(gcs_uri: str = config.EMBEDDINGS_GCS_JSONL_PATH) -> Optional[EmbeddingStore]:
+    """The process's embedding store for `gcs_uri`, loaded on first use when VECTOR_SEARCH_BACKEND is 'local'."""
+    if config.VECTOR_SEARCH_BACKEND != "local":
+        return None
+    if gcs_uri not in _STORES:
+        _STORES[gcs_uri] = load_embedding_store(gcs_uri)
+    return _STORES[gcs_uri]
+
+
+def loaded_embedding_stores() -> List[EmbeddingStore]:
+    return [store for store in _STORES.values() if store is not None]
+
+
+def refresh_embedding_store() -> bool:
+    """Reloads each local embedding store whose GCS source has a new generation; True if any new store was swapped in."""
+    swapped = False
+    for gcs_uri, store in list(_STORES.items()):
+        if store is None or store.source_uri is None:
+            continue
+        if _blob_generation(store.source_uri) in (None, store.generation):
+            continue
+        fresh_store = load_embedding_store(gcs_uri)
+        if fresh_store is None:
+            continue
+        _STORES[gcs_uri] = fresh_store # The old matrix stays valid for searches already running on it
+        METRICS.increment("embedding_store_reloads")
+        swapped = True
+    return swapped
@@ -0,0 +1,200 @@
+# /nl2sql-agent/tools/example_store.py
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import config
+from tools.embedding_store import EmbeddingStore
+from tools.schema_snapshot import SchemaState
+from tools.sql_validator import validate_sql
+from utils.metrics import METRICS
+from utils.request_log import normalize_question
+from utils.tenants import Tenant, get_tenant, tenant_path
+from utils.usage import estimate_tokens
+
+
+def question_key(question: str) -> str:
+    """Questions differing only in case, spacing or trailing punctuation share one example."""
+    return hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()[:16]
+
+
+class ExampleStore:
+    """
+    Verified (question, SQL) pairs for few-shot SQL generation, with an
+    embedding index over the questions. Pairs are added when their SQL ran
+    successfully in BigQuery (or by scripts/seed_few_shot_examples.py) and kept
+    in a SQLite file shared by all server workers; each process searches an
+    in-memory copy, reloaded when another process has written to the file.
+    """
+
+    def __init__(self, path: str, max_examples: int, reload_seconds: float, tenant: str = config.ADMISSION_DEFAULT_TENANT):
+        self.path = path
+        self.tenant = tenant # Metric label
+        self.max_examples = max_examples
+        self.reload_seconds = reload_seconds
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset) # The SQLite connection belongs to the parent
+
+    def _reset(self):
+        # Each process opens its own connection and loads its own copy
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._examples: Dict[str, Dict[str, Any]] = {} # question_key -> {"question", "sql", "embedding", "updated_at"}
+        self._index: Optional[EmbeddingStore] = None # Rebuilt lazily after the examples change
+        self._data_version: Optional[int] = None
+        self._checked_at = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL") # Server workers add examples concurrently
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS examples (question_key TEXT PRIMARY KEY, question TEXT NOT NULL, "
+                "sql TEXT NOT NULL, embedding BLOB NOT NULL, source TEXT, updated_at REAL NOT NULL)"
+            )
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def _sync(self) -> None:
+        """Reloads the examples if another process changed the file (checked at most every reload_seconds)."""
+        now = time.monotonic()
+        if self._data_version is not None and now - self._checked_at < self.reload_seconds:
+            return
+        self._checked_at = now
+        connection = self._connect()
+        data_version = connection.execute("PRAGMA data_version").fetchone()[0] # Changes on other connections' commits
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+        self._examples = {
+            key: {"question": question, "sql": sql, "embedding": np.frombuffer(embedding, dtype=np.float32), "updated_at": updated_at}
+            for key, question, sql, embedding, updated_at in connection.execute(
+                "SELECT question_key, question, sql, embedding, updated_at FROM examples"
+            )
+        }
+        self._index = None
+        METRICS.set_gauge("few_shot_store_size", len(self._examples), tenant=self.tenant)
+
+    def __len__(self):
+        with self._lock:
+            self._sync()
+            return len(self._examples)
+
+    def add(self, question: str, sql: str, embedding: List[float], source: str = "execution") -> bool:
+        """Adds or updates the example for `question`; False if the same pair is already stored."""
+        key = question_key(question)
+        sql = sql.strip()
+        with self._lock:
+            self._sync()
+            existing = self._examples.get(key)
+            if existing is not None and existing["sql"] == sql:
+                return False
+            vector = np.asarray(embedding, dtype=np.float32)
+            now = time.time()
+            connection = self._connect()
+            connection.execute(
+                "INSERT INTO examples (question_key, question, sql, embedding, source, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(question_key) DO UPDATE SET question = excluded.question, sql = excluded.sql, "
+                "embedding = excluded.embedding, source = excluded.source, updated_at = excluded.updated_at",
+                (key, question, sql, vector.tobytes(), source, now),
+            )
+            self._examples[key] = {"question": question, "sql": sql, "embedding": vector, "updated_at": now}
+            if len(self._examples) > self.max_examples: # Oldest examples go first
+                evicted = sorted(self._examples, key=lambda k: self._examples[k]["updated_at"])[:len(self._examples) - self.max_examples]
+                connection.executemany("DELETE FROM examples WHERE question_key = ?", [(k,) for k in evicted])
+                for evicted_key in evicted:
+                    del self._examples[evicted_key]
+            connection.commit()
+            self._index = None
+        METRICS.increment("few_shot_examples_added", source=source, tenant=self.tenant)
+        METRICS.set_gauge("few_shot_store_size", len(self._examples), tenant=self.tenant)
+        return True
+
+    def search(self, embedding: List[float], num_results: int) -> List[Dict[str, Any]]:
+        """The num_results examples whose questions are most similar, best first, each with its "similarity"."""
+        with self._lock:
+            self._sync()
+            if not self._examples:
+                return []
+            if self._index is None:
+                self._index = EmbeddingStore.from_records(
+                    {"id": key, "embedding": example["embedding"]} for key, example in self._examples.items()
+                )
+            index, examples = self._index, self._examples
+        return [{**examples[key], "key": key, "similarity": score} for key, score in index.search(embedding, num_results)]
+
+
+# Per tenant: whether each example's SQL validates against the schema version in _valid_versions (checked once per version)
+_valid: Dict[str, Dict[Tuple[str, str], bool]] = {}
+_valid_versions: Dict[str, Optional[int]] = {}
+
+
+def _still_valid(example: Dict[str, Any], schema_state: SchemaState, tenant: Tenant) -> bool:
+    if tenant.name not in _valid or _valid_versions.get(tenant.name) != schema_state.version:
+        _valid[tenant.name], _valid_versions[tenant.name] = {}, schema_state.version
+    valid = _valid[tenant.name]
+    cache_key = (example["key"], example["sql"])
+    if cache_key not in valid:
+        valid[cache_key] = not validate_sql(example["sql"], schema_state.catalog, tenant.project, tenant.dataset)
+    return valid[cache_key]
+
+
+def select_examples(embedding: List[float], schema_state: SchemaState, max_examples: int = config.FEW_SHOT_EXAMPLES,
+                    max_tokens: int = config.FEW_SHOT_MAX_TOKENS, tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    The most similar stored examples of `tenant` for a question's embedding: at
+    most max_examples, each at least FEW_SHOT_MIN_SIMILARITY similar, whose SQL
+    still validates against `schema_state`, within max_tokens of prompt.
+    """
+    tenant_settings = get_tenant(tenant)
+    selected, tokens = [], 0
+    # Spare candidates for those that no longer validate
+    for example in get_example_store(tenant_settings.name).search(embedding, max_examples * 2):
+        if len(selected) == max_examples or example["similarity"] < config.FEW_SHOT_MIN_SIMILARITY:
+            break
+        if not _still_valid(example, schema_state, tenant_settings):
+            continue # Written against a schema that has since changed
+        example_tokens = estimate_tokens(format_examples([example]))
+        if tokens + example_tokens > max_tokens:
+            break
+        selected.append(example)
+        tokens += example_tokens
+    METRICS.observe("few_shot_examples", len(selected))
+    return selected
+
+
+def format_examples(examples: List[Dict[str, Any]]) -> str:
+    return "\n\n".join(f"Question: {example['question']}\nSQL: {example['sql']}" for example in examples)
+
+
+# Opened on first use, so importing this module never touches the file
+EXAMPLE_STORE = ExampleStore(config.FEW_SHOT_STORE_PATH, config.FEW_SHOT_MAX_EXAMPLES, config.FEW_SHOT_RELOAD_SECONDS)
+_STORES: Dict[str, ExampleStore] = {config.ADMISSION_DEFAULT_TENANT: EXAMPLE_STORE}
+_stores_lock = threading.Lock()
+
+
+def get_example_store(tenant: Optional[str] = None) -> ExampleStore:
+    """The tenant's example store: its own file next to FEW_SHOT_STORE_PATH, so tenants never see each other's SQL."""
+    name = get_tenant(tenant).name
+    with _stores_lock:
+        store = _STORES.get(name)
+        if store is None:
+            store = _STORES[name] = ExampleStore(tenant_path(config.FEW_SHOT_STORE_PATH, name),
+                                                 config.FEW_SHOT_MAX_EXAMPLES, config.FEW_SHOT_RELOAD_SECONDS, name)
+        return store
+
+
+def _reset_after_fork():
+    global _stores_lock
+    _stores_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
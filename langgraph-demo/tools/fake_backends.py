@@ -0,0 +1,192 @@
+# /nl2sql-agent/tools/fake_backends.py
+
+import json
+import math
+import random
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import Runnable
+
+import config
+
+# Local stand-ins for the Google services, used by scripts/load_test.py to find how many concurrent
+# questions one instance can handle without paying for (or being rate limited by) the real services.
+# Each fake sleeps for a latency drawn from a log-normal distribution with the profile's p50 and p99,
+# so the agent's own overheads (thread pools, validation, retrieval, GIL) are what saturates.
+FAKE_SERVICES = ("llm", "bigquery", "embeddings", "vector_search", "model_armor")
+
+# Service -> (p50, p99) seconds; LLM latency is per tier
+LATENCY_PROFILES: Dict[str, Dict[str, Tuple[float, float]]] = {
+    "typical": {
+        "llm_fast": (0.4, 1.5), "llm_standard": (0.9, 3.0), "llm_strong": (2.5, 8.0),
+        "bigquery": (1.2, 6.0), "embeddings": (0.08, 0.3), "vector_search": (0.05, 0.25), "model_armor": (0.1, 0.4),
+    },
+}
+LATENCY_PROFILES["fast"] = {service: (p50 / 10, p99 / 10) for service, (p50, p99) in LATENCY_PROFILES["typical"].items()}
+LATENCY_PROFILES["slow"] = {service: (p50 * 3, p99 * 3) for service, (p50, p99) in LATENCY_PROFILES["typical"].items()}
+
+_Z_99 = 2.326 # Standard normal 99th percentile
+
+_FAKE_SQL = [
+    "SELECT SUM(total_amount) AS total_sales FROM `{dataset}.sales_transactions` WHERE FY = 2024",
+    "SELECT s.store_name, SUM(t.total_amount) AS total_sales FROM `{dataset}.sales_transactions` t "
+    "JOIN `{dataset}.stores` s ON t.store_id = s.store_id GROUP BY s.store_name ORDER BY total_sales DESC LIMIT 5",
+    "SELECT p.category, SUM(t.quantity) AS units_sold FROM `{dataset}.sales_transactions` t "
+    "JOIN `{dataset}.products` p ON t.product_id = p.product_id GROUP BY p.category ORDER BY units_sold DESC",
+    "SELECT FY, SUM(total_amount) AS total_sales FROM `{dataset}.sales_transactions` GROUP BY FY ORDER BY FY",
+]
+_FAKE_ROWS = [
+    [{"total_sales": 1234567.5}],
+    [{"store_name": name, "total_sales": amount} for name, amount in
+     [("Tampines", 482310.25), ("Jurong", 410450.0), ("Alexandra", 387300.75), ("Punggol", 201200.0), ("Cheras", 180040.5)]],
+    [{"category": category, "units_sold": units} for category, units in [("Storage", 1840), ("Sofas", 1622), ("Beds", 998)]],
+    [{"FY": 2022, "total_sales": 3120400.0}, {"FY": 2023, "total_sales": 3398210.5}, {"FY": 2024, "total_sales": 3655020.0}],
+]
+
+
+def fake_enabled(service: str) -> bool:
+    """Whether `service` is replaced by its fake (config.FAKE_BACKENDS)."""
+    enabled = {name.strip() for name in config.FAKE_BACKENDS.split(",") if name.strip()}
+    return "all" in enabled or service in enabled
+
+
+def _load_profile(spec: str) -> Dict[str, Tuple[float, float]]:
+    if spec in LATENCY_PROFILES:
+        return LATENCY_PROFILES[spec]
+    try:
+        overrides = {service: (float(p50), float(p99)) for service, (p50, p99) in json.loads(spec).items()}
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"FAKE_LATENCY_PROFILE must be one of {sorted(LATENCY_PROFILES)} or JSON "
+                         f"{{\"<service>\": [p50, p99]}}: {e}")
+    return {**LATENCY_PROFILES["typical"], **overrides}
+
+
+_PROFILE = _load_profile(config.FAKE_LATENCY_PROFILE)
+
+
+def sample_latency(service: str) -> float:
+    """A latency for one call: log-normal with the profile's median and 99th percentile."""
+    p50, p99 = _PROFILE.get(service, (0.0, 0.0))
+    if p50 <= 0:
+        return 0.0
+    sigma = math.log(max(p99, p50) / p50) / _Z_99
+    return p50 * math.exp(random.gauss(0.0, sigma))
+
+
+def _sleep(service: str, timeout: Optional[float] = None) -> None:
+    latency = sample_latency(service)
+    if timeout is not None and latency > timeout:
+        time.sleep(max(timeout, 0.0))
+        raise TimeoutError(f"Fake {service} call exceeded {timeout:.1f}s")
+    time.sleep(latency)
+
+
+class FakeChatModel(Runnable):
+    """Chat model returning a canned reply for the graph node it serves (see for_node)."""
+
+    def __init__(self, model_name: str, tier: str, node: Optional[str] = None):
+        self.model_name = model_name
+        self.tier = tier
+        self.node = node
+
+    def for_node(self, node: str) -> "FakeChatModel":
+        return FakeChatModel(self.model_name, self.tier, node)
+
+    def _reply(self) -> str:
+        if self.node == "contextualize_question":
+            return json.dumps({"followup": False, "question": "", "same_schema": False})
+        if self.node == "classify_intent":
+            return "DATABASE_QUERY"
+        if self.node == "answer_from_cache":
+            return "REMOTE"
+        if self.node in ("generate_sql", "repair_sql"):
+            dataset = f"{config.GCP_PROJECT_ID}.{config.BIGQUERY_DATASET_ID}"
+            return f"```sql\n{random.choice(_FAKE_SQL).format(dataset=dataset)}\n```"
+        return "Total sales in FY2024 were 3,655,020.00, up 7.6% on FY2023."
+
+    def invoke(self, input: Any, config: Optional[dict] = None, **kwargs: Any) -> AIMessage:
+        _sleep(f"llm_{self.tier}")
+        prompt_chars = len(input.to_string()) if hasattr(input, "to_string") else len(str(input))
+        content = self._reply()
+        return AIMessage(content=content, usage_metadata={
+            "input_tokens": prompt_chars // 4, "output_tokens": len(content) // 4,
+            "total_tokens": prompt_chars // 4 + len(content) // 4,
+        })
+
+
+def _rows_for(sql: str) -> List[Dict[str, Any]]:
+    """Rows shaped like the fake SQL's result (the first query's for any other SQL)."""
+    for marker, rows in (("store_name", _FAKE_ROWS[1]), ("category", _FAKE_ROWS[2]), ("GROUP BY FY", _FAKE_ROWS[3])):
+        if marker in sql:
+            return rows
+    return _FAKE_ROWS[0]
+
+
+class FakeQueryJob:
+    def __init__(self, sql: str, dry_run: bool):
+        self._dry_run = dry_run
+        self._done = False
+        self._rows = _rows_for(sql)
+        self.total_bytes_processed = random.randint(10 * 1024 ** 2, 2 * 1024 ** 3)
+        self.total_bytes_billed = self.total_bytes_processed
+        self.cache_hit = False
+
+    def result(self, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        if not self._dry_run:
+            _sleep("bigquery", timeout)
+        self._done = True
+        return [dict(row) for row in self._rows]
+
+    def done(self) -> bool:
+        return self._done
+
+    def cancel(self) -> bool:
+        return True
+
+
+class FakeBigQueryClient:
+    def query(self, sql: str, job_config: Any = None) -> FakeQueryJob:
+        return FakeQueryJob(sql, dry_run=bool(getattr(job_config, "dry_run", False)))
+
+
+class FakeEmbeddings:
+    def __init__(self, dimensions: int = 768):
+        self.dimensions = dimensions
+
+    def embed_query(self, text: str) -> List[float]:
+        _sleep("embeddings")
+        rng = random.Random(text) # The same text always gets the same vector
+        return [rng.gauss(0.0, 1.0) for _ in range(self.dimensions)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+
+class FakeIndexEndpoint:
+    """Vector Search endpoint returning random schema items of the current schema state as neighbours."""
+
+    def find_neighbors(self, queries: List[Any], deployed_index_id: str, num_neighbors: int,
+                       filter: Optional[List[Any]] = None) -> List[List[Any]]:
+        _sleep("vector_search")
+        from tools.retriever import get_schema_state # Imported here: tools.retriever imports the client factories
+        tenant = filter[0].allow_tokens[0] if filter else None # The tenant restrict of a multi-tenant query
+        ids = list(get_schema_state(tenant).lookup)
+        return [[SimpleNamespace(id=doc_id, distance=0.0) for doc_id in random.sample(ids, min(num_neighbors, len(ids)))]
+                for _ in queries]
+
+
+class FakeModelArmorClient:
+    """Model Armor client that never matches a filter (filter_match_state 1 = NO_MATCH_FOUND)."""
+
+    def sanitize_user_prompt(self, request: Any = None) -> Any:
+        _sleep("model_armor")
+        return SimpleNamespace(sanitization_result=SimpleNamespace(filter_match_state=1, filter_results={}))
+
+    def sanitize_model_response(self, request: Any = None) -> Any:
+        _sleep("model_armor")
+        text = getattr(getattr(request, "model_response_data", None), "text", "")
+        return SimpleNamespace(sanitization_result=SimpleNamespace(filter_match_state=1, filter_results={}),
+                               sanitized_model_response_data=SimpleNamespace(text=text))
@@ -0,0 +1,74 @@
+# /nl2sql-agent/tools/lexical_index.py
+
+import math
+import re
+from collections import Counter
+from typing import List, Dict, Tuple
+
+_WORD_PATTERN = re.compile(r"[A-Za-z0-9_]+")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "i", "in", "is", "it",
+    "its", "me", "my", "of", "on", "or", "show", "that", "the", "this", "to", "was", "what",
+    "when", "where", "which", "who", "with", "table", "column",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-cases and splits text into terms. Identifiers such as `price_at_sale`
+    are kept whole and also split into their parts, so both the exact column
+    name and its words match.
+    """
+    terms: List[str] = []
+    for word in _WORD_PATTERN.findall(text.lower()):
+        parts = [part for part in word.split("_") if part]
+        if len(parts) > 1:
+            terms.append(word)
+        terms.extend(part for part in parts if len(part) > 1 and part not in _STOPWORDS)
+    return terms
+
+
+class LexicalIndex:
+    """Okapi BM25 over an inverted index of schema descriptions, built in memory at load time."""
+
+    def __init__(self, documents: Dict[str, str], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[str, int]]] = {} # term -> [(doc id, term frequency)]
+        self.doc_lengths: Dict[str, int] = {}
+        for doc_id, text in documents.items():
+            terms = tokenize(text)
+            self.doc_lengths[doc_id] = len(terms)
+            for term, frequency in Counter(terms).items():
+                self.postings.setdefault(term, []).append((doc_id, frequency))
+        num_docs = len(self.doc_lengths)
+        self.avg_doc_length = (sum(self.doc_lengths.values()) / num_docs) if num_docs else 0.0
+        self.idf = {
+            term: math.log(1 + (num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def search(self, query: str, num_results: int) -> List[Tuple[str, float]]:
+        """Returns up to num_results (doc id, BM25 score) pairs, best first; only documents sharing a term."""
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, frequency in self.postings[term]:
+                length_norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / self.avg_doc_length
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        ranked = sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
+        return ranked[:num_results]
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    """Fuses several ranked ID lists: each ID scores sum(1 / (k + rank)) across the lists it appears in."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -1,22 +1,105 @@
 # /nl2sql-agent/tools/llm_services.py
 
 import json
+import threading
+import time
 from typing import List, Dict, Any
+from langchain_core.output_parsers import StrOutputParser
 from langchain_google_vertexai import ChatVertexAI
 from typing import Optional, List, Dict, Any # Or whatever other types you need from 'typing'
 import config # Import configuration
+from tools.clients import get_credentials
+from tools.fake_backends import FakeChatModel, fake_enabled
+from utils.metrics import METRICS
+from utils.log import get_logger
+from utils.resilience import call_with_resilience
+from utils.usage import check_llm_budget, estimate_tokens, record_llm
 
-# --- Initialize LLM Client (globally) ---
-try:
-    llm = ChatVertexAI(
-        model_name=config.GEMINI_MODEL_NAME,
+logger = get_logger(__name__)
+
+# Model tiers, cheapest and fastest first; escalation moves a node's call up this list
+LLM_TIER_ORDER = ["fast", "standard", "strong"]
+LLM_TIER_MODELS = {
+    "fast": config.GEMINI_FAST_MODEL_NAME,
+    "standard": config.GEMINI_MODEL_NAME,
+    "strong": config.GEMINI_STRONG_MODEL_NAME,
+}
+# Graph node -> tier, e.g. "classify_intent=fast,generate_sql=standard"; unlisted nodes use "standard"
+LLM_NODE_TIERS = dict(pair.split("=", 1) for pair in config.LLM_NODE_TIERS.replace(" ", "").split(",") if "=" in pair)
+
+
+def _build_llm(model_name: str) -> ChatVertexAI:
+    if fake_enabled("llm"):
+        return FakeChatModel(model_name, tier=next((tier for tier, name in LLM_TIER_MODELS.items() if name == model_name), "standard"))
+    return ChatVertexAI(
+        model_name=model_name,
         project=config.GCP_PROJECT_ID,
         location=config.GCP_REGION,
         temperature=0.1, # Lower temperature for more deterministic SQL generation
+        credentials=get_credentials(), # Shared with the other Google clients
         # stream=False, # Set to True if streaming needed later
         # safety_settings=... # Configure safety settings if needed
     )
-    print(f"LLM Client initialized with model: {config.GEMINI_MODEL_NAME}")
+
+
+# --- Initialize LLM Client (globally) ---
+try:
+    llm = _build_llm(config.GEMINI_MODEL_NAME) # The standard tier
+    logger.info("LLM Client initialized with model: %s", config.GEMINI_MODEL_NAME)
 except Exception as e:
-    print(f"[CRITICAL] Failed to initialize LLM Client: {e}. Agent will not function.")
+    logger.critical("Failed to initialize LLM Client: %s. Agent will not function.", e)
     llm = None # Ensure llm is None if failed
+
+_models: Dict[str, ChatVertexAI] = {config.GEMINI_MODEL_NAME: llm} if llm is not None else {}
+_models_lock = threading.Lock()
+_output_parser = StrOutputParser()
+
+
+def get_llm(tier: str) -> ChatVertexAI:
+    """The chat model of a tier, created on first use and shared afterwards."""
+    model_name = LLM_TIER_MODELS[tier]
+    with _models_lock:
+        if model_name not in _models:
+            _models[model_name] = _build_llm(model_name)
+            logger.info("LLM Client initialized with model: %s (%s tier)", model_name, tier)
+        return _models[model_name]
+
+
+def tier_for_node(node: str, escalation: int = 0) -> str:
+    """The node's configured tier, moved `escalation` tiers up (capped at the strongest)."""
+    base = LLM_NODE_TIERS.get(node, "standard")
+    index = LLM_TIER_ORDER.index(base) if base in LLM_TIER_ORDER else LLM_TIER_ORDER.index("standard")
+    return LLM_TIER_ORDER[min(index + escalation, len(LLM_TIER_ORDER) - 1)]
+
+
+def invoke_llm(node: str, prompt, inputs: Optional[Dict[str, Any]] = None,
+               deadline: Optional[float] = None, escalation: int = 0) -> str:
+    """
+    Runs `prompt` (a prompt template, or a plain string) on the model routed to
+    `node` and returns the text. Records per node and model: calls, latency,
+    input/output/cached tokens and cost, so the tier mapping can be tuned from
+    data; usage is also charged to the request (utils/usage.py). Raises
+    BudgetExceededError, without calling the model, if the prompt would break
+    a token or cost budget.
+    """
+    tier = tier_for_node(node, escalation)
+    model_name = LLM_TIER_MODELS[tier]
+    model = get_llm(tier)
+    if isinstance(model, FakeChatModel):
+        model = model.for_node(node) # Fakes answer in the shape the node expects
+    if escalation and tier != tier_for_node(node):
+        METRICS.increment("llm_escalations", node=node, tier=tier)
+    rendered = prompt if isinstance(prompt, str) else prompt.invoke(inputs or {}) # Rendered once, to size it before the call
+    check_llm_budget(node, estimate_tokens(rendered if isinstance(rendered, str) else rendered.to_string()))
+
+    start_time = time.perf_counter()
+    try:
+        message = call_with_resilience("llm", model.invoke, (rendered,), deadline=deadline)
+    except Exception:
+        METRICS.increment("llm_calls", node=node, model=model_name, outcome="error")
+        raise
+    METRICS.observe("llm_latency_seconds", time.perf_counter() - start_time, node=node, model=model_name)
+    METRICS.increment("llm_calls", node=node, model=model_name, outcome="ok")
+
+    record_llm(node, model_name, getattr(message, "usage_metadata", None) or {})
+    return _output_parser.invoke(message)
@@ -3,11 +3,17 @@ import vertexai
 import vertexai.generative_models as genai
 from google.cloud import modelarmor_v1
 import config
+from utils.resilience import call_with_resilience, DeadlineExceededError
+from utils.single_flight import SingleFlight
+from tools.clients import get_credentials
+from tools.fake_backends import FakeModelArmorClient, fake_enabled
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+_MODEL_ARMOR_FLIGHTS = SingleFlight("model_armor")
+
 class ModelArmorPipeline:
     def __init__(self,):
         self.project_id = config.GCP_PROJECT_ID
@@ -17,12 +23,16 @@ class ModelArmorPipeline:
         # Initialize clients
         vertexai.init(project=self.project_id, location=self.location)
         self.genai_client = genai.GenerativeModel(self.model_name)
-        self.model_armor_client = modelarmor_v1.ModelArmorClient(
-            transport="rest",
-            client_options={"api_endpoint": "modelarmor.us-central1.rep.googleapis.com"},
-        )
+        if fake_enabled("model_armor"):
+            self.model_armor_client = FakeModelArmorClient() # Load testing (tools/fake_backends.py)
+        else:
+            self.model_armor_client = modelarmor_v1.ModelArmorClient(
+                credentials=get_credentials(),
+                transport="rest",
+                client_options={"api_endpoint": "modelarmor.us-central1.rep.googleapis.com"},
+            )
 
-    def sanitize_prompt(self, prompt: str, template_id: str = config.MA_TEMPLATE_ID) -> dict:
+    def sanitize_prompt(self, prompt: str, template_id: str = config.MA_TEMPLATE_ID, deadline: float = None) -> dict:
         """Sanitize user prompt using Model Armor"""
         try:
             prompt_data = modelarmor_v1.DataItem(text=prompt)
@@ -30,14 +40,21 @@ class ModelArmorPipeline:
                 name=f"projects/{self.project_id}/locations/{self.location}/templates/{template_id}",
                 user_prompt_data=prompt_data,
             )
-            response = self.model_armor_client.sanitize_user_prompt(request=request)
+            # Concurrent checks of the same text share one call
+            response, _ = _MODEL_ARMOR_FLIGHTS.do(
+                ("prompt", template_id, prompt),
+                lambda: call_with_resilience("model_armor", self.model_armor_client.sanitize_user_prompt, kwargs={"request": request}, deadline=deadline),
+                deadline,
+            )
             
             return response
             
+        except DeadlineExceededError: # Including BackendBusyError: the request ends with the timeout/busy answer
+            raise
         except Exception as e:
             raise RuntimeError(f"Model Armor prompt sanitization failed: {e}")
 
-    def sanitize_response(self, response: str, template_id: str = config.MA_TEMPLATE_ID) -> dict:
+    def sanitize_response(self, response: str, template_id: str = config.MA_TEMPLATE_ID, deadline: float = None) -> dict:
         """Sanitize model response using Model Armor"""
         try:
             response_data = modelarmor_v1.DataItem(text=response)
@@ -45,9 +62,15 @@ class ModelArmorPipeline:
                 name=f"projects/{self.project_id}/locations/{self.location}/templates/{template_id}",
                 model_response_data=response_data,
             )
-            sanitized_response = self.model_armor_client.sanitize_model_response(request=request)
+            sanitized_response, _ = _MODEL_ARMOR_FLIGHTS.do(
+                ("response", template_id, response),
+                lambda: call_with_resilience("model_armor", self.model_armor_client.sanitize_model_response, kwargs={"request": request}, deadline=deadline),
+                deadline,
+            )
             
             return sanitized_response
             
+        except DeadlineExceededError:
+            raise
         except Exception as e:
             raise RuntimeError(f"Model Armor response sanitization failed: {e}")
\ No newline at end of file
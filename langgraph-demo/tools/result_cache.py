@@ -0,0 +1,115 @@
+# /nl2sql-agent/tools/result_cache.py
+
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+
+import config
+from utils.log import get_logger
+
+logger = get_logger(__name__)
+
+try:
+    import duckdb
+    import pyarrow as pa
+except ImportError as e:
+    logger.warning("Local result-set engine disabled (%s). Follow-ups will always query BigQuery.", e)
+    duckdb = None
+    pa = None
+
+
+class ResultSetStore:
+    """
+    Last `max_sets_per_session` result sets of each session, kept in memory as
+    Arrow tables so drill-down follow-ups can be answered locally. Sessions are
+    evicted least recently used beyond `max_sessions`.
+    """
+
+    def __init__(self, max_sets_per_session: int, max_sessions: int, max_rows: int):
+        self.max_sets_per_session = max_sets_per_session
+        self.max_sessions = max_sessions
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, deque]" = OrderedDict()
+
+    def add(self, session_id: Optional[str], question: str, records: List[Dict[str, Any]]) -> None:
+        if pa is None or not session_id or not records or len(records) > self.max_rows:
+            return
+        try:
+            table = pa.Table.from_pylist(records)
+        except Exception as e:
+            logger.warning("Could not convert result set to Arrow: %s", e)
+            return
+        with self._lock:
+            result_sets = self._sessions.pop(session_id, None) or deque(maxlen=self.max_sets_per_session)
+            result_sets.append({"question": question, "table": table})
+            self._sessions[session_id] = result_sets
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def get(self, session_id: Optional[str]) -> Dict[str, Dict[str, Any]]:
+        """Returns the session's result sets by table name: result_1 is the most recent."""
+        with self._lock:
+            result_sets = self._sessions.get(session_id) if session_id else None
+            if not result_sets:
+                return {}
+            self._sessions.move_to_end(session_id)
+            return {f"result_{number}": result_set for number, result_set in enumerate(reversed(result_sets), start=1)}
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+def describe_result_sets(result_sets: Dict[str, Dict[str, Any]], sample_rows: int = 3) -> str:
+    """Renders each cached table (name, source question, columns with types, row count, sample rows) for a prompt."""
+    lines = []
+    for name, result_set in result_sets.items():
+        table = result_set["table"]
+        columns = ", ".join(f"{field.name} {field.type}" for field in table.schema)
+        lines.append(f"- {name}({columns}) -- {table.num_rows} rows, answer to: \"{result_set['question']}\"")
+        for row in table.slice(0, sample_rows).to_pylist():
+            lines.append(f"    {row}")
+    return "\n".join(lines)
+
+
+def check_local_sql(sql: str, table_names: List[str]) -> Optional[str]:
+    """Returns an error unless `sql` is one read-only DuckDB query that only reads the given cached tables."""
+    try:
+        statements = [statement for statement in sqlglot.parse(sql, read="duckdb") if statement is not None]
+    except ParseError as e:
+        return f"SQL could not be parsed: {str(e).splitlines()[0]}"
+    if len(statements) != 1 or not isinstance(statements[0], (exp.Select, getattr(exp, "SetOperation", exp.Union))):
+        return "Expected exactly one read-only SELECT statement."
+    tree = statements[0]
+    cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    allowed = {name.lower() for name in table_names} | cte_names
+    for table in tree.find_all(exp.Table):
+        if table.db or table.name.lower() not in allowed:
+            return f"Table '{table.sql(dialect='duckdb')}' is not a cached result set."
+    return None
+
+
+def run_local_query(sql: str, result_sets: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Runs a DuckDB query over the cached Arrow tables (zero-copy) and returns the rows as dictionaries."""
+    # No file or network access: the query can only read the registered tables
+    connection = duckdb.connect(database=":memory:", config={"enable_external_access": False})
+    try:
+        for name, result_set in result_sets.items():
+            connection.register(name, result_set["table"])
+        cursor = connection.execute(sql)
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+
+# Process-wide store of recent result sets per session
+RESULT_SETS = ResultSetStore(
+    config.RESULT_CACHE_SETS_PER_SESSION, config.RESULT_CACHE_MAX_SESSIONS, config.RESULT_CACHE_MAX_ROWS
+)
+LOCAL_ENGINE_AVAILABLE = duckdb is not None
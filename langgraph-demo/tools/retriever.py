@@ -2,176 +2,406 @@
 
 import os
 import json
-from typing import List, Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
 from google.cloud import aiplatform
-from google.cloud import storage
-from langchain_google_vertexai import VertexAIEmbeddings
+from google.cloud.aiplatform.matching_engine.matching_engine_index_endpoint import Namespace
 import config # Import configuration from config.py
-
-def load_schema_lookup_from_gcs(gcs_uri: str) -> Dict[str, str]:
+from tools.lexical_index import reciprocal_rank_fusion
+from tools.schema_snapshot import SchemaState, save_snapshot, load_snapshot
+from utils.resilience import call_with_resilience
+from utils.single_flight import SingleFlight
+from utils.metrics import METRICS
+from utils.request_log import annotate
+from utils.usage import record_embedding
+from utils.log import get_logger
+from utils.tenants import Tenant, all_tenants, get_tenant, is_multi_tenant, tenant_key, tenant_path
+from tools.clients import get_credentials, get_storage_client, get_embeddings_client, get_index_endpoint
+from tools.embedding_store import get_embedding_store, refresh_embedding_store
+
+logger = get_logger(__name__)
+
+def load_schema_source(gcs_uri: str) -> Tuple[List[Dict[str, Any]], Optional[int], Optional[str]]:
     """
-    Downloads schema descriptions JSON from GCS and transforms it into a lookup dictionary.
+    Downloads schema descriptions JSON from GCS (or reads a local file) and
+    returns the valid items with the version they were read from: the GCS
+    generation and ETag, or the file's modification time in nanoseconds.
     The JSON is expected to be a list of objects, each containing an 'id' field
-    (matching the ID in Vector Search) and a 'description' field.
+    (matching the ID in Vector Search) and a 'description' field, plus the
+    'type'/'table'/'name' fields used to build the schema catalog.
     """
-    print(f"--- Loading schema lookup from GCS: {gcs_uri} ---")
-    final_lookup_dict: Dict[str, str] = {}
+    logger.info("Loading schema lookup from %s", gcs_uri)
+    items_by_id: Dict[str, Dict[str, Any]] = {}
+    generation, etag = None, None
     try:
-        if not config.GCP_PROJECT_ID:
-            print("[ERROR] GCP_PROJECT_ID is not configured. Cannot initialize GCS client.")
-            return final_lookup_dict
+        if gcs_uri and os.path.isfile(gcs_uri):
+            # A local file (development or a mounted volume): its modification time is the version
+            generation = os.stat(gcs_uri).st_mtime_ns
+            with open(gcs_uri, "r", encoding="utf-8") as handle:
+                json_data_string = handle.read()
+        else:
+            if not config.GCP_PROJECT_ID:
+                logger.error("GCP_PROJECT_ID is not configured. Cannot initialize GCS client.")
+                return [], None, None
 
-        storage_client = storage.Client(project=config.GCP_PROJECT_ID)
+            storage_client = get_storage_client()
 
-        if not gcs_uri or not gcs_uri.startswith("gs://"):
-            print(f"[ERROR] Invalid GCS URI provided: '{gcs_uri}'. It must start with 'gs://'.")
-            return final_lookup_dict
+            if not gcs_uri or not gcs_uri.startswith("gs://"):
+                logger.error("Invalid GCS URI provided: '%s'. It must start with 'gs://' or be an existing local file.", gcs_uri)
+                return [], None, None
 
-        try:
-            bucket_name, blob_name = gcs_uri[5:].split("/", 1)
-        except ValueError:
-            print(f"[ERROR] Invalid GCS URI format: '{gcs_uri}'. Expected: gs://bucket-name/path/to/blob.json")
-            return final_lookup_dict
+            try:
+                bucket_name, blob_name = gcs_uri[5:].split("/", 1)
+            except ValueError:
+                logger.error("Invalid GCS URI format: '%s'. Expected: gs://bucket-name/path/to/blob.json", gcs_uri)
+                return [], None, None
 
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(blob_name)
+            bucket = storage_client.bucket(bucket_name)
+            blob = bucket.get_blob(blob_name) # Metadata fetch: None if the object does not exist
 
-        if not blob.exists(storage_client):
-            print(f"[ERROR] GCS file not found at {gcs_uri}. Please check the path and bucket.")
-            return final_lookup_dict
+            if blob is None:
+                logger.error("GCS file not found at %s. Please check the path and bucket.", gcs_uri)
+                return [], None, None
 
-        print(f"Attempting to download {blob_name} from bucket {bucket_name}...")
-        json_data_string = blob.download_as_text(encoding='utf-8')
-        print("File downloaded successfully.")
+            logger.info("Downloading %s (generation %s) from bucket %s", blob_name, blob.generation, bucket_name)
+            # The blob carries its generation, so the download reads exactly the version stamped on the state
+            json_data_string = blob.download_as_text(encoding='utf-8')
+            generation, etag = blob.generation, blob.etag
+            logger.debug("File downloaded successfully.")
 
         loaded_json_list = json.loads(json_data_string)
 
         if not isinstance(loaded_json_list, list):
-            print(f"[ERROR] Expected a JSON array (list) from GCS, but got type: {type(loaded_json_list)}. Check the JSON file structure.")
-            return final_lookup_dict
+            logger.error("Expected a JSON array (list) from GCS, but got type: %s. Check the JSON file structure.", type(loaded_json_list))
+            return [], None, None
 
-        print(f"Processing {len(loaded_json_list)} items from JSON list to build lookup dictionary...")
+        logger.debug("Processing %d items from JSON list to build lookup dictionary...", len(loaded_json_list))
         for item in loaded_json_list:
             if not isinstance(item, dict):
-                print(f"[WARNING] Skipping non-dictionary item in JSON list: {str(item)[:100]}")
+                logger.warning("Skipping non-dictionary item in JSON list: %s", str(item)[:100])
                 continue
 
             doc_id = item.get('id') # <<< --- THIS IS THE CRITICAL LINE ---
             item_description = item.get('description')
 
             if not doc_id:
-                print(f"[WARNING] Skipping item due to missing 'id' field: {str(item)[:150]}")
+                logger.warning("Skipping item due to missing 'id' field: %s", str(item)[:150])
                 continue
             if not item_description:
-                print(f"[WARNING] Skipping item with ID '{doc_id}' due to missing 'description' field.")
+                logger.warning("Skipping item with ID '%s' due to missing 'description' field.", doc_id)
                 continue
 
-            if doc_id in final_lookup_dict:
-                print(f"[WARNING] Duplicate ID found in JSON: '{doc_id}'. Overwriting previous description. Ensure IDs are unique.")
-            final_lookup_dict[doc_id] = item_description
+            if doc_id in items_by_id:
+                logger.warning("Duplicate ID found in JSON: '%s'. Overwriting previous description. Ensure IDs are unique.", doc_id)
+            items_by_id[doc_id] = item
 
-        if not final_lookup_dict and loaded_json_list:
-             print("[ERROR] Lookup dictionary is empty after processing, though the JSON list was not. Check for 'id' and 'description' fields in your JSON items.")
+        if not items_by_id and loaded_json_list:
+             logger.error("Lookup dictionary is empty after processing, though the JSON list was not. Check for 'id' and 'description' fields in your JSON items.")
         else:
-             print(f"Successfully processed JSON. Lookup dictionary built with {len(final_lookup_dict)} entries.")
+             logger.info("Lookup dictionary built with %d entries.", len(items_by_id))
 
     except json.JSONDecodeError:
-        print(f"[ERROR] Failed to decode JSON from the file at {gcs_uri}. Ensure it's valid JSON.")
+        logger.error("Failed to decode JSON from the file at %s. Ensure it's valid JSON.", gcs_uri)
     except Exception as e:
-        print(f"[ERROR] An unexpected error occurred while loading schema lookup from GCS: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("An unexpected error occurred while loading schema lookup from GCS: %s", e)
 
-    if not final_lookup_dict:
-        print("[CRITICAL WARNING] Schema lookup dictionary is empty after all attempts. Schema retrieval will fail.")
-    return final_lookup_dict
+    if not items_by_id:
+        logger.critical("Schema lookup dictionary is empty after all attempts. Schema retrieval will fail.")
+    return list(items_by_id.values()), generation, etag
 
-# --- Load the Schema Lookup Dictionary at module import time ---
-SCHEMA_DESCRIPTION_LOOKUP = load_schema_lookup_from_gcs(config.SCHEMA_LOOKUP_GCS_URI)
 
+def load_schema_items_from_gcs(gcs_uri: str) -> List[Dict[str, Any]]:
+    """Downloads schema descriptions JSON from GCS and returns the valid items."""
+    return load_schema_source(gcs_uri)[0]
 
-if not SCHEMA_DESCRIPTION_LOOKUP:
-    print("[CRITICAL] Schema description lookup is empty. Schema retrieval will fail.")
-    # Consider raising an ImportError or setting a flag indicating failure
-else:
-    print(f"[DEBUG INFO] tools/retriever.py: SCHEMA_DESCRIPTION_LOOKUP loaded with {len(SCHEMA_DESCRIPTION_LOOKUP)} entries.")
-    loaded_keys = list(SCHEMA_DESCRIPTION_LOOKUP.keys()) # Get all keys
-    print(f"[DEBUG INFO] First 5 keys in SCHEMA_DESCRIPTION_LOOKUP: {loaded_keys[:5]}") # Print a sample
 
-# --- Initialize Vertex AI (can be done once at module level) ---
-try:
-    aiplatform.init(project=config.GCP_PROJECT_ID, location=config.GCP_REGION)
-    print(f"Vertex AI SDK initialized in retriever.py for project '{config.GCP_PROJECT_ID}'.")
-except Exception as e:
-    print(f"Error initializing Vertex AI SDK in retriever.py: {e}")
+def load_schema_lookup_from_gcs(gcs_uri: str) -> Dict[str, str]:
+    """
+    Downloads schema descriptions JSON from GCS and transforms it into a lookup dictionary
+    mapping each Vector Search ID to its description.
+    """
+    return {item['id']: item['description'] for item in load_schema_items_from_gcs(gcs_uri)}
 
+def fetch_source_version(gcs_uri: str) -> Tuple[Optional[int], Optional[str]]:
+    """The current (generation, ETag) of the schema JSON: a metadata-only request (or a stat), no download."""
+    if os.path.isfile(gcs_uri):
+        return os.stat(gcs_uri).st_mtime_ns, None
+    bucket_name, blob_name = gcs_uri[5:].split("/", 1)
+    blob = get_storage_client().bucket(bucket_name).get_blob(blob_name)
+    return (blob.generation, blob.etag) if blob is not None else (None, None)
 
-# --- Schema Retrieval Function (as defined previously) ---
-def retrieve_relevant_schema(query: str, index_endpoint_name: str, deployed_index_id: str, num_results: int = 5) -> str:
-    """Embeds query and retrieves relevant schema descriptions from Vertex AI Vector Search."""
-    print(f"\n--- Starting Schema Retrieval for query: '{query}' ---")
 
-    if not SCHEMA_DESCRIPTION_LOOKUP:
-         print("[ERROR] Cannot retrieve schema: Lookup dictionary is empty.")
-         return "Failed to retrieve schema context: Lookup data missing." # Return error message
+def build_schema_state(gcs_uri: str, tenant: Optional[str] = None) -> SchemaState:
+    """
+    Downloads the schema JSON and builds every structure derived from it, saving a snapshot for the next start.
+    A non-default tenant's item IDs are namespaced (utils/tenants.py), matching its datapoints in a shared index.
+    """
+    items, generation, etag = load_schema_source(gcs_uri)
+    items = [dict(item, id=tenant_key(tenant, item["id"])) for item in items]
+    state = SchemaState(items, gcs_uri, generation, etag)
+    snapshot_path = tenant_path(config.SCHEMA_SNAPSHOT_PATH, tenant)
+    if snapshot_path and items:
+        try:
+            save_snapshot(state, snapshot_path)
+        except Exception as e:
+            logger.warning("Could not write schema snapshot %s: %s", snapshot_path, e)
+    return state
 
-    # Ensure required config values are present
-    if not all([index_endpoint_name, deployed_index_id, config.GCP_PROJECT_ID, config.GCP_REGION]):
-         print("[ERROR] Missing required configuration for Vector Search.")
-         return "Failed to retrieve schema context: Configuration missing."
 
+def refresh_schema_state(tenant: Optional[str] = None) -> bool:
+    """
+    Rebuilds the tenant's schema state off the request path if its source
+    changed, then swaps it in. Returns True if a new state was installed.
+    """
+    name = get_tenant(tenant).name
+    state = get_schema_state(name)
+    generation, etag = fetch_source_version(state.source_uri)
+    if generation is None or (generation, etag) == (state.generation, state.etag):
+        return False
+    logger.info("Schema source of tenant %s changed (version %s -> %s); rebuilding in the background.",
+                name, state.version, generation)
+    start_time = time.perf_counter()
+    fresh_state = build_schema_state(state.source_uri, name)
+    if not fresh_state.items:
+        logger.warning("Rebuilt schema state is empty; keeping the current one.")
+        return False
+    _install_schema_state(name, fresh_state)
+    METRICS.increment("schema_reloads", tenant=name)
+    METRICS.observe("schema_reload_seconds", time.perf_counter() - start_time)
+    logger.info("Schema state of tenant %s swapped to version %s (%d entries).", name, fresh_state.version, len(fresh_state.lookup))
+    return True
+
+
+def _schema_refresh_loop(interval_seconds: float):
+    while True:
+        time.sleep(interval_seconds)
+        for name in list(_SCHEMA_STATES): # Tenants whose state this process has loaded
+            try:
+                refresh_schema_state(name)
+            except Exception as e:
+                logger.warning("Schema refresh of tenant %s failed; keeping version %s: %s", name, _SCHEMA_STATES[name].version, e)
+        try:
+            refresh_embedding_store()
+        except Exception as e:
+            logger.warning("Embedding store refresh failed: %s", e)
+
+
+def start_schema_refresher(interval_seconds: float = config.SCHEMA_REFRESH_INTERVAL_SECONDS):
+    """Polls the schema source (and the local embedding artifact) every interval_seconds; 0 disables polling."""
+    global _refresher_started
+    with _refresher_lock:
+        if _refresher_started or interval_seconds <= 0:
+            return
+        _refresher_started = True
+    threading.Thread(target=_schema_refresh_loop, args=(interval_seconds,), name="schema-refresher", daemon=True).start()
+
+
+def _check_snapshot_freshness(tenant: str):
+    """Startup freshness check for a snapshot-loaded state."""
     try:
-        # Initialize embedding service inside function or reuse a global instance
-        embeddings_service = VertexAIEmbeddings(
-            model_name=config.EMBEDDING_MODEL_NAME,
-            project=config.GCP_PROJECT_ID,
-            # location=config.GCP_REGION # Location might not be needed here, depends on SDK version/defaults
-        )
-        # print(f"Using embedding model: {config.EMBEDDING_MODEL_NAME}") # Debug log
+        if not refresh_schema_state(tenant):
+            logger.info("Schema snapshot of tenant %s is current (version %s).", tenant, get_schema_state(tenant).version)
+    except Exception as e:
+        logger.warning("Schema snapshot freshness check of tenant %s failed; keeping the snapshot: %s", tenant, e)
 
-        query_embedding = embeddings_service.embed_query(query)
-        # print(f"Query embedded into vector dim {len(query_embedding)}.") # Debug log
 
-        index_endpoint = aiplatform.MatchingEngineIndexEndpoint(index_endpoint_name=index_endpoint_name)
-        print(f"Connecting to endpoint: {index_endpoint_name}") # Debug log
+def _load_initial_schema_state(tenant: Tenant) -> SchemaState:
+    """
+    Startup path: a local snapshot (if one was built from the same source) is
+    loaded and checked for freshness in the background; otherwise the state is
+    built from the source (GCS or a local file).
+    """
+    start_time = time.perf_counter()
+    state = load_snapshot(tenant_path(config.SCHEMA_SNAPSHOT_PATH, tenant.name), tenant.schema_uri)
+    source = "snapshot" if state is not None else "source"
+    if state is None:
+        state = build_schema_state(tenant.schema_uri, tenant.name)
+    else:
+        threading.Thread(target=_check_snapshot_freshness, args=(tenant.name,), name="schema-freshness", daemon=True).start()
+    elapsed = time.perf_counter() - start_time
+    METRICS.set_gauge("schema_load_seconds", elapsed, source=source, tenant=tenant.name)
+    logger.info("Schema state of tenant %s loaded from %s in %.1f ms (version %s).", tenant.name, source, elapsed * 1000, state.version)
+    if not state.lookup:
+        logger.critical("Schema description lookup of tenant %s is empty. Schema retrieval will fail.", tenant.name)
+    return state
+
+
+# --- Load the schema state at module import time ---
+# Read through get_schema_state(): each tenant's state object is replaced as a whole when its source changes.
+_refresher_lock = threading.Lock()
+_refresher_started = False
+_SCHEMA_STATES: Dict[str, SchemaState] = {} # Tenant name -> current state; other tenants load on first use
+_schema_states_lock = threading.Lock()
+
+
+def get_schema_state(tenant: Optional[str] = None) -> SchemaState:
+    """The current schema state of `tenant` (default: the default tenant). Raises UnknownTenantError."""
+    name = tenant or config.ADMISSION_DEFAULT_TENANT
+    state = _SCHEMA_STATES.get(name)
+    if state is None:
+        tenant_settings = get_tenant(name)
+        with _schema_states_lock: # One load per tenant, even when its first requests arrive together
+            state = _SCHEMA_STATES.get(name)
+            if state is None:
+                state = _load_initial_schema_state(tenant_settings)
+                _install_schema_state(name, state)
+    return state
+
+
+def _install_schema_state(tenant: str, state: SchemaState):
+    # A single reference assignment: requests see the old or the new state, never a mix
+    _SCHEMA_STATES[tenant] = state
+    METRICS.set_gauge("schema_version", state.version or 0, tenant=tenant)
+
+
+def _reset_after_fork():
+    # The refresher thread does not survive fork(); each worker starts its own
+    global _refresher_lock, _refresher_started, _recent_embeddings_lock, _schema_states_lock
+    _refresher_lock = threading.Lock()
+    _refresher_started = False
+    _recent_embeddings_lock = threading.Lock()
+    _schema_states_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+SCHEMA_STATE: SchemaState = get_schema_state() # The default tenant's state at import time
+
+
+if SCHEMA_STATE.lookup:
+    logger.debug("Schema lookup loaded with %d entries.", len(SCHEMA_STATE.lookup))
+    loaded_keys = list(SCHEMA_STATE.lookup.keys()) # Get all keys
+    logger.debug("First 5 keys in the schema lookup: %s", loaded_keys[:5]) # Log a sample
 
-        response = index_endpoint.find_neighbors(
-            queries=[query_embedding],
-            deployed_index_id=deployed_index_id,
-            num_neighbors=num_results
-        )
-        print("Received response from Vector Search.") # Debug log
-
-        #print('SCHEMA_DESCRIPTION_LOOKUP ---------',SCHEMA_DESCRIPTION_LOOKUP)
-        #print('response-----',response)
-
-
-        relevant_docs_text: List[str] = []
-        if response and response[0]:
-            neighbors = response[0]
-            # print(f"Found {len(neighbors)} potential neighbors.") # Debug log
-            for neighbor in neighbors:
-                neighbor_id = neighbor.id
-                description = SCHEMA_DESCRIPTION_LOOKUP.get(neighbor_id)
-                if description:
-                    relevant_docs_text.append(description)
-                    # print(f"  Mapped ID '{neighbor_id}' to description.") # Debug log
-                else:
-                    print(f"[Warning] Could not find description for ID: '{neighbor_id}'. Check JSON and index IDs.")
-        else:
-            print("Vector Search returned no neighbors.")
+# --- Initialize Vertex AI (can be done once at module level) ---
+try:
+    aiplatform.init(project=config.GCP_PROJECT_ID, location=config.GCP_REGION, credentials=get_credentials())
+    logger.info("Vertex AI SDK initialized for project '%s'.", config.GCP_PROJECT_ID)
+except Exception as e:
+    logger.error("Error initializing Vertex AI SDK: %s", e)
+
+_EMBEDDING_FLIGHTS = SingleFlight("embeddings")
+# Recent query embeddings: schema retrieval and the few-shot example store (tools/example_store.py) embed the same question
+_RECENT_EMBEDDINGS: "OrderedDict[str, List[float]]" = OrderedDict()
+_recent_embeddings_lock = threading.Lock()
+
+
+def embed_query(query: str, node: str, deadline: Optional[float] = None) -> List[float]:
+    """Embeds a question, reusing a recent embedding of the same text; the call is charged to `node`."""
+    with _recent_embeddings_lock:
+        if query in _RECENT_EMBEDDINGS:
+            _RECENT_EMBEDDINGS.move_to_end(query)
+            return _RECENT_EMBEDDINGS[query]
+    # Clients are created once per process and shared (tools/clients.py)
+    embeddings_service = get_embeddings_client()
+    # Concurrent requests embedding the same text share one call
+    query_embedding, shared = _EMBEDDING_FLIGHTS.do(
+        query, lambda: call_with_resilience("embeddings", embeddings_service.embed_query, (query,), deadline=deadline), deadline
+    )
+    if not shared:
+        record_embedding(node, len(query)) # Charged to the request that made the call
+    with _recent_embeddings_lock:
+        _RECENT_EMBEDDINGS[query] = query_embedding
+        while len(_RECENT_EMBEDDINGS) > config.EMBEDDING_QUERY_CACHE_SIZE:
+            _RECENT_EMBEDDINGS.popitem(last=False)
+    return query_embedding
+
+
+def _vector_search_ids(query: str, index_endpoint_name: str, deployed_index_id: str, num_results: int,
+                      lookup: Dict[str, str], deadline: Optional[float] = None, tenant: Optional[str] = None) -> List[str]:
+    """Embeds the query and returns the IDs of the tenant's nearest schema descriptions, best match first."""
+    query_embedding = embed_query(query, "retrieve_schema", deadline)
+
+    embeddings_uri = get_tenant(tenant).embeddings_uri
+    embedding_store = get_embedding_store(embeddings_uri)
+    if embedding_store is not None:
+        # Local backend: brute-force cosine search over the in-memory (or shared) embedding matrix.
+        # A store shared by several tenants holds all their rows, so fetch enough for this tenant's to fill num_results.
+        sharing = sum(1 for other in all_tenants() if other.embeddings_uri == embeddings_uri)
+        ranked = [doc_id for doc_id, _ in embedding_store.search(query_embedding, num_results * sharing) if doc_id in lookup]
+        return ranked[:num_results]
+
+    index_endpoint = get_index_endpoint(index_endpoint_name)
+    logger.debug("Connecting to endpoint: %s", index_endpoint_name)
+
+    search_kwargs = dict(queries=[query_embedding], deployed_index_id=deployed_index_id, num_neighbors=num_results)
+    if is_multi_tenant():
+        # Filtered ANN on the shared index: only datapoints restricted to this tenant
+        # (see scripts/generate_schema_embeddings.py) are candidates
+        search_kwargs["filter"] = [Namespace("tenant", [get_tenant(tenant).name], [])]
+    response = call_with_resilience("vector_search", index_endpoint.find_neighbors, kwargs=search_kwargs, deadline=deadline)
+    logger.debug("Received response from Vector Search.")
+
+    ranked_ids: List[str] = []
+    if response and response[0]:
+        for neighbor in response[0]: # Neighbours come back best match first
+            if neighbor.id in lookup:
+                ranked_ids.append(neighbor.id)
+            else:
+                logger.warning("Could not find description for ID: '%s'. Check JSON and index IDs.", neighbor.id)
+    else:
+        logger.debug("Vector Search returned no neighbors.")
+    return ranked_ids
+
+
+# --- Schema Retrieval Function ---
+def retrieve_relevant_schema(query: str, index_endpoint_name: str, deployed_index_id: str,
+                             num_results: int = config.SCHEMA_RETRIEVAL_CANDIDATES,
+                             deadline: Optional[float] = None, schema_state: Optional[SchemaState] = None,
+                             tenant: Optional[str] = None) -> str:
+    """
+    Retrieves relevant schema context with hybrid lexical + vector search.
+
+    The local BM25 index and Vertex AI Vector Search each return their
+    `num_results` best table/column descriptions; the two rankings are combined
+    with reciprocal rank fusion. If Vector Search is unconfigured, slow or
+    failing (or the request `deadline` leaves no budget), the lexical ranking
+    is used on its own. `schema_state` pins the schema version to read
+    (default: the tenant's current one).
+
+    Retrieval is then hierarchical: tables are ranked first, then columns
+    within the chosen tables. Join-key columns from the foreign-key graph are
+    added so the chosen tables can be joined, and the result is rendered one
+    line per table.
+    """
+    logger.debug("Starting schema retrieval for query: '%s'", query)
+
+    state = schema_state or get_schema_state(tenant) # One consistent state for the whole retrieval
+    if not state.lookup:
+         logger.error("Cannot retrieve schema: Lookup dictionary is empty.")
+         return "Failed to retrieve schema context: Lookup data missing." # Return error message
+
+    lexical_ids = [doc_id for doc_id, _ in state.lexical_index.search(query, num_results)]
 
-        if not relevant_docs_text:
-            print("No relevant schema descriptions were successfully retrieved.")
-            return "No specific schema context found relevant to the question. Use general knowledge of tables: stores, products, sales_transactions."
+    vector_ids: List[str] = []
+    # Ensure required config values are present
+    if config.VECTOR_SEARCH_BACKEND != "local" and not all([index_endpoint_name, deployed_index_id, config.GCP_PROJECT_ID, config.GCP_REGION]):
+         logger.warning("Missing required configuration for Vector Search. Using lexical retrieval only.")
+    else:
+        try:
+            # Each call has its own timeout, retries and circuit breaker (utils/resilience.py)
+            vector_ids = _vector_search_ids(query, index_endpoint_name, deployed_index_id, num_results, state.lookup, deadline, tenant)
+        except Exception as e:
+            logger.warning("Vector Search unavailable (%s: %s). Using lexical retrieval only.", type(e).__name__, e)
+
+    try:
+        ranked_ids = reciprocal_rank_fusion([vector_ids, lexical_ids]) if vector_ids else lexical_ids
+        logger.debug("Retrieved %d vector and %d lexical candidates.", len(vector_ids), len(lexical_ids))
+        annotate(schema_ids=ranked_ids[:num_results]) # For the request log (utils/request_log.py)
+
+        final_context = state.catalog.build_context(
+            ranked_ids,
+            max_tables=config.SCHEMA_MAX_TABLES,
+            max_columns_per_table=config.SCHEMA_MAX_COLUMNS_PER_TABLE,
+        )
+        if not final_context:
+            logger.warning("No relevant schema descriptions were successfully retrieved.")
+            return f"No specific schema context found relevant to the question. Use general knowledge of tables: {', '.join(sorted(state.catalog.tables))}."
         else:
-            final_context = "\n\n---\n\n".join(relevant_docs_text)
-            print(f"--- Successfully Retrieved Schema Context (length: {len(final_context)}) ---") # Avoid printing full context in production logs
+            logger.debug("Retrieved schema context (length: %d)", len(final_context))
             return final_context
 
     except Exception as e:
-        print(f"[ERROR] An error occurred during schema retrieval: {e}")
-        # Log the full error traceback for debugging
-        import traceback
-        traceback.print_exc()
-        return "Failed to retrieve schema context due to an error."
\ No newline at end of file
+        logger.exception("An error occurred during schema retrieval: %s", e) # Logs the full traceback
+        return "Failed to retrieve schema context due to an error."
@@ -0,0 +1,168 @@
+# /nl2sql-agent/tools/schema_catalog.py
+
+from collections import deque
+from typing import List, Dict, Any, Tuple, Optional
+
+# A join edge between two tables: (left_table, left_column, right_table, right_column)
+JoinEdge = Tuple[str, str, str, str]
+
+
+def _first_sentence(text: str) -> str:
+    """Returns the first sentence of a description (used for compact rendering)."""
+    end = text.find(". ")
+    return text if end == -1 else text[:end + 1]
+
+
+class SchemaCatalog:
+    """
+    In-memory view of the schema descriptions (the items behind the
+    schema lookup), organised by table and column, plus a
+    foreign-key graph between tables that is precomputed once at load time.
+    """
+
+    def __init__(self, items: List[Dict[str, Any]]):
+        self.items: Dict[str, Dict[str, Any]] = {}
+        self.tables: Dict[str, Dict[str, Any]] = {}                 # table -> table item
+        self.columns: Dict[str, Dict[str, Dict[str, Any]]] = {}     # table -> column -> column item
+        for item in items:
+            self.items[item["id"]] = item
+            if item.get("type") == "table":
+                self.tables[item["name"]] = item
+                self.columns.setdefault(item["name"], {})
+            elif item.get("type") == "column" and item.get("table"):
+                self.columns.setdefault(item["table"], {})[item["name"]] = item
+        self.join_graph = self._build_join_graph()
+
+    def _build_join_graph(self) -> Dict[str, Dict[str, List[Tuple[str, str]]]]:
+        """
+        Builds table -> neighbour table -> [(column, neighbour column)] from the
+        `type`/`table` fields: a column name shared by two tables is treated as a
+        join key when it follows the `<entity>_id` convention or its description
+        calls it a key.
+        """
+        tables_by_column: Dict[str, List[str]] = {}
+        for table, columns in self.columns.items():
+            for column_name in columns:
+                tables_by_column.setdefault(column_name, []).append(table)
+
+        graph: Dict[str, Dict[str, List[Tuple[str, str]]]] = {table: {} for table in self.columns}
+        for column_name, tables in tables_by_column.items():
+            if len(tables) < 2:
+                continue
+            described_as_key = any(
+                "key" in self.columns[table][column_name].get("description", "").lower() for table in tables
+            )
+            if not (column_name.lower().endswith("_id") or described_as_key):
+                continue
+            for left in tables:
+                for right in tables:
+                    if left != right:
+                        graph[left].setdefault(right, []).append((column_name, column_name))
+        return graph
+
+    def table_of(self, item_id: str) -> Optional[str]:
+        """Returns the table an item (table or column description) belongs to."""
+        item = self.items.get(item_id)
+        if not item:
+            return None
+        return item["name"] if item.get("type") == "table" else item.get("table")
+
+    def column_names(self, table: str) -> List[str]:
+        return list(self.columns.get(table, {}))
+
+    def rank_tables(self, ranked_ids: List[str], max_tables: int, min_score_ratio: float = 0.3) -> List[str]:
+        """
+        Stage 1: scores tables from a ranked hit list (table and column hits
+        both count, weighted by 1 / (rank + 1)) and keeps the best ones.
+        Tables scoring below `min_score_ratio` of the best table are dropped.
+        """
+        scores: Dict[str, float] = {}
+        for rank, item_id in enumerate(ranked_ids):
+            table = self.table_of(item_id)
+            if table:
+                scores[table] = scores.get(table, 0.0) + 1.0 / (rank + 1)
+        if not scores:
+            return []
+        ordered = sorted(scores, key=scores.get, reverse=True)
+        best = scores[ordered[0]]
+        return [table for table in ordered[:max_tables] if scores[table] >= best * min_score_ratio]
+
+    def rank_columns(self, ranked_ids: List[str], tables: List[str], max_columns_per_table: int) -> Dict[str, List[str]]:
+        """Stage 2: keeps the best-ranked column hits within each chosen table."""
+        selected: Dict[str, List[str]] = {table: [] for table in tables}
+        for item_id in ranked_ids:
+            item = self.items.get(item_id)
+            if not item or item.get("type") != "column":
+                continue
+            columns = selected.get(item.get("table"))
+            if columns is not None and len(columns) < max_columns_per_table and item["name"] not in columns:
+                columns.append(item["name"])
+        return selected
+
+    def join_path(self, sources: List[str], target: str) -> List[JoinEdge]:
+        """Shortest chain of join edges from any of `sources` to `target` (BFS), or [] if unreachable."""
+        previous: Dict[str, Optional[JoinEdge]] = {source: None for source in sources}
+        queue = deque(sources)
+        while queue:
+            table = queue.popleft()
+            if table == target:
+                break
+            for neighbour, keys in self.join_graph.get(table, {}).items():
+                if neighbour not in previous:
+                    left_column, right_column = keys[0]
+                    previous[neighbour] = (table, left_column, neighbour, right_column)
+                    queue.append(neighbour)
+        if target not in previous:
+            return []
+        path: List[JoinEdge] = []
+        edge = previous[target]
+        while edge is not None:
+            path.append(edge)
+            edge = previous[edge[0]]
+        return list(reversed(path))
+
+    def expand_with_join_keys(self, selected: Dict[str, List[str]]) -> Tuple[Dict[str, List[str]], List[JoinEdge]]:
+        """
+        Adds the minimal join-path columns (and any bridging tables) needed to
+        connect every selected table, growing a tree from the best-ranked table.
+        """
+        expanded = {table: list(columns) for table, columns in selected.items()}
+        tables = list(selected)
+        if len(tables) < 2:
+            return expanded, []
+
+        connected = [tables[0]]
+        joins: List[JoinEdge] = []
+        for table in tables[1:]:
+            if table in connected:
+                continue
+            for edge in self.join_path(connected, table):
+                left_table, left_column, right_table, right_column = edge
+                for edge_table, edge_column in ((left_table, left_column), (right_table, right_column)):
+                    columns = expanded.setdefault(edge_table, [])
+                    if edge_column not in columns:
+                        columns.append(edge_column)
+                    if edge_table not in connected:
+                        connected.append(edge_table)
+                joins.append(edge)
+        return expanded, joins
+
+    def render(self, selected: Dict[str, List[str]], joins: List[JoinEdge]) -> str:
+        """Renders a compact context: one line per table with its columns, then the join conditions."""
+        lines = []
+        for table, columns in selected.items():
+            table_item = self.tables.get(table)
+            summary = f" -- {_first_sentence(table_item['description'])}" if table_item else ""
+            lines.append(f"- {table}({', '.join(columns)}){summary}")
+        for left_table, left_column, right_table, right_column in joins:
+            lines.append(f"- JOIN {left_table}.{left_column} = {right_table}.{right_column}")
+        return "\n".join(lines)
+
+    def build_context(self, ranked_ids: List[str], max_tables: int, max_columns_per_table: int) -> str:
+        """Two-stage selection (tables, then columns), foreign-key expansion and compact rendering."""
+        tables = self.rank_tables(ranked_ids, max_tables)
+        if not tables:
+            return ""
+        selected = self.rank_columns(ranked_ids, tables, max_columns_per_table)
+        selected, joins = self.expand_with_join_keys(selected)
+        return self.render(selected, joins)
@@ -0,0 +1,84 @@
+# /nl2sql-agent/tools/schema_snapshot.py
+
+import os
+import pickle
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from tools.lexical_index import LexicalIndex
+from tools.schema_catalog import SchemaCatalog
+from utils.log import get_logger
+
+logger = get_logger(__name__)
+
+# Bump when SchemaState or the classes it holds change shape; older snapshots are then rebuilt.
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+class SchemaState:
+    """
+    Everything derived from the schema descriptions JSON: the items, the ID ->
+    description lookup, the schema catalog (with its foreign-key graph) and the
+    BM25 index. Immutable once built; a newer source replaces it as a whole.
+    Stamped with the GCS generation/ETag of the object it was built from.
+    """
+
+    def __init__(self, items: List[Dict[str, Any]], source_uri: str,
+                 generation: Optional[int] = None, etag: Optional[str] = None):
+        self.items = items
+        self.lookup: Dict[str, str] = {item["id"]: item["description"] for item in items}
+        # Table/column view of the same items with the precomputed foreign-key graph
+        self.catalog = SchemaCatalog(items)
+        # Local BM25 index over the same descriptions (plus table/column names) for lexical matches and fallback
+        self.lexical_index = LexicalIndex({
+            item["id"]: f"{item.get('table', '')} {item.get('name', '')} {item['description']}" for item in items
+        })
+        self.source_uri = source_uri
+        self.generation = generation
+        self.etag = etag
+        self.built_at = time.time()
+
+    @property
+    def version(self) -> Optional[int]:
+        """The source generation (GCS) or modification time (local file): identical across processes for the same source."""
+        return self.generation
+
+
+def save_snapshot(state: SchemaState, path: str) -> None:
+    """
+    Writes the state to a local snapshot file atomically, so a crash never leaves a
+    truncated snapshot. Each writer uses its own temp file: server workers may save
+    the same snapshot at once.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            pickle.dump({"format": SNAPSHOT_FORMAT_VERSION, "state": state}, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def load_snapshot(path: str, source_uri: str) -> Optional[SchemaState]:
+    """Returns the snapshot's state, or None if it is missing, unreadable, of another format or built from another source."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as handle:
+            payload = pickle.load(handle)
+    except Exception as e:
+        logger.warning("Ignoring unreadable schema snapshot %s: %s", path, e)
+        return None
+    if not isinstance(payload, dict) or payload.get("format") != SNAPSHOT_FORMAT_VERSION \
+            or not isinstance(payload.get("state"), SchemaState):
+        logger.warning("Ignoring schema snapshot %s: written by another snapshot format.", path)
+        return None
+    state = payload["state"]
+    if state.source_uri != source_uri:
+        logger.warning("Ignoring schema snapshot %s: built from %s, not %s.", path, state.source_uri, source_uri)
+        return None
+    return state
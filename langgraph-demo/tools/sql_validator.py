@@ -0,0 +1,139 @@
+# /nl2sql-agent/tools/sql_validator.py
+
+import time
+from typing import List, Dict, Optional
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+from sqlglot.optimizer.scope import traverse_scope
+
+from tools.schema_catalog import SchemaCatalog
+from utils.metrics import METRICS
+from utils.log import get_logger
+
+logger = get_logger(__name__)
+
+# Statement types that modify data, schema or permissions. Checked on the parsed
+# tree, so identifiers such as `last_updated` or `deleted_flag` are not rejected.
+_WRITE_NODE_TYPES = tuple(
+    getattr(exp, name) for name in
+    ("Insert", "Update", "Delete", "Merge", "Create", "Drop", "Alter", "TruncateTable", "Grant", "Revoke", "Command")
+    if hasattr(exp, name)
+)
+_READ_ONLY_ROOT_TYPES = (exp.Select, getattr(exp, "SetOperation", exp.Union)) # SELECT, UNION/INTERSECT/EXCEPT
+
+
+def _error(code: str, message: str) -> Dict[str, str]:
+    return {"code": code, "message": message}
+
+
+def _parse_single_read_only(sql: str):
+    """Parses BigQuery SQL and checks it is exactly one read-only statement. Returns (tree, errors)."""
+    try:
+        statements = [statement for statement in sqlglot.parse(sql, read="bigquery") if statement is not None]
+    except ParseError as e:
+        return None, [_error("PARSE_ERROR", f"SQL could not be parsed: {str(e).splitlines()[0]}")]
+
+    if len(statements) != 1:
+        return None, [_error("MULTIPLE_STATEMENTS", f"Expected exactly one SQL statement, found {len(statements)}.")]
+
+    tree = statements[0]
+    write_node = tree if isinstance(tree, _WRITE_NODE_TYPES) else tree.find(*_WRITE_NODE_TYPES)
+    if write_node is not None or not isinstance(tree, _READ_ONLY_ROOT_TYPES):
+        statement_type = type(write_node or tree).__name__.upper()
+        return None, [_error("NOT_READ_ONLY", f"Only read-only SELECT queries are allowed, found {statement_type}.")]
+    return tree, []
+
+
+def check_read_only(sql: str) -> List[Dict[str, str]]:
+    """Returns structured errors unless `sql` is a single read-only BigQuery statement."""
+    return _parse_single_read_only(sql)[1]
+
+
+def validate_sql(sql: str, catalog: SchemaCatalog, project: Optional[str] = None,
+                 dataset: Optional[str] = None) -> List[Dict[str, str]]:
+    """
+    Validates generated SQL locally before it is sent to BigQuery.
+
+    Parses `sql` in the BigQuery dialect, checks that it is a single read-only
+    statement, and resolves every table and column against the schema catalog
+    (table references must point at `project`.`dataset` when those are given).
+    Columns are resolved per query scope, so CTE/subquery outputs and SELECT
+    aliases are accepted. Returns a list of {"code", "message"} errors; an
+    empty list means the query is valid.
+    """
+    start_time = time.perf_counter()
+    tree, errors = _parse_single_read_only(sql)
+    if tree is not None and catalog.tables:
+        errors = _resolve_identifiers(tree, catalog, project, dataset)
+
+    METRICS.observe("sql_validation_seconds", time.perf_counter() - start_time)
+    for error in errors:
+        METRICS.increment("sql_validation_errors", code=error["code"])
+    return errors
+
+
+def _resolve_identifiers(tree: exp.Expression, catalog: SchemaCatalog, project: Optional[str],
+                         dataset: Optional[str]) -> List[Dict[str, str]]:
+    errors: List[Dict[str, str]] = []
+    catalog_columns = {
+        table.lower(): {column.lower() for column in columns} for table, columns in catalog.columns.items()
+    }
+    cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+
+    for table in tree.find_all(exp.Table):
+        name = table.name.lower()
+        if not name or (name in cte_names and not table.db):
+            continue
+        if name not in catalog_columns:
+            errors.append(_error("UNKNOWN_TABLE", f"Table '{table.name}' is not in the schema catalog."))
+        elif dataset and table.db and table.db != dataset:
+            errors.append(_error("WRONG_DATASET", f"Table '{table.name}' must be read from dataset '{dataset}', not '{table.db}'."))
+        elif project and table.catalog and table.catalog != project:
+            errors.append(_error("WRONG_PROJECT", f"Table '{table.name}' must be read from project '{project}', not '{table.catalog}'."))
+
+    try:
+        scopes = traverse_scope(tree)
+    except Exception as e:
+        # Scope analysis is best effort; table checks above still apply.
+        logger.warning("Could not analyse SQL scopes for column validation: %s", e)
+        return errors
+
+    for scope in scopes:
+        real_tables: Dict[str, str] = {}   # alias -> catalog table, including enclosing scopes (correlated refs)
+        visible_aliases = set()
+        has_derived_source = False
+        enclosing = scope
+        while enclosing is not None:
+            for alias, source in enclosing.sources.items():
+                visible_aliases.add(alias.lower())
+                if isinstance(source, exp.Table) and source.name.lower() in catalog_columns:
+                    real_tables.setdefault(alias.lower(), source.name.lower())
+                else:
+                    has_derived_source = True # CTE, subquery, UNNEST... columns not in the catalog
+            enclosing = enclosing.parent
+        select_aliases = {
+            select.alias.lower() for select in getattr(scope.expression, "selects", []) if isinstance(select, exp.Alias)
+        }
+
+        for column in scope.columns:
+            if isinstance(column.this, exp.Star) or column.find_ancestor(exp.Select) is not scope.expression:
+                continue # Star, or a column checked in its own (nested) scope
+            column_name = column.name.lower()
+            qualifier = column.table.lower()
+            if qualifier:
+                if qualifier in real_tables:
+                    if column_name not in catalog_columns[real_tables[qualifier]]:
+                        errors.append(_error("UNKNOWN_COLUMN", f"Column '{column.name}' does not exist in table '{real_tables[qualifier]}'."))
+                elif qualifier not in visible_aliases:
+                    errors.append(_error("UNKNOWN_TABLE", f"'{column.table}' in '{column.sql(dialect='bigquery')}' is not a table or alias in the query."))
+            elif not has_derived_source and column_name not in select_aliases:
+                if not any(column_name in catalog_columns[table] for table in real_tables.values()):
+                    errors.append(_error("UNKNOWN_COLUMN", f"Column '{column.name}' does not exist in any referenced table."))
+    return errors
+
+
+def format_validation_errors(errors: List[Dict[str, str]]) -> str:
+    """Renders validation errors as one line each (for error messages and repair prompts)."""
+    return "\n".join(f"[{error['code']}] {error['message']}" for error in errors)
@@ -0,0 +1,281 @@
+# /nl2sql-agent/utils/admission.py
+
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Iterator, Optional, Tuple
+
+from google.api_core import exceptions as google_exceptions
+import config
+from utils.metrics import METRICS
+from utils.resilience import BackendBusyError
+from utils.tenants import TENANTS
+
+# Priorities, served strictly in this order; tenants within one priority are served round-robin
+PRIORITIES = ("high", "normal", "low")
+_HOLD_SECONDS_SMOOTHING = 0.2 # EWMA weight of the latest call when estimating how long a call holds its slot
+
+_REQUEST: contextvars.ContextVar[Tuple[str, str]] = contextvars.ContextVar(
+    "admission_request", default=(config.ADMISSION_DEFAULT_TENANT, "normal"))
+
+
+@contextlib.contextmanager
+def request_priority(tenant: Optional[str] = None, priority: Optional[str] = None) -> Iterator[None]:
+    """Tenant and priority used to queue this request's backend calls (graph nodes run in copies of this context)."""
+    priority = priority if priority in PRIORITIES else "normal"
+    token = _REQUEST.set((tenant or config.ADMISSION_DEFAULT_TENANT, priority))
+    try:
+        yield
+    finally:
+        _REQUEST.reset(token)
+
+
+class TokenBucket:
+    """
+    Rate limit sized to a quota: `rate` calls per second with bursts up to
+    `burst`. The rate halves on a quota error (429) and recovers gradually
+    with successful calls (AIMD), so the limit follows the quota actually granted.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """Takes a token (possibly borrowing ahead) and returns the seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def cancel(self):
+        """Returns a reserved token that was not used."""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+    def pending_seconds(self, calls: int) -> float:
+        """Seconds until `calls` more tokens would be available."""
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (calls - self._tokens) / self.rate)
+
+    def on_throttled(self):
+        with self._lock:
+            self.rate = max(self.max_rate * 0.1, self.rate / 2)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.01)
+
+
+class _Waiter:
+    __slots__ = ("tenant", "priority", "granted", "event")
+
+    def __init__(self, tenant: str, priority: str):
+        self.tenant = tenant
+        self.priority = priority
+        self.granted = False
+        self.event = threading.Event()
+
+
+class BackendLimiter:
+    """
+    At most `concurrency` calls in flight to one backend and a token bucket on
+    their rate. Callers beyond the limit wait in a fair queue: strict priority
+    across PRIORITIES, round-robin across tenants within a priority, FIFO per
+    tenant. A caller whose expected wait exceeds its remaining deadline is shed.
+    """
+
+    def __init__(self, service: str, concurrency: int, rate_per_second: float, burst: float):
+        self.service = service
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate_per_second, burst) if rate_per_second > 0 else None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        # priority -> tenant -> waiters; tenants rotate to the back after being served
+        self._queues: Dict[str, "OrderedDict[str, deque]"] = {priority: OrderedDict() for priority in PRIORITIES}
+        self._queued = 0
+        self._hold_seconds = 1.0 # Updated from observed calls
+
+    def _publish(self):
+        METRICS.set_gauge("admission_queue_depth", self._queued, service=self.service)
+        METRICS.set_gauge("admission_in_flight", self._in_flight, service=self.service)
+
+    @property
+    def saturated(self) -> bool:
+        """True while callers are queueing (e.g. hedged duplicates would only add load)."""
+        return self._queued > 0
+
+    def _ahead_of(self, tenant: str, priority: str) -> int:
+        """Waiters served before a new caller: all higher priorities, and one round per queued turn of its tenant."""
+        ahead = 0
+        for level in PRIORITIES:
+            tenants = self._queues[level]
+            if level == priority:
+                own_turn = len(tenants.get(tenant, ())) + 1
+                return ahead + sum(min(len(waiters), own_turn) for name, waiters in tenants.items() if name != tenant) \
+                    + own_turn - 1
+            ahead += sum(len(waiters) for waiters in tenants.values())
+        return ahead
+
+    def _expected_wait(self, ahead: int) -> float:
+        slot_wait = (ahead // self.concurrency + (1 if self._in_flight >= self.concurrency else 0)) * self._hold_seconds
+        rate_wait = self.bucket.pending_seconds(ahead + 1) if self.bucket is not None else 0.0
+        return max(slot_wait, rate_wait)
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        for level in PRIORITIES:
+            tenants = self._queues[level]
+            if tenants:
+                tenant, waiters = next(iter(tenants.items()))
+                waiter = waiters.popleft()
+                del tenants[tenant]
+                if waiters:
+                    tenants[tenant] = waiters # Back of the rotation
+                self._queued -= 1
+                return waiter
+        return None
+
+    def _remove(self, waiter: _Waiter):
+        waiters = self._queues[waiter.priority].get(waiter.tenant)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            self._queued -= 1
+            if not waiters:
+                del self._queues[waiter.priority][waiter.tenant]
+
+    def _shed(self, reason: str, message: str):
+        METRICS.increment("admission_shed", service=self.service, reason=reason)
+        raise BackendBusyError(self.service, message)
+
+    def acquire(self, deadline: Optional[float]) -> float:
+        """Waits for a slot and a rate token; returns the seconds waited. Raises BackendBusyError to shed."""
+        tenant, priority = _REQUEST.get()
+        start = time.monotonic()
+        budget = None if deadline is None else deadline - time.time()
+        with self._lock:
+            if self._in_flight < self.concurrency and not self._queued:
+                self._in_flight += 1
+                waiter = None
+            else:
+                expected = self._expected_wait(self._ahead_of(tenant, priority))
+                if budget is not None and expected >= budget:
+                    self._shed("expected_wait", f"{self.service} is busy: expected queue wait {expected:.1f}s "
+                                                f"exceeds the {max(budget, 0.0):.1f}s left for this request.")
+                waiter = _Waiter(tenant, priority)
+                self._queues[priority].setdefault(tenant, deque()).append(waiter)
+                self._queued += 1
+            self._publish()
+
+        if waiter is not None and not waiter.event.wait(timeout=None if budget is None else max(budget, 0.0)):
+            with self._lock:
+                if not waiter.granted: # Not granted while the wait timed out
+                    self._remove(waiter)
+                    self._publish()
+                    self._shed("deadline", f"{self.service} is busy: no capacity within the request deadline.")
+
+        if self.bucket is not None:
+            token_wait = self.bucket.reserve()
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and token_wait >= remaining:
+                self.bucket.cancel()
+                self.release(None)
+                self._shed("rate", f"{self.service} is at its rate limit for longer than the request deadline allows.")
+            time.sleep(token_wait)
+
+        waited = time.monotonic() - start
+        METRICS.observe("admission_wait_seconds", waited, service=self.service, priority=priority)
+        return waited
+
+    def release(self, hold_seconds: Optional[float], throttled: bool = False):
+        """Frees the slot (handing it straight to the next waiter) and updates the hold time and rate estimates."""
+        if self.bucket is not None and hold_seconds is not None:
+            self.bucket.on_throttled() if throttled else self.bucket.on_success()
+        with self._lock:
+            if hold_seconds is not None:
+                self._hold_seconds += _HOLD_SECONDS_SMOOTHING * (hold_seconds - self._hold_seconds)
+            waiter = self._next_waiter()
+            if waiter is None:
+                self._in_flight -= 1
+            else:
+                waiter.granted = True # The slot passes to the waiter without being freed
+                waiter.event.set()
+            self._publish()
+
+
+_limiters: Dict[str, BackendLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _limits_for(service: str) -> Dict[str, float]:
+    if service.startswith("tenant:"): # Requests of one tenant (utils/tenants.py)
+        tenant = TENANTS.get(service[len("tenant:"):])
+        return tenant.limits if tenant is not None else {}
+    return config.ADMISSION_LIMITS.get(service) or {}
+
+
+def get_limiter(service: str) -> Optional[BackendLimiter]:
+    """
+    The limiter configured for `service` in ADMISSION_LIMITS (or for "tenant:<name>",
+    in the tenant's limits), or None if calls to it are not limited.
+    """
+    if not config.ADMISSION_CONTROL_ENABLED:
+        return None
+    limits = _limits_for(service)
+    if not limits:
+        return None
+    with _limiters_lock:
+        limiter = _limiters.get(service)
+        if limiter is None:
+            limiter = _limiters[service] = BackendLimiter(
+                service, int(limits.get("concurrency", 1 << 30)), float(limits.get("rate_per_second", 0)),
+                float(limits.get("burst", limits.get("rate_per_second", 0)))
+            )
+        return limiter
+
+
+def backend_saturated(service: str) -> bool:
+    """Whether callers are queueing for `service`."""
+    limiter = get_limiter(service)
+    return limiter is not None and limiter.saturated
+
+
+@contextlib.contextmanager
+def admit(service: str, deadline: Optional[float]) -> Iterator[None]:
+    """Holds one admission slot for `service` around a call; a no-op for unlimited services."""
+    limiter = get_limiter(service)
+    if limiter is None:
+        yield
+        return
+    limiter.acquire(deadline)
+    start = time.monotonic()
+    throttled = False
+    try:
+        yield
+    except Exception as e:
+        throttled = isinstance(e, google_exceptions.TooManyRequests) # Quota error: slow this backend down
+        raise
+    finally:
+        limiter.release(time.monotonic() - start, throttled)
+
+
+def _reset_after_fork():
+    # Waiters and in-flight counts belong to the parent's threads
+    global _limiters, _limiters_lock
+    _limiters = {}
+    _limiters_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
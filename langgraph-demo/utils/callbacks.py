@@ -4,6 +4,10 @@ from langchain_core.callbacks import BaseCallbackHandler
 from typing import Any, Dict, List, Optional, Union
 from langchain_core.messages import BaseMessage
 import time # Example: to time operations
+from utils.log import get_logger
+
+logger = get_logger(__name__)
+
 
 class CustomCallbackHandler(BaseCallbackHandler):
     """A custom callback handler for logging and timing agent steps."""
@@ -13,7 +17,7 @@ class CustomCallbackHandler(BaseCallbackHandler):
         self.chain_start_time = None
         self.llm_start_time = None
         self.tool_start_time = None
-        print("CustomCallbackHandler initialized.")
+        logger.debug("CustomCallbackHandler initialized.")
 
     def on_chain_start(
         self, serialized: Dict[str, Any], inputs: Dict[str, Any], **kwargs: Any
@@ -37,16 +41,16 @@ class CustomCallbackHandler(BaseCallbackHandler):
                 # it will remain "Unknown/Unnamed Chain"
         else:
             # Log that serialized was None, which is the cause of the original error
-            print(f"\n>> Entering Chain: [Serialized object was None, check component definition]") # Helps identify the problematic step
+            logger.debug("Entering chain: [Serialized object was None, check component definition]") # Helps identify the problematic step
 
-        print(f"\n>> Entering Chain: {chain_name}")
+        logger.debug("Entering chain: %s", chain_name)
         # Example: Log partial inputs (be careful with sensitive data)
         # print(f"   Inputs (partial): {{'question': inputs.get('question', '?')}}")
 
     def on_chain_end(self, outputs: Dict[str, Any], **kwargs: Any) -> Any:
         """Called when a chain ends."""
         duration = f"{(time.time() - self.chain_start_time):.2f}s" if self.chain_start_time else "N/A"
-        print(f"<< Exiting Chain (Duration: {duration})")
+        logger.debug("Exiting chain (duration: %s)", duration)
         # Example: Log partial outputs
         # print(f"   Outputs (keys): {list(outputs.keys())}")
         self.chain_start_time = None # Reset timer
@@ -57,17 +61,23 @@ class CustomCallbackHandler(BaseCallbackHandler):
         """Called when an LLM call starts."""
         self.llm_start_time = time.time()
         model_name = serialized.get('kwargs', {}).get('model_name', 'Unknown LLM')
-        print(f"  >> LLM Call Start ({model_name})")
+        logger.debug("LLM call start (%s)", model_name)
         # Log prompts if needed for debugging (can be verbose)
         # print(f"     Prompt:\n{prompts[0][:500]}...") # Log first 500 chars
 
     def on_llm_end(self, response, **kwargs: Any) -> Any:
         """Called when an LLM call ends."""
         duration = f"{(time.time() - self.llm_start_time):.2f}s" if self.llm_start_time else "N/A"
-        # Accessing token usage might require specific model/provider parsing
-        # token_usage = response.llm_output.get('token_usage', {}) if hasattr(response, 'llm_output') else {}
-        # print(f"  << LLM Call End (Duration: {duration}, Tokens: {token_usage})")
-        print(f"  << LLM Call End (Duration: {duration})")
+        # Chat models report usage on the message (LangChain usage_metadata); request totals are in utils/usage.py
+        generations = getattr(response, "generations", None) or [[]]
+        message = getattr(generations[0][0], "message", None) if generations[0] else None
+        usage = getattr(message, "usage_metadata", None) or {}
+        if usage:
+            cached = (usage.get("input_token_details") or {}).get("cache_read", 0)
+            logger.debug("LLM call end (duration: %s, tokens: %s prompt / %s completion / %s cached)",
+                         duration, usage.get('input_tokens', 0), usage.get('output_tokens', 0), cached)
+        else:
+            logger.debug("LLM call end (duration: %s)", duration)
         # print(f"     Response (partial): {str(response.generations[0][0].text)[:200]}...") # Log partial response
         self.llm_start_time = None # Reset timer
 
@@ -75,5 +85,5 @@ class CustomCallbackHandler(BaseCallbackHandler):
         self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any
     ) -> Any:
         """Called when an LLM call errors."""
-        print(f"  [ERROR] LLM Error: {error}")
+        logger.error("LLM error: %s", error)
         self.llm_start_time = None # Reset timer
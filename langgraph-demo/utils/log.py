@@ -0,0 +1,152 @@
+# /nl2sql-agent/utils/log.py
+
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from typing import Any, Dict, Iterator, Optional
+
+import config
+from utils.metrics import METRICS
+
+# Structured, leveled logging. Modules log through get_logger(__name__); records are put on a bounded
+# queue without blocking (dropped and counted when it is full) and written as one JSON object per line
+# by a background thread, so a request never waits on stdout.
+
+# Attributes every LogRecord has; anything else was passed with extra={...} and becomes a JSON field
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+# Request fields added to every record logged while the request runs (see log_context)
+_CONTEXT: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("log_context", default={})
+
+
+@contextlib.contextmanager
+def log_context(**fields: Any) -> Iterator[None]:
+    """Adds fields (e.g. session_id) to every record logged inside the block, including from graph nodes."""
+    token = _CONTEXT.set({**_CONTEXT.get(), **fields})
+    try:
+        yield
+    finally:
+        _CONTEXT.reset(token)
+
+
+def _truncate(value: Any, limit: int) -> Any:
+    if isinstance(value, str) and len(value) > limit:
+        return f"{value[:limit]}... [{len(value) - limit} more chars]"
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, request context and extra fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+            "thread": record.threadName,
+        }
+        entry.update({name: value for name, value in vars(record).items() if name not in _STANDARD_ATTRIBUTES})
+        return json.dumps(entry, default=str)
+
+
+class _SamplingFilter(logging.Filter):
+    """Keeps LOG_DEBUG_SAMPLE_RATE of DEBUG records (the high-volume ones); every record above DEBUG passes."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < config.LOG_DEBUG_SAMPLE_RATE
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Queues records for the writer thread: never blocks the caller, and truncates large payloads first."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record) # Formats msg % args (and any traceback) in the caller's thread
+        record.msg = _truncate(record.msg, config.LOG_MAX_MESSAGE_CHARS)
+        for name, value in list(vars(record).items()):
+            if name not in _STANDARD_ATTRIBUTES:
+                setattr(record, name, _truncate(value if isinstance(value, (str, int, float, bool, type(None))) else str(value),
+                                                config.LOG_MAX_MESSAGE_CHARS))
+        for name, value in _CONTEXT.get().items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            METRICS.increment("log_records_dropped")
+
+
+_handler: Optional[_NonBlockingQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _install() -> None:
+    """(Re)creates the queue, its handler on the root logger and the writer thread."""
+    global _handler, _listener
+    root = logging.getLogger()
+    if _handler is not None:
+        root.removeHandler(_handler)
+    records: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+    _handler = _NonBlockingQueueHandler(records)
+    _handler.addFilter(_SamplingFilter())
+    root.addHandler(_handler)
+
+    output = logging.StreamHandler(sys.stdout)
+    if config.LOG_FORMAT == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=False)
+    _listener.start()
+
+
+def _configure() -> None:
+    logging.Formatter.converter = time.gmtime # Text timestamps in UTC, like the JSON epoch seconds
+    logging.getLogger().setLevel(config.LOG_LEVEL.upper())
+    # Per-logger levels, e.g. "tools.retriever=DEBUG,agent.nodes=WARNING"
+    for pair in config.LOG_LEVELS.replace(" ", "").split(","):
+        if "=" in pair:
+            name, level = pair.split("=", 1)
+            logging.getLogger(name).setLevel(level.upper())
+    _install()
+
+
+def _stop() -> None:
+    if _listener is None:
+        return
+    give_up_at = time.monotonic() + 2.0
+    while _listener.queue.full() and time.monotonic() < give_up_at:
+        time.sleep(0.01) # Room for the stop sentinel
+    try:
+        _listener.stop() # Writes what is queued
+    except queue.Full:
+        pass # The writer is a daemon thread; records it has not written are lost
+
+
+def _reset_after_fork():
+    # The writer thread does not survive fork(); each server worker starts its own
+    _install()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """The logger for a module (pass __name__); records go through the shared non-blocking JSON pipeline."""
+    return logging.getLogger(name)
+
+
+_configure()
+# Logged here rather than in config.py, which is imported before the root logger is configured
+get_logger("config").info("Configuration loaded successfully.")
+atexit.register(_stop) # Flush queued records on a clean exit
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,109 @@
+# /nl2sql-agent/utils/metrics.py
+
+import os
+import threading
+from collections import deque
+from typing import Any, Dict, Tuple
+
+# Samples kept per histogram for percentile estimates
+_RESERVOIR_SIZE = 2048
+
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, Any]) -> MetricKey:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _format_key(key: MetricKey) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{label}={value}" for label, value in labels) + "}"
+
+
+class MetricsRegistry:
+    """Thread-safe in-process counters, gauges and latency histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[MetricKey, float] = {}
+        self._gauges: Dict[MetricKey, float] = {}
+        self._histograms: Dict[MetricKey, Dict[str, Any]] = {}
+
+    def increment(self, name: str, value: float = 1, **labels: Any):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels: Any):
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels: Any):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"count": 0, "sum": 0.0, "samples": deque(maxlen=_RESERVOIR_SIZE)}
+            histogram["count"] += 1
+            histogram["sum"] += value
+            histogram["samples"].append(value)
+
+    def counter(self, name: str, **labels: Any) -> float:
+        with self._lock:
+            return self._counters.get(_key(name, labels), 0)
+
+    def percentile(self, name: str, q: float, **labels: Any) -> float:
+        """Returns the q-th percentile (0-100) of recent samples, or 0.0 if there are none."""
+        with self._lock:
+            histogram = self._histograms.get(_key(name, labels))
+            samples = sorted(histogram["samples"]) if histogram else []
+        if not samples:
+            return 0.0
+        index = min(len(samples) - 1, int(round(q / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def sample_count(self, name: str, **labels: Any) -> int:
+        with self._lock:
+            histogram = self._histograms.get(_key(name, labels))
+            return len(histogram["samples"]) if histogram else 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns all metrics as plain data (histograms summarised as count/mean/p50/p95/p99)."""
+        with self._lock:
+            counters = {_format_key(key): value for key, value in self._counters.items()}
+            gauges = {_format_key(key): value for key, value in self._gauges.items()}
+            histograms = {key: (h["count"], h["sum"], sorted(h["samples"])) for key, h in self._histograms.items()}
+
+        summaries = {}
+        for key, (count, total, samples) in histograms.items():
+            def pct(q):
+                return samples[min(len(samples) - 1, int(round(q / 100 * (len(samples) - 1))))] if samples else 0.0
+            summaries[_format_key(key)] = {
+                "count": count,
+                "mean": round(total / count, 6) if count else 0.0,
+                "p50": round(pct(50), 6),
+                "p95": round(pct(95), 6),
+                "p99": round(pct(99), 6),
+            }
+        return {"counters": counters, "gauges": gauges, "histograms": summaries}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+
+# Process-wide registry
+METRICS = MetricsRegistry()
+
+
+def _reset_after_fork():
+    """Each forked worker starts with its own, empty registry (per-worker metrics)."""
+    METRICS._lock = threading.Lock()
+    METRICS.reset()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
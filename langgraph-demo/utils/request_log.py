@@ -0,0 +1,315 @@
+# /nl2sql-agent/utils/request_log.py
+
+import atexit
+import contextlib
+import contextvars
+import hashlib
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import sqlglot
+from sqlglot import exp
+
+import config
+from utils.metrics import METRICS
+from utils.log import get_logger
+
+logger = get_logger(__name__)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# One row per question. List/dict values (schema_ids, cache_hits, node_seconds) are stored as JSON text.
+RECORD_COLUMNS: List[Tuple[str, str]] = [
+    ("request_id", "TEXT"), ("ts", "REAL"), ("session_id", "TEXT"), ("tenant", "TEXT"),
+    ("question_hash", "TEXT"), ("question_shape", "TEXT"), ("intent", "TEXT"), ("is_followup", "INTEGER"),
+    ("schema_version", "INTEGER"), ("schema_ids", "TEXT"),
+    ("sql_fingerprint", "TEXT"), ("sql_hash", "TEXT"), ("sql_shape", "TEXT"),
+    ("answer_source", "TEXT"), ("response_renderer", "TEXT"), ("rows", "INTEGER"),
+    ("bytes_processed", "INTEGER"), ("bytes_billed", "INTEGER"), ("cache_hits", "TEXT"),
+    ("node_seconds", "TEXT"), ("total_seconds", "REAL"), ("repair_attempts", "INTEGER"),
+    ("few_shot_examples", "INTEGER"),
+    ("timed_out", "INTEGER"), ("error", "TEXT"),
+    # Usage and estimated cost (utils/usage.py)
+    ("llm_input_tokens", "INTEGER"), ("llm_output_tokens", "INTEGER"), ("llm_cached_tokens", "INTEGER"),
+    ("embedding_chars", "INTEGER"), ("cost_usd", "REAL"), ("cost_by_node", "TEXT"),
+]
+_ERROR_MAX_CHARS = 500
+
+# Per-request annotations from inside the graph (e.g. BigQuery bytes), see annotate()
+_TRACE: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("request_trace", default=None)
+
+
+@contextlib.contextmanager
+def request_trace():
+    """Collects annotate() calls made while one request runs (graph nodes run in copies of this context)."""
+    trace: Dict[str, Any] = {}
+    token = _TRACE.set(trace)
+    try:
+        yield trace
+    finally:
+        _TRACE.reset(token)
+
+
+def annotate(**fields: Any) -> None:
+    """Adds fields to the current request's log record; a no-op outside a request."""
+    trace = _TRACE.get()
+    if trace is not None:
+        trace.update(fields)
+
+
+def record_coalesced(group: str) -> None:
+    """Notes that the current request shared another request's in-flight call (utils/single_flight.py)."""
+    trace = _TRACE.get()
+    if trace is not None:
+        trace.setdefault("coalesced", []).append(group)
+
+
+def _short_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip("?.! ")
+
+
+def question_shape(question: str) -> str:
+    """The question with its literals masked: 'sales in 2023 for "Tampines"' -> 'sales in <n> for <text>'."""
+    shape = re.sub(r"(['\"]).*?\1", "<text>", normalize_question(question))
+    return re.sub(r"\d+(?:[.,]\d+)*", "<n>", shape)
+
+
+def sql_fingerprint(sql: str) -> Tuple[str, str, str]:
+    """
+    Returns (fingerprint, sql_hash, shape). The shape is the normalised SQL with
+    literals replaced by '?' (IN lists collapsed), so queries differing only in
+    constants share a fingerprint; sql_hash identifies the exact normalised query.
+    """
+    try:
+        tree = sqlglot.parse_one(sql, read="bigquery")
+        normalized = tree.sql(dialect="bigquery")
+        shape = tree.transform(lambda node: exp.Placeholder() if isinstance(node, exp.Literal) else node).sql(dialect="bigquery")
+    except Exception:
+        normalized = re.sub(r"\s+", " ", sql.strip())
+        shape = re.sub(r"\b\d+(?:\.\d+)?\b", "?", re.sub(r"'(?:[^'\\]|\\.)*'", "?", normalized))
+    shape = re.sub(r"\(\?(?:, \?)+\)", "(?, ...)", shape)
+    return _short_hash(shape.lower()), _short_hash(normalized), shape
+
+
+def build_record(question: str, final_state: Dict[str, Any], trace: Dict[str, Any], node_seconds: Dict[str, float],
+                 total_seconds: float, session_id: Optional[str], error: Optional[str] = None) -> Dict[str, Any]:
+    """The log record for one finished (or failed) request."""
+    sql = final_state.get("local_sql") or final_state.get("sql_query")
+    fingerprint, sql_hash, shape = sql_fingerprint(sql) if sql else (None, None, None)
+    cache_hits = []
+    if final_state.get("answer_source") == "local":
+        cache_hits.append("result_set") # Answered from the session's cached result sets (tools/result_cache.py)
+    if final_state.get("reuse_schema_context"):
+        cache_hits.append("schema_context")
+    if trace.get("bigquery_cache_hit"):
+        cache_hits.append("bigquery")
+    cache_hits.extend(f"coalesced:{group}" for group in trace.get("coalesced", [])) # Shared an identical in-flight call
+    results = final_state.get("query_results")
+    error = error or final_state.get("error_message")
+    usage = trace.get("usage", {}) # UsageLedger.summary() of the request
+    return {
+        "request_id": trace.get("request_id") or uuid.uuid4().hex, # Same id as the request's log lines
+        "ts": time.time(),
+        "session_id": session_id,
+        "tenant": final_state.get("tenant"),
+        "question_hash": _short_hash(normalize_question(question)),
+        "question_shape": question_shape(question),
+        "intent": final_state.get("intent_type"),
+        "is_followup": int(bool(final_state.get("is_followup"))),
+        "schema_version": final_state.get("schema_version"),
+        "schema_ids": json.dumps(trace.get("schema_ids", [])),
+        "sql_fingerprint": fingerprint,
+        "sql_hash": sql_hash,
+        "sql_shape": shape,
+        "answer_source": final_state.get("answer_source"),
+        "response_renderer": final_state.get("response_renderer"),
+        "rows": trace.get("rows", len(results) if results is not None else None),
+        "bytes_processed": trace.get("bytes_processed"),
+        "bytes_billed": trace.get("bytes_billed"),
+        "cache_hits": json.dumps(cache_hits),
+        "node_seconds": json.dumps({node: round(seconds, 6) for node, seconds in node_seconds.items()}),
+        "total_seconds": total_seconds,
+        "repair_attempts": final_state.get("repair_attempts") or 0,
+        "few_shot_examples": final_state.get("few_shot_examples"), # None: the question never reached SQL generation
+        "timed_out": int(bool(final_state.get("timed_out"))),
+        "error": error[:_ERROR_MAX_CHARS] if error else None,
+        "llm_input_tokens": usage.get("input_tokens", 0),
+        "llm_output_tokens": usage.get("output_tokens", 0),
+        "llm_cached_tokens": usage.get("cached_tokens", 0),
+        "embedding_chars": usage.get("embedding_chars", 0),
+        "cost_usd": usage.get("cost_usd", 0.0),
+        "cost_by_node": json.dumps(usage.get("cost_by_node", {})),
+    }
+
+
+def _parquet_schema():
+    types = {"TEXT": pa.string(), "REAL": pa.float64(), "INTEGER": pa.int64()}
+    return pa.schema([(name, types[kind]) for name, kind in RECORD_COLUMNS])
+
+
+class RequestLogWriter:
+    """
+    Queues records and writes them from a background thread in batches of
+    `batch_size` (or every `flush_seconds`), so requests never wait on disk.
+    `fmt` is 'sqlite' (one table, WAL mode, shared by all server workers) or
+    'parquet' (a directory with one file per batch). A full queue drops records
+    (counted as request_log_dropped) rather than blocking.
+    """
+
+    def __init__(self, path: str, fmt: str, batch_size: int, flush_seconds: float, queue_size: int):
+        if fmt not in ("sqlite", "parquet"):
+            raise ValueError(f"Unsupported request log format '{fmt}'. Use 'sqlite' or 'parquet'.")
+        self.path = path
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=self.queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._batches = 0
+
+    def log(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-log-writer", daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            METRICS.increment("request_log_dropped")
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Writes what is queued and stops the writer thread."""
+        with self._lock:
+            thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+
+    def _run(self):
+        connection = None
+        batch: List[Dict[str, Any]] = []
+        flush_at = time.monotonic() + self.flush_seconds
+        stopping = False
+        while not stopping:
+            try:
+                record = self._queue.get(timeout=max(flush_at - time.monotonic(), 0.01))
+                if record is None:
+                    stopping = True
+                else:
+                    batch.append(record)
+            except queue.Empty:
+                pass
+            if batch and (stopping or len(batch) >= self.batch_size or time.monotonic() >= flush_at):
+                try:
+                    if self.fmt == "sqlite":
+                        connection = connection or _open_sqlite(self.path)
+                        _write_sqlite(connection, batch)
+                    else:
+                        self._write_parquet(batch)
+                    METRICS.increment("request_log_records", len(batch))
+                except Exception as e:
+                    METRICS.increment("request_log_dropped", len(batch))
+                    logger.warning("Could not write %d request log records to %s: %s", len(batch), self.path, e)
+                batch = []
+            if time.monotonic() >= flush_at:
+                flush_at = time.monotonic() + self.flush_seconds
+        if connection is not None:
+            connection.close()
+
+    def _write_parquet(self, batch: List[Dict[str, Any]]):
+        if pa is None:
+            raise RuntimeError("pyarrow is not installed")
+        os.makedirs(self.path, exist_ok=True)
+        self._batches += 1
+        name = f"requests-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{self._batches:06d}.parquet"
+        table = pa.Table.from_pylist(batch, schema=_parquet_schema())
+        pq.write_table(table, os.path.join(self.path, name + ".tmp"))
+        os.replace(os.path.join(self.path, name + ".tmp"), os.path.join(self.path, name)) # Readers never see partial files
+
+
+def _open_sqlite(path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL") # Server workers append concurrently while the CLI reads
+    columns = ", ".join(f"{name} {kind}" for name, kind in RECORD_COLUMNS)
+    connection.execute(f"CREATE TABLE IF NOT EXISTS requests ({columns})")
+    existing = {row[1] for row in connection.execute("PRAGMA table_info(requests)")}
+    for name, kind in RECORD_COLUMNS:
+        if name not in existing: # Logs written before the column was added
+            connection.execute(f"ALTER TABLE requests ADD COLUMN {name} {kind}")
+    connection.execute("CREATE INDEX IF NOT EXISTS requests_ts ON requests (ts)")
+    connection.commit()
+    return connection
+
+
+def _write_sqlite(connection: sqlite3.Connection, batch: List[Dict[str, Any]]):
+    names = [name for name, _ in RECORD_COLUMNS]
+    connection.executemany(
+        f"INSERT INTO requests ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)})",
+        [tuple(record.get(name) for name in names) for record in batch],
+    )
+    connection.commit()
+
+
+def read_records(path: str, fmt: str, since: Optional[float] = None) -> List[Dict[str, Any]]:
+    """All records (newer than the `since` timestamp), oldest first, with JSON columns decoded."""
+    if fmt == "sqlite":
+        if not os.path.exists(path):
+            return []
+        connection = sqlite3.connect(path)
+        connection.row_factory = sqlite3.Row
+        try:
+            rows = [dict(row) for row in connection.execute(
+                "SELECT * FROM requests WHERE ts >= ? ORDER BY ts", (since or 0,))]
+        finally:
+            connection.close()
+    else:
+        if pq is None:
+            raise RuntimeError("Reading a parquet request log needs pyarrow.")
+        files = sorted(name for name in os.listdir(path) if name.endswith(".parquet")) if os.path.isdir(path) else []
+        rows = [row for name in files for row in pq.read_table(os.path.join(path, name)).to_pylist()
+                if row["ts"] >= (since or 0)]
+        rows.sort(key=lambda row: row["ts"])
+    for row in rows:
+        for column in ("schema_ids", "cache_hits", "node_seconds", "cost_by_node"):
+            row[column] = json.loads(row[column]) if row.get(column) else ({} if column in ("node_seconds", "cost_by_node") else [])
+    return rows
+
+
+REQUEST_LOG = RequestLogWriter(config.REQUEST_LOG_PATH, config.REQUEST_LOG_FORMAT, config.REQUEST_LOG_BATCH_SIZE,
+                               config.REQUEST_LOG_FLUSH_SECONDS, config.REQUEST_LOG_QUEUE_SIZE)
+atexit.register(REQUEST_LOG.close) # Flush the last partial batch on a clean exit
+
+
+def _reset_after_fork():
+    # The writer thread does not survive fork(); each server worker starts its own on first use
+    REQUEST_LOG._lock = threading.Lock()
+    REQUEST_LOG._reset()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
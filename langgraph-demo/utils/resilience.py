@@ -0,0 +1,295 @@
+# /nl2sql-agent/utils/resilience.py
+
+import contextvars
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from google.api_core import exceptions as google_exceptions
+import config
+from utils.metrics import METRICS
+from utils.log import get_logger
+
+logger = get_logger(__name__)
+
+
+class CallTimeoutError(TimeoutError):
+    """Raised when an external call does not complete within its timeout."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the service while its circuit breaker is open."""
+
+
+class DeadlineExceededError(TimeoutError):
+    """Raised when the request's end-to-end deadline leaves no budget for a call."""
+
+
+class BackendBusyError(DeadlineExceededError):
+    """
+    Raised by admission control (utils/admission.py) instead of queueing when
+    the wait for a backend would outlast the request deadline, so callers stop
+    the request with a "busy" answer instead of retrying.
+    """
+
+    def __init__(self, service: str, message: str):
+        super().__init__(message)
+        self.service = service
+
+
+def remaining_seconds(deadline: Optional[float]) -> Optional[float]:
+    """Seconds left until an absolute (time.time()) deadline, or None if there is no deadline."""
+    if deadline is None:
+        return None
+    return deadline - time.time()
+
+
+class CallPolicy(NamedTuple):
+    timeout: float      # Seconds per attempt
+    max_retries: int    # Retries after the first attempt, for retryable errors only
+    hedge: bool         # Send a duplicate request after the p95 latency (idempotent calls only)
+
+
+# Per-service policies. Only idempotent calls are hedged.
+SERVICE_POLICIES: Dict[str, CallPolicy] = {
+    "llm": CallPolicy(config.LLM_TIMEOUT_SECONDS, config.EXTERNAL_CALL_MAX_RETRIES, hedge=False),
+    "embeddings": CallPolicy(config.EMBEDDING_TIMEOUT_SECONDS, config.EXTERNAL_CALL_MAX_RETRIES, hedge=True),
+    "vector_search": CallPolicy(config.VECTOR_SEARCH_TIMEOUT_SECONDS, config.EXTERNAL_CALL_MAX_RETRIES, hedge=True),
+    "model_armor": CallPolicy(config.MODEL_ARMOR_TIMEOUT_SECONDS, config.EXTERNAL_CALL_MAX_RETRIES, hedge=True),
+    "bigquery": CallPolicy(config.BIGQUERY_TIMEOUT_SECONDS, config.EXTERNAL_CALL_MAX_RETRIES, hedge=False),
+}
+
+# Transient errors worth retrying (quota, overload, transient server errors, our own timeouts)
+RETRYABLE_ERRORS: Tuple[type, ...] = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    ConnectionError,
+    CallTimeoutError,
+)
+
+# Calls run on this pool so they can be timed out and hedged. A timed-out call
+# cannot be killed; its thread finishes in the background and the result is dropped.
+_executor = ThreadPoolExecutor(max_workers=config.RESILIENCE_MAX_WORKERS, thread_name_prefix="external-call")
+
+_BREAKER_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class CircuitBreaker:
+    """
+    Classic closed -> open -> half-open breaker. After `failure_threshold`
+    consecutive failures the circuit opens and calls fail fast; after
+    `reset_timeout` seconds a single probe call is let through.
+    """
+
+    def __init__(self, service: str, failure_threshold: int, reset_timeout: float):
+        self.service = service
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._publish()
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def _publish(self):
+        METRICS.set_gauge("circuit_breaker_state", _BREAKER_STATE_VALUES[self._state], service=self.service)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == "open":
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = "half_open"
+                self._probe_in_flight = False
+                self._publish()
+            if self._state == "half_open":
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            if self._state != "closed":
+                self._state = "closed"
+                self._publish()
+
+    def release(self):
+        """Ends a call that says nothing about service health (e.g. cut short by the request deadline)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == "half_open" or self._failures >= self.failure_threshold:
+                if self._state != "open":
+                    logger.warning("Circuit breaker for '%s' opened after %d failure(s).", self.service, self._failures)
+                self._state = "open"
+                self._opened_at = time.monotonic()
+                self._publish()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    """Threads do not survive fork(): a forked worker gets its own call pool and breakers."""
+    global _executor, _breakers, _breakers_lock
+    _executor = ThreadPoolExecutor(max_workers=config.RESILIENCE_MAX_WORKERS, thread_name_prefix="external-call")
+    _breakers = {}
+    _breakers_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_breaker(service: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(service)
+        if breaker is None:
+            breaker = _breakers[service] = CircuitBreaker(
+                service, config.CIRCUIT_BREAKER_FAILURE_THRESHOLD, config.CIRCUIT_BREAKER_RESET_SECONDS
+            )
+        return breaker
+
+
+def _hedge_delay(service: str) -> Optional[float]:
+    """Delay before sending a hedged duplicate: the recent p95 latency, once enough samples exist."""
+    if METRICS.sample_count("external_call_latency_seconds", service=service) < config.HEDGE_MIN_SAMPLES:
+        return None
+    return METRICS.percentile("external_call_latency_seconds", config.HEDGE_PERCENTILE, service=service)
+
+
+def _run_attempt(service: str, fn: Callable, args: tuple, kwargs: dict, timeout: float, hedge: bool) -> Any:
+    """One attempt: runs fn with a timeout, sending a hedged duplicate after the p95 delay if enabled."""
+    start = time.monotonic()
+    end = start + timeout
+    hedge_delay = _hedge_delay(service) if hedge else None
+    hedge_at = start + hedge_delay if hedge_delay is not None else None
+
+    def queued_call():
+        # Time spent waiting for a free worker: grows once concurrent calls exceed RESILIENCE_MAX_WORKERS
+        METRICS.observe("external_call_queue_seconds", time.monotonic() - submitted_at, service=service)
+        return fn(*args, **kwargs)
+
+    submitted_at = time.monotonic()
+    # Each attempt runs in a copy of the caller's context, so log fields, the usage ledger and the
+    # request log annotations (all contextvars) reach the backend call; a context runs in one thread at a time
+    primary = _executor.submit(contextvars.copy_context().run, queued_call)
+    pending = {primary}
+    hedged = False
+    last_error: Optional[BaseException] = None
+    while pending:
+        now = time.monotonic()
+        if now >= end:
+            break
+        wait_for = end - now
+        if hedge_at is not None and not hedged:
+            wait_for = min(wait_for, max(0.0, hedge_at - now))
+        done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+        for future in done:
+            error = future.exception()
+            if error is None:
+                METRICS.observe("external_call_latency_seconds", time.monotonic() - start, service=service)
+                if future is not primary:
+                    METRICS.increment("external_call_hedge_wins", service=service)
+                return future.result()
+            last_error = error
+        if pending and not hedged and hedge_at is not None and time.monotonic() >= hedge_at:
+            hedged = True
+            METRICS.increment("external_call_hedges", service=service)
+            pending.add(_executor.submit(contextvars.copy_context().run, fn, *args, **kwargs))
+
+    if last_error is not None and not pending:
+        raise last_error
+    METRICS.increment("external_call_timeouts", service=service)
+    raise CallTimeoutError(f"{service} call did not complete within {timeout:.1f}s")
+
+
+def call_with_resilience(service: str, fn: Callable, args: tuple = (), kwargs: Optional[dict] = None,
+                         timeout: Optional[float] = None, deadline: Optional[float] = None) -> Any:
+    """
+    Calls an external service with the policy configured for `service`:
+    per-attempt timeout, retries with exponential backoff and full jitter for
+    retryable errors, optional hedging, and a circuit breaker that fails fast
+    (CircuitOpenError) while the service is unhealthy so callers can degrade.
+
+    `timeout` overrides the policy timeout for this call. `deadline` is the
+    request's absolute deadline (time.time() based): attempts and backoff
+    sleeps never run past it, and DeadlineExceededError is raised once it passes.
+    Each attempt first passes the backend's admission control, which raises
+    BackendBusyError if the queue wait would outlast the deadline.
+    """
+    from utils.admission import admit, backend_saturated # Imported here: utils.admission imports this module's errors
+    policy = SERVICE_POLICIES[service]
+    kwargs = kwargs or {}
+    call_timeout = policy.timeout if timeout is None else min(policy.timeout, timeout)
+    breaker = get_breaker(service)
+    METRICS.increment("external_calls", service=service)
+
+    for attempt in range(policy.max_retries + 1):
+        budget = remaining_seconds(deadline)
+        if budget is not None and budget <= 0:
+            METRICS.increment("deadline_exceeded", service=service)
+            raise DeadlineExceededError(f"Request deadline passed before the {service} call.")
+
+        if not breaker.allow():
+            METRICS.increment("circuit_breaker_rejections", service=service)
+            raise CircuitOpenError(f"Circuit breaker for '{service}' is open; failing fast.")
+        try:
+            with admit(service, deadline): # May wait in the backend's fair queue, or raise BackendBusyError
+                budget = remaining_seconds(deadline)
+                attempt_timeout = call_timeout if budget is None else min(call_timeout, max(budget, 0.0))
+                capped_by_deadline = attempt_timeout < call_timeout
+                # No hedged duplicates while callers queue for this backend: they would only add load
+                result = _run_attempt(service, fn, args, kwargs, attempt_timeout, policy.hedge and not backend_saturated(service))
+        except BackendBusyError:
+            breaker.release()
+            raise
+        except CallTimeoutError as e:
+            if capped_by_deadline:
+                # Cut short by our own budget, not by a slow service: no breaker failure, no retry.
+                breaker.release()
+                METRICS.increment("deadline_exceeded", service=service)
+                raise DeadlineExceededError(f"Request deadline passed during the {service} call.") from e
+            error = e
+        except RETRYABLE_ERRORS as e:
+            error = e
+        except Exception as e:
+            # The service answered (e.g. invalid request): not a health problem, so no breaker failure.
+            breaker.record_success()
+            METRICS.increment("external_call_errors", service=service, error=type(e).__name__)
+            raise
+        else:
+            breaker.record_success()
+            return result
+
+        breaker.record_failure()
+        METRICS.increment("external_call_errors", service=service, error=type(error).__name__)
+        if attempt == policy.max_retries:
+            raise error
+        delay = random.uniform(0, min(config.RETRY_MAX_DELAY_SECONDS, config.RETRY_BASE_DELAY_SECONDS * (2 ** attempt)))
+        budget = remaining_seconds(deadline)
+        if budget is not None and delay >= budget:
+            raise error # No budget left for another attempt
+        logger.warning("%s call failed (%s: %s). Retry %d/%d in %.2fs.", service, type(error).__name__, error, attempt + 1,
+                       policy.max_retries, delay)
+        METRICS.increment("external_call_retries", service=service)
+        time.sleep(delay)
@@ -0,0 +1,84 @@
+# /nl2sql-agent/utils/single_flight.py
+
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import config
+from utils.metrics import METRICS
+from utils.request_log import record_coalesced
+from utils.resilience import DeadlineExceededError, remaining_seconds
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: the first caller with a key (the
+    leader) runs the function, and callers arriving with the same key while it
+    runs wait for its result (or exception) instead of repeating the work.
+    Nothing is cached: once the leader finishes, the next caller runs again.
+    """
+
+    def __init__(self, group: str):
+        self.group = group
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        # In-flight calls belong to the parent's threads
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.group in {name.strip() for name in config.SINGLE_FLIGHT_GROUPS.split(",")}
+
+    def do(self, key: Hashable, fn: Callable[[], Any], deadline: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        Returns (result, shared), where `shared` is True if another caller's
+        run produced the result. Shared results are the same objects for every
+        caller, so treat them as read-only. A follower waits at most until its
+        own `deadline`; if the leader ran out of its own time, a follower with
+        time left leads a fresh call.
+        """
+        if not self.enabled:
+            return fn(), False
+        METRICS.increment("single_flight_calls", group=self.group)
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+            if leader:
+                try:
+                    flight.result = fn()
+                    return flight.result, False
+                except BaseException as e:
+                    flight.error = e
+                    raise
+                finally:
+                    with self._lock:
+                        del self._flights[key]
+                    flight.done.set()
+
+            budget = remaining_seconds(deadline)
+            if not flight.done.wait(timeout=None if budget is None else max(budget, 0.0)):
+                raise DeadlineExceededError(f"Request deadline passed while waiting for a coalesced {self.group} call.")
+            budget = remaining_seconds(deadline)
+            if isinstance(flight.error, DeadlineExceededError) and (budget is None or budget > 0):
+                continue
+            METRICS.increment("single_flight_coalesced", group=self.group)
+            record_coalesced(self.group)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
@@ -0,0 +1,109 @@
+# /nl2sql-agent/utils/tenants.py
+
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+import config
+
+# Tenants served by one process. The default tenant (ADMISSION_DEFAULT_TENANT) is the flat GCP/BigQuery
+# configuration in config.py; TENANTS adds others, each with its own dataset and schema descriptions.
+_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$") # Tenant names become part of file names and datapoint IDs
+
+
+class UnknownTenantError(ValueError):
+    """A request named a tenant that is not configured."""
+
+
+class Tenant:
+    """
+    One business unit: the BigQuery project and dataset its questions run
+    against, the company named in answers, its schema descriptions JSON, its
+    embeddings (local vector backend) and Vector Search endpoint, and the
+    admission limits on its concurrent requests (empty: not limited).
+    """
+
+    def __init__(self, name: str, project: str, dataset: str, company: str, schema_uri: str, embeddings_uri: str,
+                 index_endpoint: str, deployed_index_id: str, limits: Dict[str, float]):
+        self.name = name
+        self.project = project
+        self.dataset = dataset
+        self.company = company
+        self.schema_uri = schema_uri
+        self.embeddings_uri = embeddings_uri
+        self.index_endpoint = index_endpoint
+        self.deployed_index_id = deployed_index_id
+        self.limits = limits
+
+    @property
+    def is_default(self) -> bool:
+        return self.name == config.ADMISSION_DEFAULT_TENANT
+
+    def table_name(self, table: str) -> str:
+        """The fully qualified BigQuery name of one of the tenant's tables."""
+        return f"{self.project}.{self.dataset}.{table}"
+
+
+def _build_tenants(settings_by_name: Dict[str, Dict[str, Any]]) -> Dict[str, Tenant]:
+    default = Tenant(
+        config.ADMISSION_DEFAULT_TENANT, config.GCP_PROJECT_ID, config.BIGQUERY_DATASET_ID, config.COMPANY,
+        config.SCHEMA_LOOKUP_GCS_URI, config.EMBEDDINGS_GCS_JSONL_PATH, config.VECTOR_SEARCH_INDEX_ENDPOINT_NAME,
+        config.VECTOR_SEARCH_DEPLOYED_INDEX_ID, config.TENANT_DEFAULT_LIMITS,
+    )
+    tenants = {default.name: default}
+    for name, settings in settings_by_name.items():
+        if not _NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid tenant name '{name}' in TENANTS: use letters, digits, '_' and '-'.")
+        if name != default.name and not (settings.get("dataset") and settings.get("schema_uri")):
+            raise ValueError(f"Tenant '{name}' in TENANTS needs a 'dataset' and a 'schema_uri'.")
+        base = tenants.get(name, default) # Settings for the default tenant override the flat configuration
+        tenants[name] = Tenant(
+            name,
+            settings.get("project", base.project),
+            settings.get("dataset", base.dataset),
+            settings.get("company", base.company),
+            settings.get("schema_uri", base.schema_uri),
+            settings.get("embeddings_uri", base.embeddings_uri), # Shared by default; search over-fetches, then filters
+            settings.get("index_endpoint", base.index_endpoint),
+            settings.get("deployed_index_id", base.deployed_index_id),
+            settings.get("limits", config.TENANT_DEFAULT_LIMITS),
+        )
+    return tenants
+
+
+TENANTS: Dict[str, Tenant] = _build_tenants(config.TENANTS)
+
+
+def get_tenant(name: Optional[str] = None) -> Tenant:
+    """The named tenant (the default tenant if None). Raises UnknownTenantError if it is not configured."""
+    tenant = TENANTS.get(name or config.ADMISSION_DEFAULT_TENANT)
+    if tenant is None:
+        raise UnknownTenantError(f"Unknown tenant '{name}'.")
+    return tenant
+
+
+def all_tenants() -> List[Tenant]:
+    return list(TENANTS.values())
+
+
+def is_multi_tenant() -> bool:
+    """Whether tenants share this process (and Vector Search queries must filter by tenant)."""
+    return len(TENANTS) > 1
+
+
+def tenant_key(tenant: Optional[str], key: str) -> str:
+    """
+    `key` (a session ID, a schema datapoint ID, ...) namespaced by tenant. The
+    default tenant keeps bare keys, so single-tenant deployments are unchanged.
+    """
+    name = tenant or config.ADMISSION_DEFAULT_TENANT
+    return key if name == config.ADMISSION_DEFAULT_TENANT else f"{name}:{key}"
+
+
+def tenant_path(path: str, tenant: Optional[str]) -> str:
+    """A per-tenant local file next to `path` ("few_shot_examples.sqlite" -> "few_shot_examples.acme.sqlite")."""
+    name = tenant or config.ADMISSION_DEFAULT_TENANT
+    if not path or name == config.ADMISSION_DEFAULT_TENANT:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.{name}{extension}"
@@ -0,0 +1,143 @@
+# /nl2sql-agent/utils/usage.py
+
+import contextlib
+import contextvars
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional
+
+import config
+from utils.metrics import METRICS
+
+# Rough prompt size before a call: Gemini averages about 4 characters per token for English text and SQL
+CHARS_PER_TOKEN = 4
+_BYTES_PER_TIB = 1024 ** 4
+
+_LEDGER: contextvars.ContextVar[Optional["UsageLedger"]] = contextvars.ContextVar("usage_ledger", default=None)
+
+
+class BudgetExceededError(RuntimeError):
+    """Raised before a paid call that would break a token or cost budget (LLM_MAX_PROMPT_TOKENS, REQUEST_MAX_*)."""
+
+
+class UsageLedger:
+    """
+    What one request consumed: LLM tokens (prompt, completion, cached),
+    embedding characters and BigQuery bytes billed, each attributed to the
+    graph node and model that used it, with an estimated cost in USD.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.entries: List[Dict[str, Any]] = []
+
+    def add(self, kind: str, node: str, model: str, cost_usd: float, **quantities: int) -> None:
+        with self._lock:
+            self.entries.append({"kind": kind, "node": node, "model": model, "cost_usd": cost_usd, **quantities})
+
+    def total(self, field: str) -> float:
+        with self._lock:
+            return sum(entry.get(field, 0) for entry in self.entries)
+
+    def summary(self) -> Dict[str, Any]:
+        """Totals for the request, plus cost per node and per model."""
+        with self._lock:
+            entries = list(self.entries)
+        by_node, by_model = defaultdict(float), defaultdict(float)
+        for entry in entries:
+            by_node[entry["node"]] += entry["cost_usd"]
+            by_model[entry["model"]] += entry["cost_usd"]
+        return {
+            "llm_calls": sum(1 for entry in entries if entry["kind"] == "llm"),
+            "input_tokens": sum(entry.get("input_tokens", 0) for entry in entries),
+            "output_tokens": sum(entry.get("output_tokens", 0) for entry in entries),
+            "cached_tokens": sum(entry.get("cached_tokens", 0) for entry in entries),
+            "embedding_chars": sum(entry.get("chars", 0) for entry in entries),
+            "bytes_billed": sum(entry.get("bytes_billed", 0) for entry in entries),
+            "cost_usd": round(sum(entry["cost_usd"] for entry in entries), 8),
+            "cost_by_node": {node: round(cost, 8) for node, cost in by_node.items()},
+            "cost_by_model": {model: round(cost, 8) for model, cost in by_model.items()},
+        }
+
+
+@contextlib.contextmanager
+def request_usage() -> Iterator[UsageLedger]:
+    """Collects the usage of one request (graph nodes run in copies of this context)."""
+    ledger = UsageLedger()
+    token = _LEDGER.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _LEDGER.reset(token)
+
+
+def llm_cost_usd(model: str, input_tokens: int, output_tokens: int, cached_tokens: int = 0) -> float:
+    """Cost of one call; cached prompt tokens are billed at LLM_CACHED_INPUT_PRICE_RATIO of the input price."""
+    input_price, output_price = config.LLM_PRICES_PER_MILLION_TOKENS.get(model, (0.0, 0.0))
+    uncached = max(input_tokens - cached_tokens, 0)
+    return (uncached * input_price + cached_tokens * input_price * config.LLM_CACHED_INPUT_PRICE_RATIO
+            + output_tokens * output_price) / 1_000_000
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def check_llm_budget(node: str, prompt_tokens: int) -> None:
+    """Raises BudgetExceededError if a call with this prompt would break a budget; a no-op for unset budgets."""
+    reason = None
+    if config.LLM_MAX_PROMPT_TOKENS and prompt_tokens > config.LLM_MAX_PROMPT_TOKENS:
+        reason = f"the prompt for {node} is about {prompt_tokens} tokens, above the {config.LLM_MAX_PROMPT_TOKENS} token limit"
+    ledger = _LEDGER.get()
+    if reason is None and ledger is not None:
+        used = ledger.total("input_tokens") + ledger.total("output_tokens")
+        if config.REQUEST_MAX_LLM_TOKENS and used + prompt_tokens > config.REQUEST_MAX_LLM_TOKENS:
+            reason = f"the request has used {used} LLM tokens and {node} would exceed its {config.REQUEST_MAX_LLM_TOKENS} token budget"
+    if reason is None:
+        check_cost_budget(node)
+        return
+    METRICS.increment("budget_rejections", node=node, budget="tokens")
+    raise BudgetExceededError(f"Request rejected: {reason}.")
+
+
+def check_cost_budget(node: str) -> None:
+    """Raises BudgetExceededError once the request has spent REQUEST_MAX_COST_USD (no further paid calls)."""
+    ledger = _LEDGER.get()
+    if not config.REQUEST_MAX_COST_USD or ledger is None:
+        return
+    spent = ledger.total("cost_usd")
+    if spent >= config.REQUEST_MAX_COST_USD:
+        METRICS.increment("budget_rejections", node=node, budget="cost")
+        raise BudgetExceededError(f"Request rejected: it has spent ${spent:.6f} of its ${config.REQUEST_MAX_COST_USD:.6f} budget, "
+                                  f"before {node}.")
+
+
+def record_llm(node: str, model: str, usage: Dict[str, Any]) -> float:
+    """Records one LLM response's usage metadata (LangChain usage_metadata); returns its cost."""
+    input_tokens, output_tokens = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+    cost = llm_cost_usd(model, input_tokens, output_tokens, cached_tokens)
+    METRICS.increment("llm_tokens", input_tokens, node=node, model=model, kind="input")
+    METRICS.increment("llm_tokens", output_tokens, node=node, model=model, kind="output")
+    METRICS.increment("llm_tokens", cached_tokens, node=node, model=model, kind="cached")
+    METRICS.increment("llm_cost_usd", cost, node=node, model=model)
+    ledger = _LEDGER.get()
+    if ledger is not None:
+        ledger.add("llm", node, model, cost, input_tokens=input_tokens, output_tokens=output_tokens, cached_tokens=cached_tokens)
+    return cost
+
+
+def record_embedding(node: str, chars: int) -> None:
+    cost = chars * config.EMBEDDING_PRICE_PER_MILLION_CHARS / 1_000_000
+    METRICS.increment("embedding_chars", chars, node=node, model=config.EMBEDDING_MODEL_NAME)
+    ledger = _LEDGER.get()
+    if ledger is not None:
+        ledger.add("embeddings", node, config.EMBEDDING_MODEL_NAME, cost, chars=chars)
+
+
+def record_bigquery(node: str, bytes_billed: int) -> None:
+    cost = bytes_billed * config.BIGQUERY_PRICE_PER_TIB / _BYTES_PER_TIB
+    METRICS.increment("bigquery_bytes_billed", bytes_billed, node=node)
+    ledger = _LEDGER.get()
+    if ledger is not None:
+        ledger.add("bigquery", node, "bigquery", cost, bytes_billed=bytes_billed)